@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Approximate nearest neighbor search over user rating vectors with an
+inverted file index. Every user row is mean centered and scaled to unit
+length, the rows are grouped into clusters by spherical k-means and every
+cluster keeps the list of its users. A query only scores the users of the
+clusters closest to it with the exact metric, so the cost of a query is
+the size of the lists it probes instead of every user.
+"""
+import numpy as np
+from Neighbors import LARGER_IS_CLOSER, candidateDistances, checkMissingPolicy
+from Support import shrinkScores
+from TopN import selectTop
+
+#------------------------------------------------------------------------------
+#Start of AnnIndex class
+class AnnIndex:
+    def __init__(self, ratings, clusters=None, probes=4, missing='absent', iterations=10,
+                 sample=20000, seed=0, userBlockSize=1024):
+        '''Indexes every user of a RatingMatrix.
+        param clusters is the number of clusters, None uses the square root of
+        the number of users
+        param probes is the number of clusters closest to a query that are
+        searched, the recall and speed knob. It can be changed at any time.
+        param missing is the missing value policy of the metric, see
+        Neighbors.MISSING_POLICIES. With 'absent' the rated items are centered
+        on the user's average, with 'zero' the whole row with the missing
+        ratings read as 0 is centered, which matches what each metric compares.
+        param iterations and sample are the k-means iterations and the number
+        of users, picked with seed, the clusters are trained on
+        Users are assigned userBlockSize at a time with one matrix product.'''
+        self.ratings = ratings
+        self.missing = checkMissingPolicy(missing)
+        self.probes = probes
+        self.userBlockSize = userBlockSize
+        if clusters is None:
+            clusters = max(int(round(np.sqrt(ratings.numUsers))), 1)
+        rng = np.random.default_rng(seed)
+        trainUsers = np.sort(rng.choice(ratings.numUsers, min(sample, ratings.numUsers),
+                                        replace=False))
+        self.centroids = self.trainCentroids(trainUsers, min(clusters, len(trainUsers)),
+                                             iterations, rng)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self.numUsers = 0
+        self.fallbacks = 0
+        self.lists = [[] for cluster in range(len(self.centroids))]
+        for start in range(0, ratings.numUsers, userBlockSize):
+            stop = min(start + userBlockSize, ratings.numUsers)
+            self._insert(np.arange(start, stop), self.nearestClusters(
+                self.blockVectors(np.arange(start, stop)), 1)[:, 0])
+
+    @classmethod
+    def fromState(cls, ratings, arrays, probes=4, missing='absent', userBlockSize=1024):
+        '''Rebuilds a trained index from the arrays of state without training
+        it again. The centroids are used as they are, they can be read only.'''
+        index = cls.__new__(cls)
+        index.ratings = ratings
+        index.missing = checkMissingPolicy(missing)
+        index.probes = probes
+        index.userBlockSize = userBlockSize
+        index.centroids = arrays['centroids']
+        index._assignments = np.array(arrays['assignments'], dtype=np.int32)
+        index.numUsers = len(index._assignments)
+        index.fallbacks = 0
+        order = np.argsort(index._assignments, kind='stable')
+        sizes = np.bincount(index._assignments, minlength=len(index.centroids))
+        index.lists = [users.tolist() for users in np.split(order, np.cumsum(sizes)[:-1])]
+        return index
+
+    def state(self):
+        '''The arrays that fromState needs, the centroids and the cluster of
+        every user'''
+        return {'centroids': self.centroids, 'assignments': self.assignments}
+
+    @property
+    def assignments(self):
+        '''Cluster of every indexed user'''
+        return self._assignments[:self.numUsers]
+
+    def unitRows(self, block, mask):
+        '''Centers a dense block of rows following self.missing and scales
+        every row to unit length, rows without ratings stay 0'''
+        counts = mask.sum(axis=1)
+        if self.missing == 'zero':
+            block -= (block.sum(axis=1) / max(block.shape[1], 1))[:, None]
+        else:
+            means = np.divide(block.sum(axis=1), counts, out=np.zeros(len(block)),
+                              where=counts > 0)
+            block -= means[:, None]
+            block[~mask] = 0.0
+        norms = np.sqrt((block * block).sum(axis=1))
+        block /= np.where(norms > 0, norms, 1.0)[:, None]
+        return block
+
+    def blockVectors(self, userIDs):
+        '''Unit rows of the indexed users userIDs'''
+        if len(userIDs) and userIDs[-1] - userIDs[0] == len(userIDs) - 1:
+            block, mask = self.ratings.denseBlock(userIDs[0], userIDs[-1] + 1)
+            return self.unitRows(block, mask)
+        return self.vectors([self.ratings.userRow(userID) for userID in userIDs])
+
+    def vectors(self, rows):
+        '''Unit rows of a list of (item ids, ratings) rows'''
+        block = np.zeros((len(rows), self.ratings.numItems))
+        mask = np.zeros(block.shape, dtype=bool)
+        for (r, (items, values)) in enumerate(rows):
+            block[r, items] = values
+            mask[r, items] = True
+        return self.unitRows(block, mask)
+
+    def trainCentroids(self, userIDs, clusters, iterations, rng):
+        '''Spherical k-means on the unit rows of userIDs. Returns a clusters x
+        numItems array of unit centroids. The rows are made userBlockSize
+        users at a time so only one dense block is held.'''
+        centroids = self.blockVectors(np.sort(rng.choice(userIDs, clusters, replace=False)))
+        for iteration in range(iterations):
+            sums = np.zeros(centroids.shape)
+            for start in range(0, len(userIDs), self.userBlockSize):
+                vectors = self.blockVectors(userIDs[start:start + self.userBlockSize])
+                assigned = np.argmax(vectors @ centroids.T, axis=1)
+                members = np.zeros((len(vectors), len(centroids)))
+                members[np.arange(len(vectors)), assigned] = 1.0
+                sums += members.T @ vectors
+            norms = np.sqrt((sums * sums).sum(axis=1))
+            #An empty cluster keeps its centroid.
+            filled = norms > 0
+            centroids[filled] = sums[filled] / norms[filled][:, None]
+        return centroids
+
+    def nearestClusters(self, vectors, probes):
+        '''The probes closest clusters of every unit row, closest first'''
+        if self.centroids.shape[1] < vectors.shape[1]:
+            #Items added after training have no weight in any centroid.
+            self.centroids = np.pad(self.centroids,
+                                    ((0, 0), (0, vectors.shape[1] - self.centroids.shape[1])))
+        scores = vectors @ self.centroids.T
+        return np.argsort(-scores, axis=1, kind='stable')[:, :probes]
+
+    def _insert(self, userIDs, clusters):
+        if len(userIDs) == 0:
+            return
+        if userIDs.max() >= len(self._assignments):
+            capacity = max(int(userIDs.max()) + 1, 2 * len(self._assignments))
+            buffer = np.zeros(capacity, dtype=np.int32)
+            buffer[:self.numUsers] = self.assignments
+            self._assignments = buffer
+        for (userID, cluster) in zip(userIDs.tolist(), clusters.tolist()):
+            self.lists[cluster].append(userID)
+        self._assignments[userIDs] = clusters
+        self.numUsers = max(self.numUsers, int(userIDs.max()) + 1)
+
+    def update(self, userID):
+        '''Assigns a user again after their ratings changed, users that are
+        new to the ratings are inserted. The clusters are not retrained.'''
+        if userID < self.numUsers:
+            self.lists[self.assignments[userID]].remove(userID)
+            userIDs = np.array([userID])
+        else:
+            #Users added without ratings in between are inserted too.
+            userIDs = np.arange(self.numUsers, userID + 1)
+        self._insert(userIDs, self.nearestClusters(self.blockVectors(userIDs), 1)[:, 0])
+
+    def candidates(self, clusters):
+        '''Sorted ids of the users in clusters'''
+        found = [self.lists[cluster] for cluster in clusters if self.lists[cluster]]
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate(found))
+
+    def query(self, rows, k, metric, missing=None, exclude=None, support=None, min_overlap=1,
+              shrinkage=0.0, fallback=True):
+        '''Approximate k nearest users of a list of (item ids, ratings) rows.
+        The users of the self.probes closest clusters are scored with the
+        exact metric, see Neighbors.candidateDistances, and the k best kept
+        with ties in user id order like the exact search. missing defaults to
+        the policy of the index. exclude is an optional user id per row to
+        leave out, the querying user. A row with fewer than k candidates is
+        searched exactly and counted in self.fallbacks, without fallback it
+        keeps the candidates it has. Returns one (user ids, distances) pair
+        per row.
+        param support is an optional Support.SupportCounts of the users, the
+        candidates that share fewer than min_overlap items with the user in
+        exclude are dropped before they are scored and the distances are
+        shrunk by the overlap, see Support.shrinkScores.'''
+        if missing is None:
+            missing = self.missing
+        results = []
+        probed = self.nearestClusters(self.vectors(rows), self.probes)
+        for (r, row) in enumerate(rows):
+            candidates = self.candidates(probed[r])
+            skip = None if exclude is None else exclude[r]
+            if skip is not None:
+                candidates = candidates[candidates != skip]
+            if support is not None:
+                overlap = support.lookup(skip, candidates)
+                candidates = candidates[overlap >= min_overlap]
+                overlap = overlap[overlap >= min_overlap]
+            if len(candidates) < k and fallback:
+                self.fallbacks += 1
+                if support is not None:
+                    candidates, overlap = support.candidates(skip, min_overlap)
+                else:
+                    candidates = np.arange(self.ratings.numUsers)
+                    if skip is not None:
+                        candidates = np.delete(candidates, skip)
+            distances = candidateDistances(self.ratings, row, candidates, metric, missing)
+            if support is not None:
+                distances = shrinkScores(distances, overlap, shrinkage, LARGER_IS_CLOSER[metric])
+            top = selectTop(distances, k, LARGER_IS_CLOSER[metric])
+            results.append((candidates[top], distances[top]))
+        return results
+
+    def stats(self):
+        '''Number of users and clusters, the mean and largest list size and
+        the number of queries searched exactly for lack of candidates'''
+        sizes = [len(users) for users in self.lists]
+        return {'users': self.numUsers, 'clusters': len(sizes),
+                'meanList': float(np.mean(sizes)) if sizes else 0.0,
+                'largestList': max(sizes, default=0), 'fallbacks': self.fallbacks}
+#End of AnnIndex class
+#------------------------------------------------------------------------------
+
+def recallAtK(exact, approximate):
+    '''Fraction of the exact neighbor ids found by the approximate search,
+    over lists of id arrays of the same queries'''
+    found = sum(len(np.intersect1d(e, a)) for (e, a) in zip(exact, approximate))
+    total = sum(len(e) for e in exact)
+    return found / total if total else 1.0
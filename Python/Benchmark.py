@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Times the training and prediction paths of Recommender on synthetic rating
+matrices and on the bundled data files. Run from the Python folder:
+
+    python Benchmark.py --sizes small medium --output results.json
+    python Benchmark.py --compare old.json results.json
+    python Benchmark.py --precision --bundled L_MovieData
+    python Benchmark.py --ann --sizes large --bundled L_MovieData
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+from AnnIndex import AnnIndex, recallAtK
+from Evaluation import foldAssignments, scoreMethod, splitRatings
+from ItemSimilarity import SIMILARITY_LEVELS, ItemNeighbors
+from RatingMatrix import RatingMatrix
+from RatingsLoader import readWideCsv
+from Recommender import Recommender
+from Neighbors import LARGER_IS_CLOSER, MISSING_POLICIES, userDistances
+from SlopeOne import STORAGE_LEVELS, SlopeOneModel
+from TopN import selectTop
+
+DATA_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+
+#(users, items, density) of the synthetic sizes
+SIZES = {'small': (200, 300, 0.05),
+         'medium': (1000, 1700, 0.06),
+         'large': (5000, 4000, 0.02)}
+
+#Bundled files and their encodings
+BUNDLED = {'Band_Ratings': ('Band_Ratings.csv', 'utf-8'),
+           'Movie_Ratings': ('Movie_Ratings.csv', 'utf-8'),
+           'L_MovieData': ('L_MovieData.csv', 'latin-1')}
+
+#Probes of the AnnIndex settings benchmarkAnn compares
+ANN_PROBES = [1, 2, 4, 8, 16]
+
+def syntheticRatings(numUsers, numItems, density, seed=0, alpha=1.0, minR=1, maxR=5):
+    '''Returns a seeded RatingMatrix shaped like MovieLens.
+    Item popularity follows a power law with exponent alpha so a few items
+    get most of the ratings. The number of ratings per user is drawn around
+    density * numItems and every user has at least one. The items of a user
+    are drawn by popularity without replacement, see sampleItems, so the
+    density of the result is the one asked for up to the draw of the counts.
+    Ratings are a user bias plus an item bias plus noise, rounded to whole
+    numbers in minR..maxR.'''
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, numItems + 1)**alpha
+    popularity = popularity[rng.permutation(numItems)]
+    popularity /= popularity.sum()
+    counts = np.clip(rng.poisson(density * numItems, numUsers), 1, numItems)
+    userIDs = np.repeat(np.arange(numUsers), counts)
+    itemIDs = sampleItems(rng, counts, popularity)
+    userBias = rng.normal(0.0, 0.5, numUsers)
+    itemBias = rng.normal(0.0, 0.7, numItems)
+    ratings = ((minR + maxR) / 2.0 + userBias[userIDs] + itemBias[itemIDs]
+               + rng.normal(0.0, 0.8, len(userIDs)))
+    ratings = np.clip(np.round(ratings), minR, maxR)
+    users = ['u' + str(user) for user in range(numUsers)]
+    items = ['i' + str(item) for item in range(numItems)]
+    return RatingMatrix.fromTriplets(users, items, userIDs, itemIDs, ratings)
+
+def sampleItems(rng, counts, popularity, blockEntries=1 << 22):
+    '''Draws counts[u] distinct item ids for every user u, weighted by
+    popularity like one rng.choice(replace=False, p=popularity) per user.
+    Every item gets the key Exponential(1) / popularity and the items with
+    the smallest keys are taken. Users are drawn a block at a time with
+    about blockEntries keys per block. Returns the ids of all users, sorted
+    within each user.'''
+    numItems = len(popularity)
+    blockSize = max(1, blockEntries // numItems)
+    blocks = []
+    for start in range(0, len(counts), blockSize):
+        rowCounts = counts[start:start + blockSize]
+        keys = rng.exponential(size=(len(rowCounts), numItems)) / popularity
+        most = int(rowCounts.max())
+        if most < numItems:
+            candidates = np.argpartition(keys, most - 1, axis=1)[:, :most]
+        else:
+            candidates = np.broadcast_to(np.arange(numItems), keys.shape)
+        order = np.argsort(np.take_along_axis(keys, candidates, axis=1), axis=1)
+        chosen = np.take_along_axis(candidates, order, axis=1)
+        chosen = np.where(np.arange(most) < rowCounts[:, None], chosen, numItems)
+        chosen.sort(axis=1)
+        blocks.append(chosen[chosen < numItems])
+    if not blocks:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(blocks)
+
+def bundledRatings(name):
+    '''Loads one of the bundled data files as a RatingMatrix'''
+    (filename, encoding) = BUNDLED[name]
+    return readWideCsv(os.path.join(DATA_FOLDER, filename), encoding=encoding)
+
+def measure(fn, memory=True):
+    '''Runs fn once for the time and, with memory, once more under tracemalloc
+    for the peak number of bytes allocated. Returns (seconds, peak bytes).'''
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+def benchmarkRatings(name, ratings, queries=50, k=5, memory=True, seed=0):
+    '''Times every training and prediction path on ratings. Prediction paths
+    are timed over queries users picked with seed. Returns a list of result
+    dictionaries.'''
+    rng = np.random.default_rng(seed)
+    users = [ratings.users[user] for user in
+             rng.choice(ratings.numUsers, min(queries, ratings.numUsers), replace=False)]
+    recommender = Recommender(ratings, min(k, max(ratings.numUsers - 1, 1)), 'pearson', 5)
+    userRatings = [recommender.data[user] for user in users]
+
+    def trainSlopeOne():
+        recommender.computeDeviations()
+
+    def trainCosine():
+        recommender.computeAverages()
+        recommender.computeSimilarityMatrix()
+
+    def nearest():
+        for user in users:
+            recommender.computeNearestNeighbor(user)
+
+    def knn():
+        for user in users:
+            try:
+                recommender.recommend(user)
+            except ZeroDivisionError:
+                pass
+
+    def slopeOne():
+        for ratingsOfUser in userRatings:
+            recommender.weightedSlopeOne(ratingsOfUser)
+
+    def cosine():
+        for ratingsOfUser in userRatings:
+            recommender.cosineSimPredict(dict(ratingsOfUser))
+
+    cases = [('computeDeviations', trainSlopeOne, ratings.nnz, 'ratings'),
+             ('computeSimilarityMatrix', trainCosine, ratings.nnz, 'ratings'),
+             ('computeNearestNeighbor', nearest, len(users), 'users'),
+             ('recommend', knn, len(users), 'users'),
+             ('weightedSlopeOne', slopeOne, len(users), 'users'),
+             ('cosineSimPredict', cosine, len(users), 'users')]
+    results = []
+    for (operation, fn, count, unit) in cases:
+        seconds, peak = measure(fn, memory)
+        results.append({'dataset': name, 'users': ratings.numUsers,
+                        'items': ratings.numItems, 'ratings': ratings.nnz,
+                        'density': ratings.nnz / (ratings.numUsers * ratings.numItems),
+                        'operation': operation, 'seconds': seconds,
+                        'throughput': count / seconds if seconds > 0 else None,
+                        'unit': unit + '/s', 'peakBytes': peak})
+    return results
+
+def benchmarkPrecision(name, ratings, testFraction=0.2, seed=0, neighbors=50,
+                       scale=(1, 5), batchSize=256):
+    '''Trains the Slope One and cosine models at every storage precision on a
+    hold-out split of ratings and scores the held out ratings. Returns a list
+    of result dictionaries with the model bytes, MAE, RMSE and coverage of
+    each precision and the largest prediction difference from the float64
+    model. The cosine models are also pruned to neighbors per item.'''
+    assignment = foldAssignments(ratings.nnz, seed=seed, testFraction=testFraction)[0]
+    train, testUsers, testItems, testRatings = splitRatings(ratings, assignment, 0)
+    users, rows = np.unique(testUsers, return_inverse=True)
+    averages = train.userAverages()
+    models = [('slopeone', deviationDtype + '/' + frequencyDtype,
+               lambda d=deviationDtype, f=frequencyDtype:
+               SlopeOneModel.fromRatings(train, deviationDtype=d, frequencyDtype=f))
+              for (deviationDtype, frequencyDtype) in STORAGE_LEVELS]
+    for size in (None, neighbors):
+        models.extend(('cosine' if size is None else 'cosine:' + str(size), dtype,
+                       lambda s=size, d=dtype:
+                       ItemNeighbors.fromRatings(train, averages, s, similarityDtype=d))
+                      for dtype in SIMILARITY_LEVELS)
+    results = []
+    reference = {}
+    for (method, storage, build) in models:
+        model = build()
+        nbytes = (model.nbytes if isinstance(model, ItemNeighbors)
+                  else model.deviationSums.nbytes + model.frequencies.nbytes)
+        predictions = np.empty(len(testItems))
+        for batch in range(0, len(users), batchSize):
+            scores = scoreMethod(train, method.split(':')[0], {}, model,
+                                 users[batch:batch + batchSize], scale)
+            inBatch = (rows >= batch) & (rows < batch + batchSize)
+            predictions[inBatch] = scores[rows[inBatch] - batch, testItems[inBatch]]
+        predicted = ~np.isnan(predictions)
+        errors = predictions[predicted] - testRatings[predicted]
+        reference.setdefault(method, predictions)
+        difference = np.abs(predictions - reference[method])
+        results.append({'dataset': name, 'method': method, 'storage': storage,
+                        'bytes': int(nbytes),
+                        'mae': float(np.abs(errors).mean()) if len(errors) else None,
+                        'rmse': float(np.sqrt((errors**2).mean())) if len(errors) else None,
+                        'coverage': float(predicted.mean()) if len(predicted) else None,
+                        'maxDifference': float(np.nanmax(difference, initial=0.0))})
+    return results
+
+def benchmarkAnn(name, ratings, queries=200, k=10, metric='pearson', missing='absent',
+                 probes=ANN_PROBES, seed=0):
+    '''Compares AnnIndex searches of every number of probes with the exact
+    neighbor search on queries users picked with seed. Returns a list of
+    result dictionaries with the build time, the time per query, the mean
+    number of candidates scored, the querying user left out, and recall@k
+    against the exact k nearest users, the first one is the exact search.
+    Recall is measured without the exact search a query falls back to when
+    its clusters hold fewer than k candidates, fallbacks is the share of
+    queries that would have fallen back.'''
+    rng = np.random.default_rng(seed)
+    userIDs = rng.choice(ratings.numUsers, min(queries, ratings.numUsers), replace=False)
+    rows = [ratings.userRow(userID) for userID in userIDs]
+    larger = LARGER_IS_CLOSER[metric]
+    exact = []
+    start = time.perf_counter()
+    for (userID, row) in zip(userIDs, rows):
+        distances = userDistances(ratings, [row], metric, missing)[0]
+        others = np.delete(np.arange(ratings.numUsers), userID)
+        exact.append(others[selectTop(distances[others], k, larger)])
+    seconds = time.perf_counter() - start
+    results = [{'dataset': name, 'users': ratings.numUsers, 'missing': missing,
+                'method': 'exact', 'buildSeconds': 0.0, 'querySeconds': seconds / len(rows),
+                'candidates': ratings.numUsers - 1, 'fallbacks': 0.0, 'recall': 1.0}]
+    start = time.perf_counter()
+    index = AnnIndex(ratings, missing=missing, seed=seed)
+    buildSeconds = time.perf_counter() - start
+    for probe in probes:
+        index.probes = probe
+        start = time.perf_counter()
+        found = index.query(rows, k, metric, exclude=userIDs, fallback=False)
+        seconds = time.perf_counter() - start
+        clusters = index.nearestClusters(index.vectors(rows), probe)
+        candidates = np.array([np.count_nonzero(index.candidates(row) != userID)
+                               for (row, userID) in zip(clusters, userIDs)])
+        results.append({'dataset': name, 'users': ratings.numUsers, 'missing': missing,
+                        'method': '%d clusters %d probes' % (len(index.centroids), probe),
+                        'buildSeconds': buildSeconds, 'querySeconds': seconds / len(rows),
+                        'candidates': float(candidates.mean()),
+                        'fallbacks': float(np.mean(candidates < k)),
+                        'recall': recallAtK(exact, [ids for (ids, distances) in found])})
+    return results
+
+def printAnn(results):
+    for result in results:
+        print('%-18s %-7s %-22s build %7.2f s  query %7.2f ms  candidates %8.1f  '
+              'fallbacks %.3f  recall %.3f' % (result['dataset'], result['missing'],
+                                               result['method'], result['buildSeconds'],
+            result['querySeconds'] * 1e3, result['candidates'], result['fallbacks'],
+            result['recall']))
+
+def printPrecision(results):
+    for result in results:
+        print('%-14s %-10s %-16s %10.2f MB  MAE %.4f  RMSE %.4f  coverage %.3f  '
+              'max diff %.2e' % (result['dataset'], result['method'], result['storage'],
+                                 result['bytes'] / 1e6, result['mae'] or 0.0,
+                                 result['rmse'] or 0.0, result['coverage'] or 0.0,
+                                 result['maxDifference']))
+
+def environment():
+    '''Describes where the results were measured'''
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def runBenchmarks(sizes=('small', 'medium'), bundled=tuple(BUNDLED), queries=50,
+                  memory=True, seed=0):
+    '''Runs benchmarkRatings on every synthetic size and bundled file and
+    returns the results with a description of the environment'''
+    results = []
+    for size in sizes:
+        (numUsers, numItems, density) = SIZES[size]
+        ratings = syntheticRatings(numUsers, numItems, density, seed)
+        results.extend(benchmarkRatings('synthetic-' + size, ratings, queries,
+                                        memory=memory, seed=seed))
+    for name in bundled:
+        results.extend(benchmarkRatings(name, bundledRatings(name), queries,
+                                        memory=memory, seed=seed))
+    return {'environment': environment(), 'results': results}
+
+def compareResults(old, new):
+    '''Returns (dataset, operation, old seconds, new seconds, ratio) for every
+    measurement found in both result sets, a ratio above 1 is a slowdown'''
+    previous = {(result['dataset'], result['operation']): result['seconds']
+                for result in old['results']}
+    rows = []
+    for result in new['results']:
+        key = (result['dataset'], result['operation'])
+        if key in previous and previous[key] > 0:
+            rows.append(key + (previous[key], result['seconds'],
+                               result['seconds'] / previous[key]))
+    return rows
+
+def printResults(report):
+    for result in report['results']:
+        peak = '' if result['peakBytes'] is None else '%10.1f MB' % (result['peakBytes'] / 1e6)
+        print('%-22s %-24s %10.4f s %14.1f %-10s%s' % (
+            result['dataset'], result['operation'], result['seconds'],
+            result['throughput'] or 0.0, result['unit'], peak))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Recommender class')
+    parser.add_argument('--sizes', nargs='*', default=['small', 'medium'], choices=sorted(SIZES))
+    parser.add_argument('--bundled', nargs='*', default=list(BUNDLED), choices=sorted(BUNDLED))
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--output', help='write the results as json to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files instead of running')
+    parser.add_argument('--ann', action='store_true',
+                        help='measure recall@k and query time of the approximate neighbor '
+                             'index instead of timing')
+    parser.add_argument('--k', type=int, default=10, help='neighbors of the --ann recall@k')
+    parser.add_argument('--precision', action='store_true',
+                        help='measure the accuracy of the model storage dtypes on the '
+                             'bundled files instead of timing')
+    args = parser.parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        for (dataset, operation, before, after, ratio) in compareResults(old, new):
+            print('%-22s %-24s %10.4f s -> %10.4f s  x%.2f' % (dataset, operation,
+                                                              before, after, ratio))
+        return 0
+    if args.ann:
+        report = {'environment': environment(), 'ann': []}
+        datasets = [('synthetic-' + size, syntheticRatings(*SIZES[size], seed=args.seed))
+                    for size in args.sizes]
+        datasets.extend((name, bundledRatings(name)) for name in args.bundled)
+        for (name, ratings) in datasets:
+            for missing in MISSING_POLICIES:
+                report['ann'].extend(benchmarkAnn(name, ratings, args.queries, args.k,
+                                                  missing=missing, seed=args.seed))
+        printAnn(report['ann'])
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=1)
+        return 0
+    if args.precision:
+        report = {'environment': environment(), 'precision': []}
+        for name in args.bundled:
+            report['precision'].extend(benchmarkPrecision(name, bundledRatings(name),
+                                                          seed=args.seed))
+        printPrecision(report['precision'])
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=1)
+        return 0
+    report = runBenchmarks(args.sizes, args.bundled, args.queries,
+                           not args.no_memory, args.seed)
+    printResults(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
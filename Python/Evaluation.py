@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Offline evaluation of the recommendation methods on held out ratings. The
+ratings are split into seeded folds, every method is trained once per fold
+on the other folds and all held out (user, item) pairs are scored in bulk,
+a batch of users at a time. Folds run in parallel processes. Run from the
+Python folder:
+
+    python Evaluation.py ../Data/L_MovieData.csv --encoding latin-1 --folds 5 \
+        --methods knn:pearson:3 knn:manhattan:3 slopeone cosine:50
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+from ItemSimilarity import ItemNeighbors, denormalizeRatings, normalizeRatings
+from Neighbors import LARGER_IS_CLOSER
+from TopN import selectTop
+from Parallel import attachArrays, releaseArrays, shareArrays
+from RatingMatrix import RatingMatrix
+from RatingsLoader import readWideCsv
+from Recommender import Recommender
+from SlopeOne import SlopeOneModel
+
+#Sums every fold reports for every method, the metrics are computed from them
+SUMS = ('pairs', 'predicted', 'absError', 'squaredError', 'users', 'precision',
+        'recall', 'trainSeconds', 'predictSeconds')
+
+def parseMethod(spec):
+    '''Parses a method given as text into (name, options):
+    knn:METRIC:K       k nearest neighbors, e.g. knn:pearson:3
+    slopeone           weighted Slope One
+    cosine[:SIZE]      adjusted cosine, keeping SIZE neighbors per item'''
+    parts = spec.split(':')
+    if parts[0] == 'knn':
+        metric = parts[1] if len(parts) > 1 else 'pearson'
+        if metric not in LARGER_IS_CLOSER:
+            raise ValueError('Unknown metric ' + metric)
+        return 'knn', {'metric': metric, 'k': int(parts[2]) if len(parts) > 2 else 1}
+    elif parts[0] == 'slopeone' and len(parts) == 1:
+        return 'slopeone', {}
+    elif parts[0] == 'cosine' and len(parts) <= 2:
+        return 'cosine', {'neighbors_per_item': int(parts[1]) if len(parts) > 1 else None}
+    raise ValueError('Unknown method ' + spec)
+
+def foldAssignments(nnz, folds=5, seed=0, testFraction=None):
+    '''Assigns every rating, in CSR order, to a fold. Returns (assignment,
+    test folds). With testFraction a single hold-out split is made instead of
+    folds: fold 0 holds round(testFraction * nnz) random ratings and is the
+    only test fold.'''
+    order = np.random.default_rng(seed).permutation(nnz)
+    assignment = np.empty(nnz, dtype=np.int32)
+    if testFraction is None:
+        assignment[order] = np.arange(nnz) % folds
+        return assignment, list(range(folds))
+    assignment[order] = np.arange(nnz) >= int(round(testFraction * nnz))
+    return assignment, [0]
+
+def splitRatings(ratings, assignment, fold):
+    '''Returns (train, test users, test items, test ratings) where train is a
+    RatingMatrix of the ratings outside fold, with the same ids as ratings,
+    and the test arrays hold the ratings in fold'''
+    test = assignment == fold
+    userIDs = ratings.rowUserIDs()
+    indptr = np.zeros(ratings.numUsers + 1, dtype=np.int64)
+    np.cumsum(np.bincount(userIDs[~test], minlength=ratings.numUsers), out=indptr[1:])
+    train = RatingMatrix(ratings.users, ratings.items, indptr, ratings.indices[~test],
+                         ratings.values[~test])
+    return train, userIDs[test], ratings.indices[test], ratings.values[test]
+
+def trainMethod(train, name, options):
+    '''Trains the model a method needs on train, a Recommender for knn'''
+    if name == 'knn':
+        return Recommender(train, options['k'], options['metric'], announce=False)
+    elif name == 'slopeone':
+        return SlopeOneModel.fromRatings(train)
+    return ItemNeighbors.fromRatings(train, train.userAverages(),
+                                     options['neighbors_per_item'])
+
+def scoreMethod(train, name, options, model, userIDs, scale):
+    '''Returns the len(userIDs) x numItems predictions of a trained method,
+    NaN where it makes none. knn is scored by the fold's Recommender, see
+    Recommender.knnScores.'''
+    if name == 'knn':
+        return model.knnScores([train.users[user] for user in userIDs])
+    queries = [train.userRow(user) for user in userIDs]
+    if name == 'slopeone':
+        return model.predictBatch(queries)
+    (minR, maxR) = scale
+    queries = [(items, normalizeRatings(ratings.copy(), minR, maxR))
+               for (items, ratings) in queries]
+    return denormalizeRatings(model.predictBatch(queries), minR, maxR)
+
+def evaluateFold(ratings, assignment, fold, methods, n=10, relevant=4.0, scale=(1, 5),
+                 batchSize=256):
+    '''Trains every method on the ratings outside fold and scores the ratings
+    in it. Returns {method spec: sums}, see SUMS.
+    param n is the length of the top n lists of precision@n and recall@n
+    param relevant is the lowest held out rating that counts as a hit'''
+    train, testUsers, testItems, testRatings = splitRatings(ratings, assignment, fold)
+    order = np.argsort(testUsers, kind='stable')
+    testUsers = testUsers[order]
+    testItems = testItems[order]
+    testRatings = testRatings[order]
+    users, starts = np.unique(testUsers, return_index=True)
+    stops = np.append(starts[1:], len(testUsers))
+    results = {}
+    models = {}
+    for spec in methods:
+        (name, options) = parseMethod(spec)
+        start = time.perf_counter()
+        models[spec] = trainMethod(train, name, options)
+        results[spec] = dict.fromkeys(SUMS, 0.0)
+        results[spec]['trainSeconds'] = time.perf_counter() - start
+    for batch in range(0, len(users), batchSize):
+        batchUsers = users[batch:batch + batchSize]
+        for spec in methods:
+            (name, options) = parseMethod(spec)
+            start = time.perf_counter()
+            scores = scoreMethod(train, name, options, models[spec], batchUsers, scale)
+            sums = results[spec]
+            for (q, user) in enumerate(batchUsers):
+                first = starts[batch + q]
+                last = stops[batch + q]
+                items = testItems[first:last]
+                predictions = scores[q, items]
+                predicted = ~np.isnan(predictions)
+                errors = predictions[predicted] - testRatings[first:last][predicted]
+                sums['pairs'] += len(items)
+                sums['predicted'] += int(predicted.sum())
+                sums['absError'] += float(np.abs(errors).sum())
+                sums['squaredError'] += float((errors * errors).sum())
+                hits = items[testRatings[first:last] >= relevant]
+                if len(hits) == 0:
+                    continue
+                candidates = np.flatnonzero(~np.isnan(scores[q]))
+                top = candidates[selectTop(scores[q, candidates], n)]
+                found = int(np.isin(top, hits).sum())
+                sums['users'] += 1
+                sums['precision'] += found / n
+                sums['recall'] += found / len(hits)
+            sums['predictSeconds'] += time.perf_counter() - start
+    return results
+
+def summarize(sums):
+    '''Turns the summed fold results of one method into its metrics'''
+    predicted = sums['predicted']
+    return {'mae': sums['absError'] / predicted if predicted else None,
+            'rmse': (sums['squaredError'] / predicted) ** 0.5 if predicted else None,
+            'coverage': predicted / sums['pairs'] if sums['pairs'] else None,
+            'precision': sums['precision'] / sums['users'] if sums['users'] else None,
+            'recall': sums['recall'] / sums['users'] if sums['users'] else None,
+            'pairs': int(sums['pairs']),
+            'trainSeconds': sums['trainSeconds'],
+            'predictSeconds': sums['predictSeconds'],
+            'seconds': sums['trainSeconds'] + sums['predictSeconds']}
+
+#State of a worker process, set once by initEvaluation.
+_worker = {}
+
+def initEvaluation(users, items, specs):
+    '''Pool initializer, rebuilds the ratings on top of the shared arrays'''
+    blocks, arrays = attachArrays(specs)
+    _worker['blocks'] = blocks
+    _worker['ratings'] = RatingMatrix(users, items, arrays['indptr'], arrays['indices'],
+                                      arrays['values'])
+    _worker['assignment'] = arrays['assignment']
+
+def evaluateTask(task):
+    '''Evaluates one fold inside a worker'''
+    (fold, methods, n, relevant, scale) = task
+    return evaluateFold(_worker['ratings'], _worker['assignment'], fold, methods, n,
+                        relevant, scale)
+
+def evaluate(ratings, methods=('knn:pearson:3', 'slopeone', 'cosine'), folds=5, seed=0,
+             testFraction=None, n=10, relevant=4.0, scale=(1, 5), workers=None):
+    '''Evaluates methods, see parseMethod, on a RatingMatrix.
+    param folds is the number of folds of a k-fold cross validation, every
+    fold is held out once
+    param testFraction makes a single hold-out split of that share of the
+    ratings instead
+    param n and relevant configure precision@n and recall@n: a held out
+    rating of at least relevant is a hit when its item is in the top n
+    param scale is the (minR, maxR) rating scale cosine predictions use
+    param workers is the number of processes folds run in, None uses every
+    cpu and 1 runs them in this process
+    Returns one dictionary per method with mae, rmse, coverage (the share of
+    held out ratings that got a prediction), precision, recall and the
+    training, prediction and total seconds summed over the folds.'''
+    methods = list(methods)
+    for spec in methods:
+        parseMethod(spec)
+    assignment, testFolds = foldAssignments(ratings.nnz, folds, seed, testFraction)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(testFolds))
+    tasks = [(fold, methods, n, relevant, scale) for fold in testFolds]
+    if workers <= 1:
+        foldResults = [evaluateFold(ratings, assignment, *task) for task in tasks]
+    else:
+        blocks, specs = shareArrays({'indptr': ratings.indptr, 'indices': ratings.indices,
+                                     'values': ratings.values, 'assignment': assignment})
+        try:
+            with multiprocessing.Pool(workers, initEvaluation,
+                                      (ratings.users, ratings.items, specs)) as pool:
+                foldResults = pool.map(evaluateTask, tasks)
+        finally:
+            releaseArrays(blocks)
+    results = []
+    for spec in methods:
+        sums = dict.fromkeys(SUMS, 0.0)
+        for foldResult in foldResults:
+            for key in SUMS:
+                sums[key] += foldResult[spec][key]
+        result = {'method': spec, 'folds': len(testFolds)}
+        result.update(summarize(sums))
+        results.append(result)
+    return results
+
+def printEvaluation(results, n=10):
+    print('%-20s %8s %8s %9s %8s %8s %10s' % ('method', 'MAE', 'RMSE', 'coverage',
+                                              'P@%d' % n, 'R@%d' % n, 'seconds'))
+    for result in results:
+        print('%-20s %8.4f %8.4f %9.4f %8.4f %8.4f %10.2f' % (
+            result['method'], result['mae'] or 0.0, result['rmse'] or 0.0,
+            result['coverage'] or 0.0, result['precision'] or 0.0,
+            result['recall'] or 0.0, result['seconds']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate the recommendation methods')
+    parser.add_argument('data', help='wide csv file of ratings')
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--methods', nargs='+',
+                        default=['knn:pearson:3', 'knn:manhattan:3', 'knn:euclidean:3',
+                                 'slopeone', 'cosine'])
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--test-fraction', type=float,
+                        help='make one hold-out split of this share instead of folds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--relevant', type=float, default=4.0)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args(argv)
+    ratings = readWideCsv(args.data, encoding=args.encoding)
+    start = time.perf_counter()
+    results = evaluate(ratings, args.methods, args.folds, args.seed, args.test_fraction,
+                       args.n, args.relevant, workers=args.workers)
+    printEvaluation(results, args.n)
+    print('wall clock %.2f s' % (time.perf_counter() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
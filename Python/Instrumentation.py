@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import time
+from contextvars import ContextVar
+
+#Profile of the call being run with profile=True in this thread or task.
+_activeProfile = ContextVar('activeProfile', default=None)
+
+class _NoStage:
+    '''Context manager that does nothing, shared by every disabled stage'''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_STAGE = _NoStage()
+
+class _Stage:
+    '''Times one stage and reports it to a list of recorders on exit'''
+    __slots__ = ('name', 'recorders', 'start')
+
+    def __init__(self, name, recorders):
+        self.name = name
+        self.recorders = recorders
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        for recorder in self.recorders:
+            recorder.addTime(self.name, seconds)
+        return False
+
+#------------------------------------------------------------------------------
+#Start of Profile class
+class Profile:
+    def __init__(self):
+        '''Per stage times and counters of one call'''
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+
+    def addTime(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def addCount(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def breakdown(self):
+        '''Returns {'stages': {stage: seconds}, 'calls': {stage: calls},
+        'counters': {counter: value}}'''
+        return {'stages': dict(self.timings), 'calls': dict(self.calls),
+                'counters': dict(self.counters)}
+#End of Profile class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of Tracer class
+class Tracer(Profile):
+    def __init__(self, sink=None):
+        '''Collects stage times and counters over the life of a recommender.
+        param sink is an optional callable that gets every event as a
+        dictionary, {'stage': name, 'seconds': s} or {'counter': name, 'amount': n},
+        to forward them to a metrics system.'''
+        Profile.__init__(self)
+        self.sink = sink
+
+    def addTime(self, name, seconds):
+        Profile.addTime(self, name, seconds)
+        if self.sink is not None:
+            self.sink({'stage': name, 'seconds': seconds})
+
+    def addCount(self, name, amount):
+        Profile.addCount(self, name, amount)
+        if self.sink is not None:
+            self.sink({'counter': name, 'amount': amount})
+
+    def stage(self, name):
+        '''Context manager that times the stage name'''
+        profile = _activeProfile.get()
+        if profile is None:
+            return _Stage(name, (self,))
+        return _Stage(name, (self, profile))
+
+    def count(self, name, amount=1):
+        '''Adds amount to the counter name'''
+        self.addCount(name, amount)
+        profile = _activeProfile.get()
+        if profile is not None:
+            profile.addCount(name, amount)
+
+    def reset(self):
+        self.timings.clear()
+        self.calls.clear()
+        self.counters.clear()
+#End of Tracer class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of NullTracer class
+class NullTracer:
+    '''Tracer used while tracing is disabled. Stages and counters are dropped
+    unless a call is being profiled, so the cost is one context variable
+    lookup.'''
+    sink = None
+
+    def stage(self, name):
+        profile = _activeProfile.get()
+        if profile is None:
+            return NO_STAGE
+        return _Stage(name, (profile,))
+
+    def count(self, name, amount=1):
+        profile = _activeProfile.get()
+        if profile is not None:
+            profile.addCount(name, amount)
+
+    def breakdown(self):
+        return {'stages': {}, 'calls': {}, 'counters': {}}
+
+    def reset(self):
+        pass
+#End of NullTracer class
+#------------------------------------------------------------------------------
+
+NULL_TRACER = NullTracer()
+
+def profiled(fn, *args, **kwargs):
+    '''Runs fn(*args, **kwargs) while collecting a Profile of it. Returns
+    (result, breakdown) where breakdown is Profile.breakdown() plus the total
+    seconds of the call. Nested profiled calls each get their own profile.'''
+    profile = Profile()
+    token = _activeProfile.set(profile)
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        total = time.perf_counter() - start
+        _activeProfile.reset(token)
+    breakdown = profile.breakdown()
+    breakdown['total'] = total
+    return result, breakdown
@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+from Neighbors import postingRanges
+from Support import shrinkScores
+
+def normalizeRatings(ratings, minR, maxR):
+    '''Maps an array of ratings on the scale minR..maxR to -1..1 in place,
+    the normalization the cosine predictions work on. Returns ratings.'''
+    ratings -= minR
+    ratings *= 2
+    ratings -= maxR - minR
+    ratings /= maxR - minR
+    return ratings
+
+def denormalizeRatings(predictions, minR, maxR):
+    '''Maps normalized predictions back to the scale minR..maxR in place.
+    Returns predictions.'''
+    predictions += 1
+    predictions *= maxR - minR
+    predictions *= 0.5
+    predictions += minR
+    return predictions
+
+def centeredRatings(ratings, averages):
+    '''Returns the ratings of a RatingMatrix in CSR order with each user's
+    average rating subtracted. Read through ratings.csc order this is the
+    item -> (user, centered rating) posting list of every item.'''
+    return ratings.values - averages[ratings.rowUserIDs()]
+
+def adjustedCosineBlocks(ratings, averages, itemBlockSize=None, userBlockSize=512):
+    '''Computes the adjusted cosine similarity of every item pair, one block of
+    rows at a time.
+    ratings is a RatingMatrix and averages the average rating of every user.
+    Each user is mean centered once, then with C the centered ratings and B
+    the 0/1 rated mask of a block of users
+        numerator = C^T C
+        squares   = (C*C)^T B
+    summed over the blocks. squares[i, j] is the sum of the squared centered
+    ratings of item i over the users that rated both i and j so
+        similarity[i, j] = numerator[i, j] / sqrt(squares[i, j] * squares[j, i])
+    which is the same value Recommender.cosineSimilarity gives for one pair.
+    Yields (start, stop, similarities, support) where similarities and support
+    are the rows start..stop-1 of the item x item similarity and co-rating
+    count arrays. Pairs without a common user or with a zero denominator have
+    a similarity of 0. Only itemBlockSize rows are held at once.'''
+    numItems = ratings.numItems
+    if itemBlockSize is None:
+        itemBlockSize = max(numItems, 1)
+    centered = centeredRatings(ratings, averages)
+    for itemStart in range(0, numItems, itemBlockSize):
+        itemStop = min(itemStart + itemBlockSize, numItems)
+        numerator, squares, squaresT, support = adjustedCosineSums(
+            ratings, centered, itemStart, itemStop, userBlockSize)
+        items = np.arange(itemStart, itemStop)
+        yield (itemStart, itemStop) + cosineFromSums(items, numerator, squares, squaresT,
+                                                     support)
+
+def adjustedCosineSums(ratings, centered, itemStart, itemStop, userBlockSize=512):
+    '''Returns the (numerator, squares, squares transposed, support) rows
+    itemStart..itemStop-1 of the sums of adjustedCosineBlocks. centered is
+    the output of centeredRatings.'''
+    numItems = ratings.numItems
+    numerator = np.zeros((itemStop - itemStart, numItems))
+    squares = np.zeros((itemStop - itemStart, numItems))
+    squaresT = np.zeros((itemStop - itemStart, numItems))
+    support = np.zeros((itemStop - itemStart, numItems))
+    for userStart in range(0, ratings.numUsers, userBlockSize):
+        userStop = min(userStart + userBlockSize, ratings.numUsers)
+        block, mask = ratings.denseBlock(userStart, userStop, centered)
+        mask = mask.astype(np.float64)
+        left = block[:, itemStart:itemStop]
+        leftMask = mask[:, itemStart:itemStop]
+        numerator += left.T @ block
+        squares += (left * left).T @ mask
+        squaresT += leftMask.T @ (block * block)
+        support += leftMask.T @ mask
+    return numerator, squares, squaresT, support
+
+def cosineFromSums(items, numerator, squares, squaresT, support):
+    '''Returns the (similarities, support) rows of items from their sums,
+    see adjustedCosineBlocks. The pair of an item with itself is 0.'''
+    denominator = np.sqrt(squares) * np.sqrt(squaresT)
+    similarities = np.zeros(numerator.shape)
+    np.divide(numerator, denominator, out=similarities, where=denominator > 0)
+    rows = np.arange(len(items))
+    similarities[rows, items] = 0.0
+    support[rows, items] = 0
+    return similarities, support
+
+def adjustedCosine(ratings, averages, userBlockSize=512):
+    '''Returns the full item x item adjusted cosine similarity array indexed
+    by item id, see adjustedCosineBlocks.'''
+    similarities = np.zeros((ratings.numItems, ratings.numItems))
+    for (start, stop, block, support) in adjustedCosineBlocks(ratings, averages,
+                                                              userBlockSize=userBlockSize):
+        similarities[start:stop] = block
+    return similarities
+
+#Similarity storage dtypes from the most to the least precise and the
+#fewest neighbors per item storageFor prunes to before it lowers the precision
+#again, see ItemNeighbors.storageFor.
+SIMILARITY_LEVELS = ['float64', 'float32', 'float16']
+MIN_NEIGHBORS = 20
+
+def pruneSimilarities(similarities, support, neighbors_per_item=None, min_support=1,
+                      shrinkage=0.0):
+    '''Keeps the neighbors of a block of similarity rows, see
+    ItemNeighbors.fromRatings. Returns (counts, neighbors, similarities)
+    where counts is the number of neighbors kept per row and the neighbors
+    of every row follow each other, most similar first. With shrinkage the
+    similarities are shrunk by their support first, see Support.shrinkScores.'''
+    numItems = similarities.shape[1]
+    similarities = shrinkScores(similarities, support, shrinkage)
+    scores = np.where((support >= max(min_support, 1)) & (similarities != 0.0),
+                      similarities, -np.inf)
+    if neighbors_per_item is not None and neighbors_per_item < numItems:
+        top = np.argpartition(-scores, neighbors_per_item - 1, axis=1)
+        top = top[:, :neighbors_per_item]
+    else:
+        top = np.broadcast_to(np.arange(numItems), scores.shape)
+    topScores = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -topScores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    topScores = np.take_along_axis(topScores, order, axis=1)
+    valid = np.isfinite(topScores)
+    return valid.sum(axis=1), top[valid].astype(np.int32), topScores[valid]
+
+#Sums of squares below this are read as 0 by CosineAccumulators.rows, online
+#updates leave rounding residue where the exact sum is 0.
+SQUARES_TOLERANCE = 1e-9
+#Decimals CosineAccumulators.rows rounds the similarities to.
+SIMILARITY_DECIMALS = 12
+
+#------------------------------------------------------------------------------
+#Start of CosineAccumulators class
+class CosineAccumulators:
+    def __init__(self, numerator, squares, support):
+        '''Running sums behind the adjusted cosine similarity of every item
+        pair, see adjustedCosineBlocks. With c the ratings centered on the
+        user averages, over the users that rated both items i and j,
+        numerator[i, j] is the sum of c_i * c_j, squares[i, j] the sum of
+        c_i * c_i and support[i, j] the number of those users. A user only
+        adds to the pairs of the items they rated, so a changed rating is
+        applied by taking the user's terms out with the old average and
+        putting them back with the new one. The three arrays take 24 bytes
+        per item pair.'''
+        self.numerator = numerator
+        self.squares = squares
+        self.support = support
+        self._buffers = (numerator, squares, support)
+
+    @classmethod
+    def fromRatings(cls, ratings, averages, userBlockSize=512):
+        '''Builds the sums of a RatingMatrix centered on averages'''
+        numerator, squares, squaresT, support = adjustedCosineSums(
+            ratings, centeredRatings(ratings, averages), 0, ratings.numItems, userBlockSize)
+        return cls(numerator, squares, support.astype(np.int64))
+
+    @property
+    def numItems(self):
+        return self.support.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.numerator.nbytes + self.squares.nbytes + self.support.nbytes
+
+    def grow(self, numItems):
+        '''Makes room for item ids up to numItems - 1, the buffers double in
+        size when full, see SlopeOneModel.grow'''
+        if numItems <= self.numItems:
+            return
+        capacity = self._buffers[0].shape[0]
+        if numItems > capacity:
+            capacity = max(numItems, 2 * capacity)
+            buffers = []
+            for array in (self.numerator, self.squares, self.support):
+                buffer = np.zeros((capacity, capacity), dtype=array.dtype)
+                buffer[:self.numItems, :self.numItems] = array
+                buffers.append(buffer)
+            self._buffers = tuple(buffers)
+        (self.numerator, self.squares, self.support) = (
+            buffer[:numItems, :numItems] for buffer in self._buffers)
+
+    def addUser(self, items, ratings, average, sign=1):
+        '''Adds the terms of one user, items and ratings are the user's
+        row and average the average the user is centered on. A sign of -1
+        takes them out again.'''
+        centered = ratings - average
+        pairs = np.ix_(items, items)
+        self.numerator[pairs] += sign * np.outer(centered, centered)
+        self.squares[pairs] += sign * (centered * centered)[:, None]
+        self.support[pairs] += sign
+        if sign < 0:
+            #Pairs no user rates any more go back to exactly 0.
+            empty = self.support[pairs] == 0
+            self.numerator[pairs] = np.where(empty, 0.0, self.numerator[pairs])
+            self.squares[pairs] = np.where(empty, 0.0, self.squares[pairs])
+
+    def removeUser(self, items, ratings, average):
+        '''Takes the terms of one user out, see addUser'''
+        self.addUser(items, ratings, average, -1)
+
+    def rows(self, items):
+        '''Returns the (similarities, support) rows of the item ids items'''
+        squares = self.squares[items]
+        squaresT = self.squares[:, items].T
+        squares[squares < SQUARES_TOLERANCE] = 0.0
+        squaresT[squaresT < SQUARES_TOLERANCE] = 0.0
+        similarities, support = cosineFromSums(items, self.numerator[items], squares,
+                                               squaresT, self.support[items])
+        #Rounding off the residue keeps equal similarities equal, so ties at
+        #the neighbors_per_item cutoff go to the same neighbor as a rebuild.
+        return np.round(similarities, SIMILARITY_DECIMALS), support
+
+    def blocks(self, itemBlockSize=256):
+        '''Yields the similarity rows like adjustedCosineBlocks'''
+        for start in range(0, self.numItems, itemBlockSize):
+            stop = min(start + itemBlockSize, self.numItems)
+            yield (start, stop) + self.rows(np.arange(start, stop))
+#End of CosineAccumulators class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of ItemNeighbors class
+class ItemNeighbors:
+    def __init__(self, indptr, neighbors, similarities):
+        '''Item similarity model stored as a neighbor list per item.
+        The neighbors of item i are neighbors[indptr[i]:indptr[i+1]] with the
+        matching similarities, ordered from most to least similar.'''
+        self.indptr = indptr
+        self.neighbors = neighbors
+        self.similarities = similarities
+        self._rows = None
+        self._columns = None
+
+    @classmethod
+    def fromRatings(cls, ratings, averages, neighbors_per_item=None, min_support=1,
+                    itemBlockSize=256, similarityDtype='float64', shrinkage=0.0):
+        '''Builds the model from a RatingMatrix and the user averages.
+        neighbors_per_item is the model size of the Sarwar item-based paper,
+        only the k most similar items are kept for every item, None keeps all
+        of them. Pairs rated together by fewer than min_support users and pairs
+        with a similarity of 0 are dropped. Rows are computed and pruned
+        itemBlockSize items at a time so the full item x item array is never
+        held. similarityDtype is the storage dtype of the similarities.
+        shrinkage pulls the similarities of pairs with little support toward
+        0 before they are ranked, see Support.shrinkScores.'''
+        return cls.fromBlocks(ratings.numItems,
+                              adjustedCosineBlocks(ratings, averages, itemBlockSize),
+                              neighbors_per_item, min_support, similarityDtype, shrinkage)
+
+    @classmethod
+    def fromBlocks(cls, numItems, blocks, neighbors_per_item=None, min_support=1,
+                   similarityDtype='float64', shrinkage=0.0):
+        '''Builds the model from the (start, stop, similarities, support) row
+        blocks of adjustedCosineBlocks or CosineAccumulators.blocks, see
+        fromRatings'''
+        counts = np.zeros(numItems, dtype=np.int64)
+        neighbors = []
+        similarities = []
+        for (start, stop, block, support) in blocks:
+            (counts[start:stop], rowNeighbors, rowSimilarities) = pruneSimilarities(
+                block, support, neighbors_per_item, min_support, shrinkage)
+            neighbors.append(rowNeighbors)
+            similarities.append(rowSimilarities)
+        indptr = np.zeros(numItems + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        if numItems == 0:
+            return cls(indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=similarityDtype))
+        return cls(indptr, np.concatenate(neighbors),
+                   np.concatenate(similarities).astype(similarityDtype))
+
+    @classmethod
+    def storageFor(cls, numItems, max_memory, neighbors_per_item=None):
+        '''Returns the (similarity dtype, neighbors_per_item) that keeps the
+        most of the model whose arrays for numItems items take at most
+        max_memory bytes. The size is bounded by every item keeping all the
+        other items, the full model is tried in float64 then in float32, then
+        float32 is pruned down to MIN_NEIGHBORS neighbors per item and past
+        that float16 is pruned further. Raises ValueError when not even one
+        neighbor per item fits.'''
+        limit = max(numItems - 1, 0)
+        if neighbors_per_item is not None:
+            limit = min(limit, neighbors_per_item)
+
+        def largest(dtype):
+            entryBytes = np.dtype(np.int32).itemsize + np.dtype(dtype).itemsize
+            available = max_memory - (numItems + 1) * np.dtype(np.int64).itemsize
+            return int(available // (max(numItems, 1) * entryBytes))
+
+        for dtype in SIMILARITY_LEVELS[:2]:
+            if largest(dtype) >= limit:
+                return dtype, neighbors_per_item
+        if largest('float32') >= min(MIN_NEIGHBORS, limit):
+            return 'float32', largest('float32')
+        if largest('float16') >= 1:
+            return 'float16', min(largest('float16'), limit)
+        raise ValueError('An item similarity model of %d items does not fit in %d bytes'
+                         % (numItems, max_memory))
+
+    def replaceRows(self, items, similarities, support, neighbors_per_item=None,
+                    min_support=1, numItems=None, shrinkage=0.0):
+        '''Returns a copy of the model where the neighbors of the sorted item
+        ids items are pruned again from their new similarity and support rows,
+        see CosineAccumulators.rows. The other rows are kept as they are.
+        numItems makes room for new items, they have no neighbors.
+        shrinkage is as in fromRatings.'''
+        if numItems is None:
+            numItems = self.numItems
+        counts, neighbors, newSimilarities = pruneSimilarities(similarities, support,
+                                                               neighbors_per_item, min_support,
+                                                               shrinkage)
+        kept = ~np.isin(self.rows(), items)
+        rows = np.concatenate([self.rows()[kept], np.repeat(items, counts).astype(np.int32)])
+        order = np.argsort(rows, kind='stable')
+        indptr = np.zeros(numItems + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=numItems), out=indptr[1:])
+        neighbors = np.concatenate([self.neighbors[kept], neighbors])[order]
+        newSimilarities = newSimilarities.astype(self.similarities.dtype)
+        return ItemNeighbors(indptr, neighbors,
+                             np.concatenate([self.similarities[kept], newSimilarities])[order])
+
+    @property
+    def numItems(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.neighbors.nbytes + self.similarities.nbytes
+
+    def itemNeighbors(self, item):
+        '''Returns the (neighbor ids, similarities) arrays of item'''
+        start = self.indptr[item]
+        stop = self.indptr[item + 1]
+        return self.neighbors[start:stop], self.similarities[start:stop]
+
+    def similarity(self, itemI, itemJ):
+        '''Similarity of two item ids, 0 if itemJ is not a neighbor of itemI'''
+        neighbors, similarities = self.itemNeighbors(itemI)
+        found = np.flatnonzero(neighbors == itemJ)
+        if len(found) == 0:
+            return 0.0
+        return float(similarities[found[0]])
+
+    def toDense(self):
+        '''Returns the model as an item x item array'''
+        dense = np.zeros((self.numItems, self.numItems))
+        dense[self.rows(), self.neighbors] = self.similarities
+        return dense
+
+    def rows(self):
+        '''The item id that owns every neighbor entry'''
+        if self._rows is None:
+            self._rows = np.repeat(np.arange(self.numItems, dtype=np.int32),
+                                   np.diff(self.indptr))
+        return self._rows
+
+    def columns(self):
+        '''The neighbor entries grouped by neighbor item as (colptr, entries),
+        entries[colptr[i]:colptr[i + 1]] are the positions in self.neighbors
+        that hold item i, in increasing order'''
+        if self._columns is None:
+            colptr = np.zeros(self.numItems + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.neighbors, minlength=self.numItems), out=colptr[1:])
+            self._columns = (colptr, np.argsort(self.neighbors, kind='stable'))
+        return self._columns
+
+    def predict(self, items, ratings, support=False):
+        '''Predicts every item from the (normalized) ratings a user gave items.
+        For item j the prediction is
+        sum_i similarity[j, i] * rating_i / sum_i |similarity[j, i]|
+        over the neighbors i of j that the user rated. Only the entries whose
+        neighbor was rated are read, they are looked up through columns().
+        Returns an array of length numItems that is NaN for the rated items
+        and items with no rated neighbor. With support the number of rated
+        neighbors behind every prediction is returned too.'''
+        if support:
+            predictions, counts = self.predictBatch([(items, ratings)], True)
+            return predictions[0], counts[0]
+        return self.predictBatch([(items, ratings)])[0]
+
+    def predictBatch(self, queries, support=False):
+        '''predict for a batch of users given as a list of (item ids, ratings)
+        rows. The entries of every user are summed in one bincount. Returns a
+        (len(queries), numItems) array of predictions, with support also the
+        array of rated neighbor counts.'''
+        colptr, entries = self.columns()
+        ratingOf = np.zeros(self.numItems)
+        bins = []
+        numerators = []
+        denominators = []
+        for (q, (items, ratings)) in enumerate(queries):
+            positions = np.sort(entries[postingRanges(colptr, items)[0]])
+            ratingOf[items] = ratings
+            weights = self.similarities[positions]
+            #Row q of the result owns bins q * numItems .. (q + 1) * numItems - 1.
+            bins.append(q * self.numItems + self.rows()[positions])
+            numerators.append(weights * ratingOf[self.neighbors[positions]])
+            denominators.append(np.abs(weights))
+            ratingOf[items] = 0.0
+        shape = (len(queries), self.numItems)
+        predictions = np.full(shape, np.nan)
+        if not queries:
+            return (predictions, np.zeros(shape, dtype=np.int64)) if support else predictions
+        bins = np.concatenate(bins)
+        numerator = np.bincount(bins, np.concatenate(numerators),
+                                minlength=predictions.size).reshape(shape)
+        denominator = np.bincount(bins, np.concatenate(denominators),
+                                  minlength=predictions.size).reshape(shape)
+        np.divide(numerator, denominator, out=predictions, where=denominator > 0)
+        for (q, (items, ratings)) in enumerate(queries):
+            predictions[q, items] = np.nan
+        if support:
+            return predictions, np.bincount(bins, minlength=predictions.size).reshape(shape)
+        return predictions
+#End of ItemNeighbors class
+#------------------------------------------------------------------------------
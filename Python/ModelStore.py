@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import json
+import os
+import numpy as np
+
+#Bump when the layout of a saved model changes.
+FORMAT_VERSION = 1
+META_FILE = 'model.json'
+
+def saveModel(recommender, path):
+    '''Saves the data and every computed model of recommender to the directory
+    path. Every array is written to its own .npy file so it can be memory
+    mapped, the user and item ids and the other settings go to model.json.'''
+    meta, arrays = recommender.modelState()
+    os.makedirs(path, exist_ok=True)
+    for (name, array) in arrays.items():
+        filename = os.path.join(path, name + '.npy')
+        #Arrays trained out of core are already memory mapped from their file.
+        if (isinstance(array, np.memmap) and os.path.exists(filename)
+                and os.path.samefile(array.filename, filename)):
+            continue
+        np.save(filename, np.ascontiguousarray(array))
+    meta = dict(meta)
+    meta['productid2name'] = list(meta['productid2name'].items())
+    meta['format'] = FORMAT_VERSION
+    meta['arrays'] = sorted(arrays)
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+def loadModelState(path, mmap=True):
+    '''Reads the (meta, arrays) pair written by saveModel. With mmap the
+    arrays are read only memory maps of the files, pages are loaded on first
+    use and shared by every process that maps the same files.'''
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_VERSION:
+        raise ValueError('Unsupported model format ' + str(meta.get('format')) +
+                         ' in ' + path + ', expected ' + str(FORMAT_VERSION))
+    meta['productid2name'] = dict((key, name) for (key, name) in meta['productid2name'])
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+              for name in meta['arrays']}
+    return meta, arrays
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+
+#Pearson requires greater numbers while euclidean and manhattan require
+#smaller numbers.
+LARGER_IS_CLOSER = {'pearson': True, 'manhattan': False, 'euclidean': False}
+
+#How the metrics treat an item only one of the two users rated. 'absent'
+#compares the co-rated items only, 'zero' compares every item either user
+#rated with the missing rating read as 0.
+MISSING_POLICIES = ('absent', 'zero')
+
+def checkMissingPolicy(missing):
+    '''Raises ValueError for an unknown missing value policy'''
+    if missing not in MISSING_POLICIES:
+        raise ValueError('Unknown missing value policy ' + str(missing))
+    return missing
+
+def postingRanges(colptr, items):
+    '''Returns the positions in the CSC arrays of every rating of items, item
+    by item, and the number of ratings of each item.'''
+    starts = colptr[items]
+    lengths = colptr[np.asarray(items) + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum()), lengths
+
+def userDistances(ratings, queries, metric, missing='absent', candidates=None):
+    '''Computes the metric between every query and every user of ratings.
+    queries is a list of (item ids, ratings) rows. Only the users that rated
+    an item of a query are visited: the query's items are looked up in the
+    item -> users postings and the sums each metric needs are accumulated per
+    (query, user) with bincount. Returns a len(queries) x numUsers array.
+    Missing items follow the pairwise metrics and the missing value policy.
+    With 'absent' only co-rated items count, manhattan and euclidean are 0 and
+    pearson is 0 without co-rated items. With 'zero' the items rated by only
+    one side add their full rating, which comes from per row totals.
+    param candidates is an optional array of user ids per query, the pairs
+    of the other users are dropped before any sum and their columns of the
+    result are meaningless.'''
+    checkMissingPolicy(missing)
+    colptr, colUsers, colRatings = ratings.csc
+    numUsers = ratings.numUsers
+    positions = []
+    queryRatings = []
+    keys = []
+    for (q, (items, values)) in enumerate(queries):
+        found, lengths = postingRanges(colptr, items)
+        x = np.repeat(values, lengths)
+        users = colUsers[found]
+        if candidates is not None:
+            allowed = np.zeros(numUsers, dtype=bool)
+            allowed[candidates[q]] = True
+            kept = allowed[users]
+            found = found[kept]
+            x = x[kept]
+            users = users[kept]
+        positions.append(found)
+        queryRatings.append(x)
+        keys.append(users.astype(np.int64) + q * numUsers)
+    if len(queries) == 0:
+        return np.zeros((0, numUsers))
+    positions = np.concatenate(positions)
+    x = np.concatenate(queryRatings)
+    y = colRatings[positions]
+    keys = np.concatenate(keys)
+    shape = (len(queries), numUsers)
+    userIDs = ratings.rowUserIDs() if missing == 'zero' else None
+
+    def userTotals(fn):
+        return np.bincount(userIDs, fn(ratings.values), minlength=numUsers)
+
+    return pairDistances(metric, missing, shape, keys, x, y, queries, userTotals)
+
+def candidateDistances(ratings, query, candidates, metric, missing='absent'):
+    '''Computes the metric between one (item ids, ratings) query and the
+    users candidates only, like a column subset of userDistances. The rows of
+    the candidates are read and matched against the query's ratings, so the
+    cost is the number of ratings of the candidates. Returns an array of
+    len(candidates) distances.'''
+    checkMissingPolicy(missing)
+    (items, values) = query
+    positions, lengths = postingRanges(ratings.indptr, candidates)
+    owners = np.repeat(np.arange(len(candidates)), lengths)
+    queryRatings = np.full(ratings.numItems, np.nan)
+    queryRatings[items] = values
+    x = queryRatings[ratings.indices[positions]]
+    common = ~np.isnan(x)
+
+    def userTotals(fn):
+        return np.bincount(owners, fn(ratings.values[positions]), minlength=len(candidates))
+
+    return pairDistances(metric, missing, (1, len(candidates)), owners[common], x[common],
+                         ratings.values[positions[common]], [query], userTotals)[0]
+
+def pairDistances(metric, missing, shape, keys, x, y, queries, userTotals):
+    '''Turns the co-rated pairs of userDistances and candidateDistances into
+    a shape array of the metric. keys is the flat (query, user) cell of every
+    pair and x, y the query's and the user's rating. queries and userTotals,
+    a function of an elementwise function that sums it over every rating of
+    each user, give the row totals the 'zero' policy needs.'''
+
+    def total(weights):
+        return np.bincount(keys, weights, minlength=shape[0] * shape[1]).reshape(shape)
+
+    if missing == 'zero':
+        return _zeroFilledDistances(metric, total, x, y, queries, userTotals)
+    if metric == 'manhattan':
+        return total(np.abs(x - y))
+    if metric == 'euclidean':
+        return np.sqrt(total((x - y)**2))
+    n = total(None)
+    sumXY = total(x * y)
+    sumX = total(x)
+    sumY = total(y)
+    sumX2 = total(x**2)
+    sumY2 = total(y**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = (np.sqrt(np.maximum(sumX2 - sumX**2/n, 0.0))
+                       * np.sqrt(np.maximum(sumY2 - sumY**2/n, 0.0)))
+        correlation = (sumXY - (sumX * sumY) / n) / denominator
+    return np.where((n > 0) & (denominator > 0), correlation, 0.0)
+
+def _zeroFilledDistances(metric, total, x, y, queries, userTotals):
+    '''pairDistances with the 'zero' policy. The sums over every item either
+    side rated are the co-rated sums plus what each side rated alone, the
+    row totals minus their co-rated part.'''
+
+    def queryTotals(fn):
+        return np.array([fn(values).sum() for (items, values) in queries],
+                        dtype=np.float64)[:, None]
+
+    def rowTotals(fn):
+        return userTotals(fn)[None, :]
+
+    if metric == 'manhattan':
+        return (total(np.abs(x - y)) + queryTotals(np.abs) - total(np.abs(x))
+                + rowTotals(np.abs) - total(np.abs(y)))
+    if metric == 'euclidean':
+        return np.sqrt(np.maximum(total((x - y)**2) + queryTotals(np.square) - total(x**2)
+                                  + rowTotals(np.square) - total(y**2), 0.0))
+    n = (queryTotals(np.ones_like) + rowTotals(np.ones_like) - total(None))
+    sumXY = total(x * y)
+    sumX = queryTotals(np.asarray)
+    sumY = rowTotals(np.asarray)
+    sumX2 = queryTotals(np.square)
+    sumY2 = rowTotals(np.square)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = (np.sqrt(np.maximum(sumX2 - sumX**2/n, 0.0))
+                       * np.sqrt(np.maximum(sumY2 - sumY**2/n, 0.0)))
+        correlation = (sumXY - (sumX * sumY) / n) / denominator
+    return np.where((n > 0) & (denominator > 0), correlation, 0.0)
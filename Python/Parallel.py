@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import csv
+import os
+import multiprocessing
+from collections import deque
+from itertools import chain, islice
+from multiprocessing import shared_memory
+import numpy as np
+
+def shareArrays(arrays):
+    '''Copies every array of the dictionary arrays into its own block of shared
+    memory. Returns (blocks, specs): the SharedMemory blocks, which the caller
+    must close and unlink when done, and the {name: (block name, shape, dtype)}
+    specs that attachArrays uses in another process.'''
+    blocks = []
+    specs = {}
+    for (name, array) in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def attachArrays(specs):
+    '''Maps the shared memory blocks of shareArrays back to read only arrays
+    without copying. Returns (blocks, arrays), blocks must be kept alive for
+    as long as the arrays are used.'''
+    blocks = []
+    arrays = {}
+    for (name, (blockName, shape, dtype)) in specs.items():
+        block = shared_memory.SharedMemory(name=blockName)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        blocks.append(block)
+        arrays[name] = array
+    return blocks, arrays
+
+def releaseArrays(blocks):
+    '''Closes and unlinks the blocks created by shareArrays'''
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+#State of a worker process, set once by initWorker.
+_worker = {}
+
+def initWorker(meta, specs):
+    '''Pool initializer, rebuilds the recommender on top of the shared arrays.
+    A trained neighbor index is rebuilt from its shared arrays, not trained
+    again, see Recommender.fromModelState.'''
+    from Recommender import Recommender
+    blocks, arrays = attachArrays(specs)
+    _worker['blocks'] = blocks
+    _worker['recommender'] = Recommender.fromModelState(meta, arrays)
+
+def recommendChunk(task):
+    '''Recommends for a chunk of users inside a worker'''
+    (users, method) = task
+    recommender = _worker['recommender']
+    return [(user, recommender.recommendUser(user, method)) for user in users]
+
+def userChunks(users, chunksize):
+    '''Yields lists of up to chunksize users from any iterable of users'''
+    users = iter(users)
+    while True:
+        chunk = list(islice(users, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+def recommendAll(recommender, users, method='knn', workers=None, chunksize=64):
+    '''Generator of (user, recommendations) for every user in users, in order.
+    The model state of recommender is copied into shared memory once, then
+    chunks of chunksize users are sent to a pool of workers processes that all
+    read the same pages. users can be any iterable, it is read a chunk at a
+    time and at most two chunks per worker are in flight, a new chunk is only
+    sent once the oldest one has been yielded. The memory held for results
+    is bounded by those chunks for any number of users. With workers of 1
+    the users are scored in this process.'''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = userChunks(users, chunksize)
+    first = list(islice(chunks, 2))
+    chunks = chain(first, chunks)
+    if workers <= 1 or len(first) <= 1:
+        for chunk in chunks:
+            for user in chunk:
+                yield user, recommender.recommendUser(user, method)
+        return
+    meta, arrays = recommender.modelState()
+    blocks, specs = shareArrays(arrays)
+    try:
+        with multiprocessing.Pool(workers, initWorker, (meta, specs)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(recommendChunk, ((chunk, method),)))
+                if len(pending) >= 2 * workers:
+                    for result in pending.popleft().get():
+                        yield result
+            while pending:
+                for result in pending.popleft().get():
+                    yield result
+    finally:
+        releaseArrays(blocks)
+
+def writeRecommendations(results, filename):
+    '''Writes (user, recommendations) pairs to a csv file with the columns
+    User, Rank, Title and Rating as they arrive. Returns the number of users.'''
+    users = 0
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['User', 'Rank', 'Title', 'Rating'])
+        for (user, recommendations) in results:
+            for (rank, (title, rating)) in enumerate(recommendations, 1):
+                writer.writerow([user, rank, title, rating])
+            users += 1
+    return users
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+from math import isnan
+import numpy as np
+
+def isMissing(rating):
+    '''Returns True when a rating cell holds no rating. Empty cells arrive as
+    NaN from pandas, as None, or as an empty string from a csv reader.'''
+    if rating is None or rating == '':
+        return True
+    return isnan(rating)
+
+def coRated(row1, row2):
+    '''Returns the ratings two rows have in common as two aligned arrays.
+    row1 and row2 are (item ids, ratings) pairs with sorted item ids.'''
+    common, i, j = np.intersect1d(row1[0], row2[0], assume_unique=True,
+                                  return_indices=True)
+    return row1[1][i], row2[1][j]
+
+def pairedRatings(row1, row2, missing='absent'):
+    '''Returns the ratings two rows are compared on as two aligned arrays
+    under a missing value policy, see Neighbors.MISSING_POLICIES. 'absent'
+    keeps the co-rated items, 'zero' every item either row rated with 0 for
+    the rating a row lacks.'''
+    if missing == 'absent':
+        return coRated(row1, row2)
+    union = np.union1d(row1[0], row2[0])
+    x = np.zeros(len(union))
+    y = np.zeros(len(union))
+    x[np.searchsorted(union, row1[0])] = row1[1]
+    y[np.searchsorted(union, row2[0])] = row2[1]
+    return x, y
+
+#Changes to at most this many ratings are written row by row, see
+#RatingMatrix.applyChanges, larger batches are merged in one pass.
+ROW_CHANGES_LIMIT = 16
+
+def mergeRatings(stored, values, keys, ratings):
+    '''Merges changes into sorted (key, value) arrays in one pass.
+    keys are sorted and unique, a NaN rating removes its key, any other
+    rating replaces or inserts it. Returns the new (keys, values).'''
+    positions = np.searchsorted(stored, keys)
+    found = positions < len(stored)
+    found[found] = stored[positions[found]] == keys[found]
+    removed = np.isnan(ratings)
+    values = values.copy()
+    values[positions[found & ~removed]] = ratings[found & ~removed]
+    kept = np.ones(len(stored), dtype=bool)
+    kept[positions[found & removed]] = False
+    inserted = ~found & ~removed
+    stored = stored[kept]
+    at = np.searchsorted(stored, keys[inserted])
+    return (np.insert(stored, at, keys[inserted]),
+            np.insert(values[kept], at, ratings[inserted]))
+
+def spliceRow(indptr, indices, values, row, rowIndices, rowValues):
+    '''Replaces one row of compressed (indptr, indices, values) arrays and
+    returns the arrays. A row that keeps its length is written in place,
+    otherwise only the ratings after it move. Read only arrays are copied
+    rather than written.'''
+    start = indptr[row]
+    stop = indptr[row + 1]
+    delta = len(rowIndices) - (stop - start)
+    if delta == 0 and indices.flags.writeable and values.flags.writeable:
+        indices[start:stop] = rowIndices
+        values[start:stop] = rowValues
+        return indptr, indices, values
+    indices = np.concatenate([indices[:start], rowIndices.astype(indices.dtype),
+                              indices[stop:]])
+    values = np.concatenate([values[:start], rowValues, values[stop:]])
+    if delta:
+        if not indptr.flags.writeable:
+            indptr = indptr.copy()
+        indptr[row + 1:] += delta
+    return indptr, indices, values
+
+#------------------------------------------------------------------------------
+#Start of RatingMatrix class
+class RatingMatrix:
+    def __init__(self, users, items, indptr, indices, values):
+        '''Sparse user x item rating matrix.
+        users and items are lists of names, the position of a name is its id.
+        indptr, indices and values are the CSR arrays of the matrix, the
+        ratings of user u are values[indptr[u]:indptr[u+1]] for the item ids
+        in indices[indptr[u]:indptr[u+1]] which are sorted ascending.
+        Only real ratings are stored, there are no NaN placeholders.
+        Use RatingMatrix.fromDict to build one from {'User' : {'Item': rating}}'''
+        self.users = list(users)
+        self.items = list(items)
+        self.userIndex = {name: i for (i, name) in enumerate(self.users)}
+        self.itemIndex = {name: i for (i, name) in enumerate(self.items)}
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float64)
+        self._csc = None
+
+    @classmethod
+    def fromDict(cls, data):
+        '''Builds a RatingMatrix from a dictionary of the form
+        {'User' : {'ItemKey': rating}}. Missing ratings are dropped.
+        Users and items are numbered in the order they are first seen, an item
+        key with only missing ratings still gets an id.'''
+        users = []
+        items = []
+        itemIndex = {}
+        indptr = [0]
+        indices = []
+        values = []
+        for (user, ratings) in data.items():
+            users.append(user)
+            row = []
+            for (item, rating) in ratings.items():
+                if item not in itemIndex:
+                    itemIndex[item] = len(items)
+                    items.append(item)
+                if isMissing(rating):
+                    continue
+                row.append((itemIndex[item], float(rating)))
+            row.sort()
+            for (itemID, rating) in row:
+                indices.append(itemID)
+                values.append(rating)
+            indptr.append(len(indices))
+        return cls(users, items, indptr, indices, values)
+
+    @classmethod
+    def fromTriplets(cls, users, items, userIDs, itemIDs, ratings):
+        '''Builds a RatingMatrix from parallel arrays of user ids, item ids and
+        ratings. users and items are the lists of names for the ids. When a
+        (user, item) pair appears more than once the last rating wins.'''
+        userIDs = np.asarray(userIDs, dtype=np.int32)
+        itemIDs = np.asarray(itemIDs, dtype=np.int32)
+        order = np.lexsort((itemIDs, userIDs))
+        userIDs = userIDs[order]
+        itemIDs = itemIDs[order]
+        ratings = np.asarray(ratings, dtype=np.float64)[order]
+        del order
+        last = np.ones(len(userIDs), dtype=bool)
+        last[:-1] = (userIDs[1:] != userIDs[:-1]) | (itemIDs[1:] != itemIDs[:-1])
+        userIDs = userIDs[last]
+        indptr = np.zeros(len(users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(userIDs, minlength=len(users)), out=indptr[1:])
+        return cls(users, items, indptr, itemIDs[last], ratings[last])
+
+    @property
+    def numUsers(self):
+        return len(self.users)
+
+    @property
+    def numItems(self):
+        return len(self.items)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    def userRow(self, userID):
+        '''Returns the (item ids, ratings) arrays of the user with id userID.
+        Both arrays are views into the matrix and should not be modified.'''
+        start = self.indptr[userID]
+        stop = self.indptr[userID + 1]
+        return self.indices[start:stop], self.values[start:stop]
+
+    def rowUserIDs(self):
+        '''Returns the user id of every stored rating in CSR order'''
+        return np.repeat(np.arange(self.numUsers, dtype=np.int32),
+                         np.diff(self.indptr))
+
+    def userAverages(self):
+        '''Returns the average rating of every user, 0 for users without ratings'''
+        ratingsSum = np.bincount(self.rowUserIDs(), weights=self.values,
+                                 minlength=self.numUsers)
+        n = np.diff(self.indptr)
+        return np.divide(ratingsSum, n, out=np.zeros(self.numUsers), where=n > 0)
+
+    @property
+    def csc(self):
+        '''The (colptr, user ids, ratings) CSC arrays of the matrix. Built on
+        first use and kept until the ratings change.'''
+        if self._csc is None:
+            order = np.argsort(self.indices, kind='stable')
+            counts = np.bincount(self.indices, minlength=self.numItems)
+            colptr = np.zeros(self.numItems + 1, dtype=np.int64)
+            np.cumsum(counts, out=colptr[1:])
+            self._csc = (colptr, self.rowUserIDs()[order], self.values[order])
+        return self._csc
+
+    def itemColumn(self, itemID):
+        '''Returns the (user ids, ratings) arrays of the item with id itemID'''
+        colptr, userIDs, ratings = self.csc
+        start = colptr[itemID]
+        stop = colptr[itemID + 1]
+        return userIDs[start:stop], ratings[start:stop]
+
+    def sparseFromDict(self, ratings, positions=False):
+        '''Converts a dictionary of the form {'ItemKey': rating} to a sorted
+        (item ids, ratings) pair. Missing ratings and items that are not in
+        the matrix are dropped.
+        With positions a third array holds the place of every kept item in
+        the iteration order of the dictionary.'''
+        row = []
+        for (item, rating) in ratings.items():
+            if item in self.itemIndex and not isMissing(rating):
+                row.append((self.itemIndex[item], float(rating), len(row)))
+        row.sort()
+        itemIDs = np.array([itemID for (itemID, rating, place) in row], dtype=np.int32)
+        values = np.array([rating for (itemID, rating, place) in row], dtype=np.float64)
+        if positions:
+            places = np.array([place for (itemID, rating, place) in row], dtype=np.int64)
+            return itemIDs, values, places
+        return itemIDs, values
+
+    def userDict(self, userID):
+        '''Returns the ratings of the user with id userID as {'ItemKey': rating}'''
+        itemIDs, ratings = self.userRow(userID)
+        return {self.items[itemID]: float(rating)
+                for (itemID, rating) in zip(itemIDs, ratings)}
+
+    def denseBlock(self, start, stop, values=None):
+        '''Returns the rows of users start..stop-1 as a dense (ratings, mask)
+        pair of shape (stop - start) x numItems. Unrated cells are 0 in
+        ratings and False in mask. values replaces the stored ratings when
+        given, it must be in CSR order like self.values.'''
+        if values is None:
+            values = self.values
+        lo = self.indptr[start]
+        hi = self.indptr[stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(self.indptr[start:stop + 1]))
+        ratings = np.zeros((stop - start, self.numItems))
+        mask = np.zeros((stop - start, self.numItems), dtype=bool)
+        ratings[rows, self.indices[lo:hi]] = values[lo:hi]
+        mask[rows, self.indices[lo:hi]] = True
+        return ratings, mask
+
+    def internUser(self, user):
+        '''Returns the id of user, adding the user with no ratings if needed'''
+        return int(self.internUsers([user])[0])
+
+    def internItem(self, item):
+        '''Returns the id of item, adding the item with no ratings if needed'''
+        return int(self.internItems([item])[0])
+
+    def internUsers(self, users):
+        '''Returns the ids of a sequence of users as an array, the users that
+        are new are added with no ratings'''
+        numUsers = self.numUsers
+        for user in users:
+            if user not in self.userIndex:
+                self.userIndex[user] = len(self.users)
+                self.users.append(user)
+        if self.numUsers > numUsers:
+            self.indptr = np.concatenate([self.indptr,
+                                          np.full(self.numUsers - numUsers, self.indptr[-1])])
+        return np.array([self.userIndex[user] for user in users], dtype=np.int64)
+
+    def internItems(self, items):
+        '''Returns the ids of a sequence of items as an array, the items that
+        are new are added with no ratings'''
+        numItems = self.numItems
+        for item in items:
+            if item not in self.itemIndex:
+                self.itemIndex[item] = len(self.items)
+                self.items.append(item)
+        if self.numItems > numItems and self._csc is not None:
+            colptr, userIDs, ratings = self._csc
+            colptr = np.concatenate([colptr, np.full(self.numItems - numItems, colptr[-1])])
+            self._csc = (colptr, userIDs, ratings)
+        return np.array([self.itemIndex[item] for item in items], dtype=np.int64)
+
+    def getRating(self, userID, itemID):
+        '''Returns the rating user userID gave item itemID or None'''
+        position = self._position(userID, itemID)
+        if position is None:
+            return None
+        return float(self.values[position])
+
+    def setRating(self, userID, itemID, rating):
+        '''Sets the rating user userID gave item itemID and returns the
+        previous rating or None if there was none.
+        The arrays are never written when they are read only, e.g. memory
+        mapped by Recommender.load: new arrays are built and only assigned
+        once they are complete, so a failure leaves the matrix as it was.'''
+        position = self._position(userID, itemID)
+        if position is not None:
+            previous = float(self.values[position])
+            if not self.values.flags.writeable:
+                self.values = self.values.copy()
+            self.values[position] = rating
+            if self._csc is not None:
+                colptr, userIDs, ratings = self._csc
+                start = colptr[itemID]
+                stop = colptr[itemID + 1]
+                ratings[start + np.searchsorted(userIDs[start:stop], userID)] = rating
+            return previous
+        self.applyChanges([userID], [itemID], [rating])
+        return None
+
+    def removeRating(self, userID, itemID):
+        '''Removes the rating user userID gave item itemID and returns it or
+        None if there was none. Read only arrays are not written, see setRating.'''
+        position = self._position(userID, itemID)
+        if position is None:
+            return None
+        previous = float(self.values[position])
+        self.applyChanges([userID], [itemID], [np.nan])
+        return previous
+
+    def getRatings(self, userIDs, itemIDs):
+        '''Returns the ratings of many (user id, item id) pairs as an array,
+        NaN where there is none'''
+        positions = self._positions(userIDs, itemIDs)
+        ratings = np.full(len(positions), np.nan)
+        found = positions >= 0
+        ratings[found] = self.values[positions[found]]
+        return ratings
+
+    def applyChanges(self, userIDs, itemIDs, ratings):
+        '''Sets many ratings at once, a NaN rating removes the rating of its
+        pair. Every (user id, item id) pair must appear at most once.
+        A few changes are written row by row, only the rows of the changed
+        users (and the columns of the changed items when the CSC arrays are
+        built) are rewritten, see spliceRow. A batch of more than
+        ROW_CHANGES_LIMIT changes is sorted and merged into the CSR arrays in
+        one pass, O(nnz + changes log changes) for the whole batch rather
+        than O(nnz) per rating, and the CSC arrays are patched the same way
+        instead of being rebuilt. Read only arrays are not written, see
+        setRating.'''
+        userIDs = np.asarray(userIDs, dtype=np.int64)
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        if len(userIDs) <= ROW_CHANGES_LIMIT:
+            self._spliceChanges(userIDs, itemIDs, ratings)
+            return
+        numUsers = self.numUsers
+        numItems = self.numItems
+        keys = userIDs * numItems + itemIDs
+        order = np.argsort(keys)
+        stored = self.rowUserIDs().astype(np.int64) * numItems + self.indices
+        stored, values = mergeRatings(stored, self.values, keys[order], ratings[order])
+        indptr = np.zeros(numUsers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(stored // numItems, minlength=numUsers), out=indptr[1:])
+        indices = (stored % numItems).astype(np.int32)
+        csc = None
+        if self._csc is not None:
+            colptr, colUsers, colRatings = self._csc
+            columns = np.repeat(np.arange(numItems, dtype=np.int64), np.diff(colptr))
+            keys = itemIDs * numUsers + userIDs
+            order = np.argsort(keys)
+            stored, colRatings = mergeRatings(columns * numUsers + colUsers, colRatings,
+                                              keys[order], ratings[order])
+            colptr = np.zeros(numItems + 1, dtype=np.int64)
+            np.cumsum(np.bincount(stored // numUsers, minlength=numItems), out=colptr[1:])
+            csc = (colptr, (stored % numUsers).astype(np.int32), colRatings)
+        (self.indptr, self.indices, self.values, self._csc) = (indptr, indices, values, csc)
+
+    def _spliceChanges(self, userIDs, itemIDs, ratings):
+        '''applyChanges for a few changes, one row (and column) at a time'''
+        order = np.lexsort((itemIDs, userIDs))
+        arrays = (self.indptr, self.indices, self.values)
+        for userID in np.unique(userIDs).tolist():
+            changes = order[userIDs[order] == userID]
+            rowItems, rowValues = mergeRatings(
+                arrays[1][arrays[0][userID]:arrays[0][userID + 1]].astype(np.int64),
+                arrays[2][arrays[0][userID]:arrays[0][userID + 1]],
+                itemIDs[changes], ratings[changes])
+            arrays = spliceRow(*arrays, userID, rowItems, rowValues)
+        csc = self._csc
+        if csc is not None:
+            order = np.lexsort((userIDs, itemIDs))
+            for itemID in np.unique(itemIDs).tolist():
+                changes = order[itemIDs[order] == itemID]
+                (colptr, colUsers, colRatings) = csc
+                columnUsers, columnRatings = mergeRatings(
+                    colUsers[colptr[itemID]:colptr[itemID + 1]].astype(np.int64),
+                    colRatings[colptr[itemID]:colptr[itemID + 1]],
+                    userIDs[changes], ratings[changes])
+                csc = spliceRow(*csc, itemID, columnUsers, columnRatings)
+        (self.indptr, self.indices, self.values) = arrays
+        self._csc = csc
+
+    def _positions(self, userIDs, itemIDs):
+        '''Indices into indices/values of many (user id, item id) pairs, -1
+        where there is no rating. Every pair is searched for within its row
+        by a binary search that runs for all pairs together, so the cost
+        does not depend on nnz.'''
+        userIDs = np.asarray(userIDs, dtype=np.int64)
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        lo = self.indptr[userIDs]
+        stop = self.indptr[userIDs + 1]
+        hi = stop.copy()
+        last = max(self.nnz - 1, 0)
+        active = lo < hi
+        while active.any():
+            mid = (lo + hi) // 2
+            right = active & (self.indices[np.minimum(mid, last)] < itemIDs)
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+            active = lo < hi
+        found = lo < stop
+        found[found] = self.indices[lo[found]] == itemIDs[found]
+        return np.where(found, lo, -1)
+
+    def _position(self, userID, itemID):
+        '''Index into indices/values of a stored rating or None'''
+        start = self.indptr[userID]
+        stop = self.indptr[userID + 1]
+        position = start + np.searchsorted(self.indices[start:stop], itemID)
+        if position < stop and self.indices[position] == itemID:
+            return position
+        return None
+
+    def toDict(self):
+        '''Returns the matrix as a dictionary of the form {'User' : {'ItemKey': rating}}'''
+        return {user: self.userDict(userID) for (userID, user) in enumerate(self.users)}
+
+    #Read only mapping access so that r.data['User'] keeps working.
+    def __getitem__(self, user):
+        return self.userDict(self.userIndex[user])
+
+    def __contains__(self, user):
+        return user in self.userIndex
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def keys(self):
+        return list(self.users)
+#End of RatingMatrix class
+#------------------------------------------------------------------------------
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import csv
+from array import array
+from itertools import islice
+import numpy as np
+from RatingMatrix import RatingMatrix
+
+#------------------------------------------------------------------------------
+#Start of RatingMatrixBuilder class
+class RatingMatrixBuilder:
+    def __init__(self):
+        '''Collects ratings one chunk at a time and builds a RatingMatrix.
+        Names are interned as they arrive and the ids and ratings are kept in
+        typed arrays, 16 bytes per rating, instead of python objects.'''
+        self.users = []
+        self.items = []
+        self.userIndex = {}
+        self.itemIndex = {}
+        self.userIDs = array('i')
+        self.itemIDs = array('i')
+        self.ratings = array('d')
+
+    def internUsers(self, users):
+        '''Interns a sequence of user names and returns their ids'''
+        return intern(users, self.userIndex, self.users)
+
+    def internItems(self, items):
+        '''Interns a sequence of item names and returns their ids'''
+        return intern(items, self.itemIndex, self.items)
+
+    def addChunk(self, users, items, ratings):
+        '''Appends a chunk of ratings given as parallel sequences of user
+        names, item names and ratings (numbers or numeric strings)'''
+        self.userIDs.extend(self.internUsers(users))
+        self.itemIDs.extend(self.internItems(items))
+        self.ratings.frombytes(np.asarray(ratings, dtype=np.float64).tobytes())
+
+    @property
+    def nnz(self):
+        return len(self.ratings)
+
+    def build(self):
+        '''Returns the RatingMatrix of every rating added so far. The typed
+        arrays are handed to NumPy without a copy and released afterwards so
+        the peak is the collected ratings plus the sorted CSR arrays.'''
+        userIDs = np.frombuffer(self.userIDs, dtype=np.int32)
+        itemIDs = np.frombuffer(self.itemIDs, dtype=np.int32)
+        ratings = np.frombuffer(self.ratings, dtype=np.float64)
+        matrix = RatingMatrix.fromTriplets(self.users, self.items, userIDs, itemIDs, ratings)
+        del userIDs, itemIDs, ratings
+        self.userIDs = array('i')
+        self.itemIDs = array('i')
+        self.ratings = array('d')
+        return matrix
+#End of RatingMatrixBuilder class
+#------------------------------------------------------------------------------
+
+def intern(names, index, nameList):
+    '''Returns the ids of names in index, new names are numbered in the order
+    they are first seen and appended to nameList.'''
+    for name in dict.fromkeys(names):
+        if name not in index:
+            index[name] = len(nameList)
+            nameList.append(name)
+    return list(map(index.__getitem__, names))
+
+def readChunks(reader, chunkRows):
+    '''Yields lists of up to chunkRows rows from a csv reader'''
+    while True:
+        chunk = list(islice(reader, chunkRows))
+        if not chunk:
+            return
+        yield chunk
+
+def readWideCsv(filename, chunkRows=256, encoding='utf-8', builder=None):
+    '''Streams a wide csv file with one row per item and one column per user,
+    like Movie_Ratings.csv, into a RatingMatrix. The first column holds the
+    item names and the header holds the user names. Empty cells are skipped
+    while parsing so only real ratings are stored. When a user name appears
+    in more than one column the last column is used. Only chunkRows rows of
+    text are held at once. L_MovieData.csv needs encoding='latin-1'.'''
+    if builder is None:
+        builder = RatingMatrixBuilder()
+    with open(filename, newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        lastColumn = {}
+        for (column, user) in enumerate(header[1:], 1):
+            lastColumn[user] = column
+        #Column 0 holds the item and columns of repeated user names are hidden.
+        hidden = set(range(1, len(header))) - set(lastColumn.values())
+        hidden.add(0)
+        for chunk in readChunks(reader, chunkRows):
+            users = []
+            items = []
+            cells = []
+            for row in chunk:
+                rated = [column for (column, cell) in enumerate(row)
+                         if cell != '' and column not in hidden and column < len(header)]
+                users.extend([header[column] for column in rated])
+                items.extend([row[0]] * len(rated))
+                cells.extend([row[column] for column in rated])
+            builder.internItems([row[0] for row in chunk])
+            builder.addChunk(users, items, cells)
+    return builder.build()
+
+def readTripletCsv(filename, chunkRows=65536, encoding='utf-8', delimiter=',',
+                   builder=None):
+    '''Streams a long csv file of user,item,rating rows into a RatingMatrix.
+    A first row whose rating is not a number is taken as a header. Rows with
+    an empty rating are skipped and a repeated (user, item) pair keeps the
+    last rating. Only chunkRows rows of text are held at once.'''
+    if builder is None:
+        builder = RatingMatrixBuilder()
+    with open(filename, newline='', encoding=encoding) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        first = True
+        for chunk in readChunks(reader, chunkRows):
+            if first:
+                first = False
+                try:
+                    float(chunk[0][2])
+                except (ValueError, IndexError):
+                    chunk = chunk[1:]
+            chunk = [row for row in chunk if len(row) >= 3 and row[2] != '']
+            builder.addChunk([row[0] for row in chunk], [row[1] for row in chunk],
+                             [row[2] for row in chunk])
+    return builder.build()
@@ -3,31 +3,68 @@
 @author: johnjoegarza
 """
 from math import sqrt
-from math import isnan
-from numpy import nan
+import threading
 import time
-import pandas as pd
+import numpy as np
+from RatingMatrix import RatingMatrix, isMissing, pairedRatings
+from SlopeOne import SlopeOneModel
+from ItemSimilarity import (CosineAccumulators, ItemNeighbors, normalizeRatings,
+                            denormalizeRatings)
+from Neighbors import userDistances, checkMissingPolicy, postingRanges, LARGER_IS_CLOSER
+from Support import SupportCounts, shrinkScores
+from TopN import selectTop, topN, filterScores
+from AnnIndex import AnnIndex
+from ResultCache import ResultCache
+from Results import (resultRecords, concatRecords, recordsFrame, recommendationTable,
+                     writeRecords)
+from Instrumentation import Tracer, NULL_TRACER, profiled
 
 #------------------------------------------------------------------------------
 #Start of recommender class
 class Recommender:
-    def __init__(self, data, k=1, metric = 'pearson', n=5):
-        '''Initialize MovieRecommender
+    def __init__(self, data, k=1, metric = 'pearson', n=5, ratingScale=(1, 5),
+                 missing='absent', announce=True):
+        '''Initialize Recommender
         Data should be a dictionary of the form {'User' : {'ItemKey': rating}}
+        or a RatingMatrix. A dictionary is converted to a RatingMatrix where
+        NaN ratings are dropped, self.data['User'] still returns {'ItemKey': rating}
         param k is the k value for kth nearest neighbor
         param metric is which distance formula to use
         param n is the maximum number of recommendations to make
+        param ratingScale is the (lowest, highest) rating a user can give,
+        cosineSimPredict normalizes ratings with it
+        param missing is how the metrics treat an item only one of two users
+        rated, 'absent' compares co-rated items only and 'zero' reads the
+        missing rating as 0, see Neighbors.MISSING_POLICIES
+        param announce prints 'Pearson Default set' when the metric is pearson
+        like the metric setter, without it the metric is set quietly so callers
+        that build recommenders in threads do not have to capture stdout
         '''
         self.k = k
         self.n = n
-        self.username2id = {}
-        self.userid2name = {}
+        self.ratingScale = tuple(ratingScale)
+        self.missing = checkMissingPolicy(missing)
         self.productid2name = {}
-        self.metric = metric
-        self.frequencies = {}
-        self.deviations = {}
-        self.usersRatingAverages = {}
-        self.simMatrix = {}
+        if announce:
+            self.metric = metric
+        else:
+            self.__metric = metric if metric in ('manhattan', 'euclidean') else 'pearson'
+        self.slopeOne = None
+        self.usersRatingAverages = None
+        self._staleItems = set()
+        self._staleLock = threading.Lock()
+        self.simMatrix = None
+        self.cosineSums = None
+        self.recomputeEvery = None
+        self._similarityOptions = (None, 1, 'float64', 0.0)
+        self._updatesSinceRecompute = 0
+        self.annIndex = None
+        self.userSupport = None
+        self.itemSupport = None
+        self.min_overlap = 1
+        self.shrinkage = 0.0
+        self.cache = None
+        self.tracer = NULL_TRACER
         if self.metric == 'pearson' :
             self.fn = self.pearson
         elif self.metric == 'manhattan':
@@ -35,41 +72,79 @@ class Recommender:
         elif self.metric == 'euclidean':
             self.fn = self.euclidean
             
-        if type(data).__name__ == 'dict':
+        if isinstance(data, RatingMatrix):
             self.data = data
+        elif type(data).__name__ == 'dict':
+            self.data = RatingMatrix.fromDict(data)
+        self.username2id = self.data.userIndex
+        self.userid2name = self.data.users
             
-    def computeDeviations(self):
+    def computeDeviations(self, path=None, workers=None, userBlockSize=4096,
+                          itemBlockSize=None, deviationDtype='float64',
+                          frequencyDtype='int64', max_memory=None):
         '''Create a deviation matrix that will be used for the slope one
-        method.'''
-        for ratings in self.data.values():
-            for(item, rating) in ratings.items():
-                self.frequencies.setdefault(item,{})
-                self.deviations.setdefault(item,{})
-                
-                for(item2, rating2) in ratings.items():
-                    if item != item2 and not isnan(rating) and not isnan(rating2):
-                        self.frequencies[item].setdefault(item2, 0)
-                        self.deviations[item].setdefault(item2, 0.0)
-                        self.frequencies[item][item2] += 1
-                        self.deviations[item][item2] += rating - rating2
+        method. The model is built in one pass of batched matrix products,
+        see SlopeOneModel.fromRatings.
+        With path the model is built out of core for catalogs whose item x
+        item arrays do not fit in memory: users are processed in chunks by
+        workers processes, the partial sums are spilled to disk and merged
+        into memory mapped files in path, see SlopeOneModel.fromRatingsOnDisk.
+        weightedSlopeOne then only reads the rows of the rated items from
+        disk. save(path) to the same directory adds the rest of the model.
+        param deviationDtype and frequencyDtype are the storage dtypes of the
+        two item x item arrays, e.g. 'float32' and 'uint16'.
+        param max_memory is a budget in bytes for the two arrays, when given
+        the most precise dtypes that fit are picked in place of
+        deviationDtype and frequencyDtype, see SlopeOneModel.storageFor.
+        float16 deviations are only picked when the sums stay within 2048.
+        The arrays are filled itemBlockSize rows at a time in their storage
+        dtypes, see SlopeOneModel.fromRatings. With max_memory the row and
+        user blocks are sized to a quarter of the budget, so training peaks
+        near 1.25 times max_memory.'''
+        if max_memory is not None:
+            #No deviation sum exceeds the ratings of the most rated item
+            #times the rating span.
+            largestSum = 0.0
+            if self.data.nnz:
+                largestSum = (np.bincount(self.data.indices).max()
+                              * float(self.data.values.max() - self.data.values.min()))
+            deviationDtype, frequencyDtype = SlopeOneModel.storageFor(
+                self.data.numItems, self.data.numUsers, max_memory, largestSum)
+        blockSize = 512
+        if max_memory is not None and path is None:
+            #An eighth of the budget for the float64 row block, two sums and
+            #their products take 40 bytes per item and row, and an eighth for
+            #the dense block of users, 24 bytes per item and user.
+            numItems = max(self.data.numItems, 1)
+            blockSize = int(min(blockSize, max(1, max_memory // (8 * 24 * numItems))))
+            if itemBlockSize is None:
+                itemBlockSize = int(min(max(1, max_memory // (8 * 40 * numItems)),
+                                        max(1, (1 << 22) // numItems)))
+        with self.tracer.stage('train.deviations'):
+            if path is None:
+                self.slopeOne = SlopeOneModel.fromRatings(self.data, blockSize, deviationDtype,
+                                                          frequencyDtype, itemBlockSize)
+            else:
+                self.slopeOne = SlopeOneModel.fromRatingsOnDisk(self.data, path, userBlockSize,
+                                                                itemBlockSize, workers,
+                                                                deviationDtype, frequencyDtype)
 
-        for (item, ratings) in self.deviations.items():
-            for item2 in ratings:
-                ratings[item2] /= self.frequencies[item][item2]
+    @property
+    def deviations(self):
+        '''item x item array of average deviations indexed by item id'''
+        return self.slopeOne.deviations
+
+    @property
+    def frequencies(self):
+        '''item x item array of co-rating counts indexed by item id, a frequency
+        of 0 means the pair was never rated together'''
+        return self.slopeOne.frequencies
 
     def computeAverages(self):
-        '''Computes the average rating of a user and stores it in a dictionary with their user id
-        as the key'''
-        n = 0
-        ratingsSum = 0
-        for (userID, ratings) in self.data.items():
-            for (band, itemRating) in ratings.items():
-                if not isnan(itemRating):
-                    n+=1
-                    ratingsSum += itemRating
-            self.usersRatingAverages[userID] = float(ratingsSum/n)
-            n = 0
-            ratingsSum = 0
+        '''Computes the average rating of every user and stores it in an array
+        indexed by user id'''
+        with self.tracer.stage('train.averages'):
+            self.usersRatingAverages = self.data.userAverages()
 
     def convertProductID2name(self, id):
         '''Given product id number return product name'''
@@ -78,244 +153,663 @@ class Recommender:
         else:
             return id
         
+    def sparseRow(self, ratings):
+        '''Returns ratings as an (item ids, ratings) pair. ratings is either
+        already such a pair or a dictionary of the form {'ItemKey': rating}'''
+        if isinstance(ratings, dict):
+            return self.data.sparseFromDict(ratings)
+        return ratings
+
     def manhattan(self, rating1, rating2):
         '''Computes the Manhattan distance. Both rating1 and rating2
-        are dictionaries.'''
-        distance = 0
-        for key in rating1:
-            if isnan(rating1[key]) or isnan(rating2[key]):
-                continue
-            distance += abs(rating1[key] - rating2[key])
-        return distance
+        are (item ids, ratings) pairs or dictionaries.'''
+        x, y = pairedRatings(self.sparseRow(rating1), self.sparseRow(rating2),
+                             self.missing)
+        return float(np.abs(x - y).sum())
                 
     def euclidean(self, rating1, rating2):
         '''Computes the distance of two neighbors using euclidean
         distance metric'''
-        commonRatings = False
-        distance = 0
-        for key in rating1:
-            if isnan(rating1[key]) or isnan(rating2[key]):
-                continue
-            distance += (rating1[key] - rating2[key])**(2)
-            commonRatings = True
-        if commonRatings:
-            return distance**(1/2)
-        else:
+        x, y = pairedRatings(self.sparseRow(rating1), self.sparseRow(rating2),
+                             self.missing)
+        if len(x) == 0:
             return 0 #The event that there are no ratings in common.
+        return float(((x - y)**2).sum())**(1/2)
     
     def pearson(self, rating1, rating2):
         '''Calculates the approximation to the pearson correlation coefficient
-        between rating1 and rating2 which are both dictionaries.
+        between rating1 and rating2 which are (item ids, ratings) pairs or
+        dictionaries.
         Refer to the pearson formula for clarification of the method.'''
-        sumXY = 0
-        sumX = 0
-        sumY = 0
-        sumX2 = 0
-        sumY2 = 0
-        n = 0
-        for key in rating1:
-            if isnan(rating1[key]) or isnan(rating2[key]):
-                continue
-            n+= 1
-            x = rating1[key]
-            y = rating2[key]
-            sumXY += x * y
-            sumX += x
-            sumY += y
-            sumX2 += pow(x, 2)
-            sumY2 += pow(y, 2)
+        x, y = pairedRatings(self.sparseRow(rating1), self.sparseRow(rating2),
+                             self.missing)
+        n = len(x)
         if n == 0:
             return 0
+        sumXY = float(np.dot(x, y))
+        sumX = float(x.sum())
+        sumY = float(y.sum())
+        sumX2 = float(np.dot(x, x))
+        sumY2 = float(np.dot(y, y))
 
-        denominator = (sqrt(sumX2 - pow(sumX,2)/n)
-                    * sqrt(sumY2 - pow(sumY, 2)/n))
+        denominator = (sqrt(max(sumX2 - pow(sumX,2)/n, 0.0))
+                    * sqrt(max(sumY2 - pow(sumY, 2)/n, 0.0)))
         if denominator == 0:
             return 0
         else:
             return (sumXY - (sumX * sumY) / n) / denominator
 
-    def computeNearestNeighbor(self, username):
+    def computeNearestNeighbor(self, username, k=None):
         '''Creates a sorted list of users based on their distance to 
-        username'''
-        distances = []
-        for instance in self.data:
-            if instance != username:
-                distance = self.fn(self.data[username], self.data[instance])
-                distances.append((instance, distance))
-        #Pearson requires greater numbers while euclidean and manhattan require
-        #smaller numbers.
-        if self.metric == 'pearson':
-            distances.sort(key=lambda artistTuple: artistTuple[1], reverse = True)
-        elif self.metric == 'manhattan' or self.metric == 'euclidean':
-            distances.sort(key=lambda artistTuple: artistTuple[1], reverse = False)
-        return distances
+        username. When k is given only the k nearest users are returned and
+        only those are sorted.'''
+        return self.computeNearestNeighbors([username], k)[0]
+
+    def computeNearestNeighbors(self, usernames, k=None):
+        '''computeNearestNeighbor for a batch of users at once. The distances
+        from every user in usernames to every other user are computed as one
+        block, see Neighbors.userDistances. Returns one sorted list of
+        (user, distance) per user in usernames.
+        With the cache enabled only the users without a cached list are computed.
+        With enableApproximateNeighbors and a k only the users the index
+        finds are scored. With computeSupport only the users that share at
+        least min_overlap items with the user are scored and the distances
+        are shrunk by the overlap.'''
+        neighbors = [None] * len(usernames)
+        missing = []
+        for (position, username) in enumerate(usernames):
+            cached = None
+            if self.cache is not None:
+                cached = self.cache.get(('neighbors', username, self.metric, k))
+                self.tracer.count('cacheMisses' if cached is None else 'cacheHits')
+            if cached is None:
+                missing.append(position)
+            else:
+                neighbors[position] = list(cached)
+        if not missing:
+            return neighbors
+        userIDs = [self.data.userIndex[usernames[position]] for position in missing]
+        if self.annIndex is not None and k is not None:
+            return self._approximateNeighbors(usernames, k, neighbors, missing, userIDs)
+        if self.userSupport is not None:
+            return self._supportedNeighbors(usernames, k, neighbors, missing, userIDs)
+        with self.tracer.stage('neighbors.distances'):
+            distances = userDistances(self.data, [self.data.userRow(userID) for userID in userIDs],
+                                      self.metric, self.missing)
+        self.tracer.count('pairsCompared', len(userIDs) * (self.data.numUsers - 1))
+        with self.tracer.stage('neighbors.select'):
+            for (position, row, userID) in zip(missing, distances, userIDs):
+                others = np.delete(np.arange(self.data.numUsers), userID)
+                nearest = others[selectTop(row[others], k, LARGER_IS_CLOSER[self.metric])]
+                self._keepNeighbors(usernames[position], k, neighbors, position, nearest,
+                                    row[nearest])
+        return neighbors
+
+    def _keepNeighbors(self, username, k, neighbors, position, nearest, distances):
+        '''Stores the neighbor list of username at position and caches it'''
+        neighbors[position] = [(self.data.users[instanceID], float(distance))
+                               for (instanceID, distance) in zip(nearest, distances)]
+        if self.cache is not None:
+            self.cache.put(('neighbors', username, self.metric, k), list(neighbors[position]),
+                           self._cacheTags(username, neighbors[position]))
     
-    def recommend(self, user):
-        '''Creates a list of recommendations for the given user'''
-        recommendations = {}
-        nearest = self.computeNearestNeighbor(user)
-        userRatings = self.data[user]
+    def _approximateNeighbors(self, usernames, k, neighbors, missing, userIDs):
+        '''computeNearestNeighbors for the users at the positions missing
+        through self.annIndex'''
+        with self.tracer.stage('neighbors.distances'):
+            found = self.annIndex.query([self.data.userRow(userID) for userID in userIDs], k,
+                                        self.metric, self.missing, userIDs, self.userSupport,
+                                        self.min_overlap, self.shrinkage)
+        with self.tracer.stage('neighbors.select'):
+            for (position, (nearest, distances)) in zip(missing, found):
+                self._keepNeighbors(usernames[position], k, neighbors, position, nearest,
+                                    distances)
+        return neighbors
+
+    def _supportedNeighbors(self, usernames, k, neighbors, missing, userIDs):
+        '''computeNearestNeighbors for the users at the positions missing
+        through self.userSupport, only the users sharing min_overlap items
+        with each user are scored'''
+        largerIsCloser = LARGER_IS_CLOSER[self.metric]
+        with self.tracer.stage('neighbors.distances'):
+            candidates = [self.userSupport.candidates(userID, self.min_overlap)
+                          for userID in userIDs]
+            distances = userDistances(self.data, [self.data.userRow(userID) for userID in userIDs],
+                                      self.metric, self.missing,
+                                      [others for (others, overlap) in candidates])
+        self.tracer.count('pairsCompared', sum(len(others) for (others, overlap) in candidates))
+        with self.tracer.stage('neighbors.select'):
+            for (position, row, (others, overlap)) in zip(missing, distances, candidates):
+                scores = shrinkScores(row[others], overlap, self.shrinkage, largerIsCloser)
+                top = selectTop(scores, k, largerIsCloser)
+                self._keepNeighbors(usernames[position], k, neighbors, position, others[top],
+                                    scores[top])
+        return neighbors
+
+    def computeSupport(self, min_overlap=1, shrinkage=0.0):
+        '''Counts the items every pair of users rated in common and the users
+        that rated every pair of items once, see Support.SupportCounts, and
+        uses the counts everywhere a pair is compared:
+        the neighbor search only scores the users that share at least
+        min_overlap items with the user, so a user can end up with fewer
+        than k neighbors, weightedSlopeOne leaves out pairs of items rated
+        together by fewer than min_overlap users, computeSimilarityMatrix
+        uses min_overlap as its default min_support and cosineSimilarity
+        returns 0 for such pairs without reading their ratings.
+        param shrinkage is the significance weighting of the kept pairs, a
+        pearson correlation or item similarity backed by n ratings is scaled
+        by n / (n + shrinkage) and a manhattan or euclidean distance divided
+        by it, so two users with one rating in common no longer come out as
+        the closest. It applies to computeSimilarityMatrix calls made after
+        this one.
+        Only the pairs sharing at least min_overlap ratings are kept, as
+        sparse rows of 6 bytes per pair with uint16 counts or as a dense
+        matrix of 2 bytes per pair of users (items) when that is smaller, so
+        a larger min_overlap also bounds the memory, see Support.SupportCounts.
+        The counts follow add_rating, remove_rating and apply_updates.
+        Cached neighbor lists are dropped. Returns (userSupport, itemSupport).'''
+        if min_overlap < 1:
+            raise ValueError('min_overlap must be at least 1')
+        with self.tracer.stage('train.support'):
+            self.userSupport = SupportCounts.users(self.data, min_overlap)
+            self.itemSupport = SupportCounts.items(self.data, min_overlap)
+        self.min_overlap = min_overlap
+        self.shrinkage = shrinkage
+        if self.cache is not None:
+            self.cache.invalidate(('metric', self.metric))
+        return self.userSupport, self.itemSupport
+
+    def enableApproximateNeighbors(self, clusters=None, probes=4, iterations=10, seed=0):
+        '''Finds the k nearest neighbors of recommend and computeNearestNeighbor
+        with a k through an inverted file index instead of comparing every
+        user, see AnnIndex. Only the users of the probes clusters closest to
+        the query are scored with the exact metric, more probes raise the
+        recall and cost more candidates. The index follows add_rating,
+        update_rating, remove_rating and apply_updates. Cached neighbor lists
+        are dropped. Returns the index.'''
+        self.annIndex = AnnIndex(self.data, clusters, probes, self.missing, iterations,
+                                 seed=seed)
+        self._annOptions = {'clusters': len(self.annIndex.centroids), 'probes': probes,
+                            'iterations': iterations, 'seed': seed}
+        if self.cache is not None:
+            self.cache.invalidate(('metric', self.metric))
+        return self.annIndex
+
+    def disableApproximateNeighbors(self):
+        '''Goes back to the exact neighbor search'''
+        self.annIndex = None
+        if self.cache is not None:
+            self.cache.invalidate(('metric', self.metric))
+
+    def recommend(self, user, profile=False, exclude=None, min_support=None,
+                  min_rating=None):
+        '''Creates a list of recommendations for the given user
+        With profile the result is (recommendations, breakdown) where breakdown
+        holds the time of every stage and the counters of this call.
+        Filters are applied to the scores before the top n are picked:
+        param exclude is a list of items that must not be recommended
+        param min_support drops items fewer than min_support neighbors rated
+        param min_rating drops items that score below it'''
+        if profile:
+            return profiled(self.recommend, user, exclude=exclude, min_support=min_support,
+                            min_rating=min_rating)
+        return self.recommendBatch([user], exclude, min_support, min_rating)[0]
+
+    def recommendBatch(self, users, exclude=None, min_support=None, min_rating=None):
+        '''recommend for a batch of users. The neighbors of the users that are
+        not cached are found together, see computeNearestNeighbors. Returns
+        one list of recommendations per user in users. Filtered lists are not
+        cached.'''
+        filters = (exclude, min_support, min_rating)
+        cache = self.cache if filters == (None, None, None) else None
+        recommendations = [None] * len(users)
+        missing = []
+        for (position, user) in enumerate(users):
+            cached = None
+            if cache is not None:
+                cached = cache.get(('recommend', user, self.metric, self.k, self.n))
+                self.tracer.count('cacheMisses' if cached is None else 'cacheHits')
+            if cached is None:
+                missing.append(position)
+            else:
+                recommendations[position] = list(cached)
+        if missing:
+            nearest = self.computeNearestNeighbors([users[position] for position in missing],
+                                                   self.k)
+            for (position, neighbors) in zip(missing, nearest):
+                recommendations[position] = self._knnRecommend(users[position], neighbors,
+                                                               filters)
+                if cache is not None:
+                    cache.put(('recommend', users[position], self.metric, self.k, self.n),
+                              list(recommendations[position]),
+                              self._cacheTags(users[position], neighbors[:self.k]))
+        return recommendations
+
+    def knnScores(self, users):
+        '''Scores every item for a batch of users like recommend, before the
+        top n are picked. Returns a len(users) x numItems array, NaN for the
+        items no neighbor rated, the items the user rated and every item of a
+        user whose neighbors are all at distance 0. The neighbors are found
+        together, see computeNearestNeighbors. Evaluation scores held out
+        ratings with it.'''
+        scores = np.full((len(users), self.data.numItems), np.nan)
+        for (row, user, nearest) in zip(scores, users,
+                                        self.computeNearestNeighbors(users, self.k)):
+            if sum(distance for (name, distance) in nearest[:self.k]) != 0:
+                row[:] = self._knnScores(user, nearest)[0]
+        return scores
+
+    def _knnScores(self, user, nearest):
+        '''(scores, support, first neighbor) arrays by item id of the items
+        the k nearest neighbors of user rated and user did not, the support
+        of an item is the number of neighbors that rated it. Items nobody
+        scored are NaN. first neighbor is the index of the first of the
+        neighbors that rated an item, equal scores are listed in that order
+        like the dictionary based version did.'''
+        userItems, userRatings = self.data.userRow(self.data.userIndex[user])
+        rated = np.zeros(self.data.numItems, dtype=bool)
+        rated[userItems] = True
+        scores = np.zeros(self.data.numItems)
+        support = np.zeros(self.data.numItems, dtype=np.int64)
+        firstNeighbor = np.full(self.data.numItems, self.k)
         totalDistance = 0.0
+        #With computeSupport a user can have fewer than k neighbors.
+        k = min(self.k, len(nearest))
         
-        for i in range(self.k):
+        for i in range(k):
             totalDistance += nearest [i][1]
         
-        for i in range(self.k):
+        for i in range(k):
             weight = nearest[i][1] / totalDistance
             name = nearest[i][0]
-            neighborRatings = self.data[name]
+            neighborItems, neighborRatings = self.data.userRow(self.data.userIndex[name])
+            unrated = ~rated[neighborItems]
+            scores[neighborItems[unrated]] += neighborRatings[unrated] * weight
+            support[neighborItems[unrated]] += 1
+            np.minimum.at(firstNeighbor, neighborItems[unrated], i)
+        scores[support == 0] = np.nan
+        return scores, support, firstNeighbor
 
-            for artist in neighborRatings:
-                if isnan(neighborRatings[artist]):
-                    continue
-                if isnan(userRatings[artist]):
-                    if artist not in recommendations:
-                        recommendations[artist] = (neighborRatings[artist] * weight)
-                    else:
-                        recommendations[artist] = (recommendations[artist] +
-                            neighborRatings[artist] * weight)
-                
+    def _knnRecommend(self, user, nearest, filters=(None, None, None), names=True):
+        '''Scores the items the k nearest neighbors of user rated and user did
+        not, see _knnScores, and picks the top n.
+        Without names the result is (item ids, scores), see _topRecommendations'''
+        with self.tracer.stage('knn.score'):
+            scores, support, firstNeighbor = self._knnScores(user, nearest)
+            self.tracer.count('itemsScored', int(np.count_nonzero(support)))
+            self._filterScores(scores, support, *filters)
 
-        recommendations = list(recommendations.items())
-        recommendations = [(self.convertProductID2name(key), round(value,2)) 
-                            for (key, value) in recommendations]
-        recommendations.sort(key=lambda artistTuple: artistTuple[1], reverse = True)
-        
-        return recommendations[:self.n]
+        with self.tracer.stage('knn.sort'):
+            return self._topRecommendations(scores, 2, firstNeighbor, names)
+
+    def _filterScores(self, scores, support, exclude=None, min_support=None, min_rating=None):
+        '''Applies the recommendation filters to an array of scores by item id,
+        see recommend and TopN.filterScores'''
+        if exclude is not None:
+            exclude = [self.data.itemIndex[item] for item in exclude
+                       if item in self.data.itemIndex]
+        return filterScores(scores, exclude, support, min_support, min_rating)
+
+    def _topRecommendations(self, scores, decimals=None, tieOrder=None, names=True):
+        '''The n best (name, score) pairs of an array of scores by item id.
+        Names are looked up and scores rounded only for those n items.
+        Without names the (item ids, scores) of TopN.topN are returned.'''
+        itemIDs, values = topN(scores, self.n, decimals, tieOrder)
+        if not names:
+            return itemIDs, values
+        return [(self.convertProductID2name(self.data.items[itemID]), value)
+                for (itemID, value) in zip(itemIDs, values)]
+
+    def enableTracing(self, sink=None):
+        '''Starts collecting stage times and counters (pairs compared, items
+        scored, cache hits and misses) on self.tracer, see Instrumentation.Tracer.
+        sink is an optional callable that receives every event. While tracing
+        is disabled the stages cost one context variable lookup.'''
+        self.tracer = Tracer(sink)
+        return self.tracer
+
+    def disableTracing(self):
+        self.tracer = NULL_TRACER
+
+    def enableCache(self, maxsize=1024, ttl=None):
+        '''Caches neighbor lists and recommendation lists keyed by
+        (user, metric, k, n), see ResultCache. When a user's ratings change the
+        entries of that user and every cached list that contains the user are
+        dropped. A list that did not contain the user can still go stale if the
+        user's new ratings would now place them in it, use ttl to bound how
+        long that can last.'''
+        self.cache = ResultCache(maxsize, ttl)
+        return self.cache
+
+    def invalidateUser(self, user):
+        '''Drops the cached lists of user and every cached list containing user'''
+        if self.cache is not None:
+            self.cache.invalidate(('user', user))
 
-    def recommenderTable(self, username):
+    def _cacheTags(self, user, neighbors):
+        '''Tags of a cached list: its user, its metric and the neighbors in it'''
+        tags = [('user', user), ('metric', self.metric)]
+        tags.extend(('user', name) for (name, distance) in neighbors)
+        return tags
+
+    def recommenderTable(self, username, profile=False):
         '''Creates a table of recommendations for readability'''
-        titles = []
-        ratings = []
+        if profile:
+            return profiled(self.recommenderTable, username)
         aList = self.recommend(username)
-        for recommend in aList:
-            titles.append(recommend[0])
-            ratings.append(recommend[1])
-        dataTable = pd.DataFrame({'Title':titles, 'Rating': ratings})
-        dataTable = dataTable.reindex(columns = ['Title', 'Rating'])
-        return dataTable.set_index('Title')
+        with self.tracer.stage('table'):
+            return recommendationTable(aList)
         
-    def weightedSlopeOne(self, userRatings):
+    def weightedSlopeOne(self, userRatings, profile=False, exclude=None, min_support=None,
+                         min_rating=None):
         '''Computes weighted Slope One of a user and returns a prediciton of 
         what a user may rate items they haven't rated yet. Only returns the top
         'n' items. 
         userRatings should be a dictionary of the form {'item': rating,...} which
         represents the items that one user has rated.
         self.computeDeviations() method should be called before this method is
-        called or else this method will not work.'''
-        recommendations = {}
-        currentFreq = {}
-        for(userItem, userRating) in userRatings.items():
-            if not isnan(userRating ):
-                for(diffItem, diffRatings) in self.deviations.items():
-                    if (diffItem not in userRatings or isnan(userRatings[diffItem])) and userItem in self.deviations[diffItem]:
-                        freq = self.frequencies[diffItem][userItem]
-                        recommendations.setdefault(diffItem, 0.0)
-                        currentFreq.setdefault(diffItem, 0)
-                        
-                        recommendations[diffItem] += (diffRatings[userItem] + userRating) * freq
-                        currentFreq[diffItem] += freq
-
-        recommendations = [(self.convertProductID2name(k),
-                           v/currentFreq[k]) 
-                            for (k, v) in recommendations.items()]
-
-        recommendations.sort(key = lambda artistTuple: artistTuple[1],
-                             reverse = True)
-        
-        return recommendations[:self.n]
+        called or else this method will not work.
+        With profile the result is (recommendations, breakdown) and the filters
+        work as in recommend, the support of an item is the number of times it
+        was rated together with the items in userRatings.'''
+        if profile:
+            return profiled(self.weightedSlopeOne, userRatings, exclude=exclude,
+                            min_support=min_support, min_rating=min_rating)
+        with self.tracer.stage('slopeOne.input'):
+            userItems, ratings, places = self.data.sparseFromDict(userRatings, True)
+        with self.tracer.stage('slopeOne.score'):
+            predictions, support = self.slopeOne.predict(userItems, ratings, support=True,
+                                                         min_overlap=self.min_overlap)
+        return self._slopeOneRecommendations(predictions, support,
+                                             (exclude, min_support, min_rating), True,
+                                             self._slopeOneTieOrder(userItems, places))
+
+    def weightedSlopeOneBatch(self, userRatingsList, exclude=None, min_support=None,
+                              min_rating=None, names=True):
+        '''weightedSlopeOne for a list of {'ItemKey': rating} dictionaries or
+        a (users, items) array of ratings, see queryRows.
+        The predictions of the whole batch come from two matrix products, see
+        SlopeOneModel.predictBatch. Returns one list of recommendations per
+        user, or one (item ids, scores) pair per user without names.'''
+        with self.tracer.stage('slopeOne.input'):
+            queries = self.queryRows(userRatingsList, True)
+        with self.tracer.stage('slopeOne.score'):
+            predictions, support = self.slopeOne.predictBatch(
+                [(userItems, ratings) for (userItems, ratings, places) in queries],
+                support=True, min_overlap=self.min_overlap)
+        filters = (exclude, min_support, min_rating)
+        return [self._slopeOneRecommendations(row, rowSupport, filters, names,
+                                              self._slopeOneTieOrder(userItems, places))
+                for (row, rowSupport, (userItems, ratings, places))
+                in zip(predictions, support, queries)]
+
+    def _slopeOneRecommendations(self, predictions, support, filters, names=True,
+                                 tieOrder=None):
+        '''The n best items of a row of Slope One predictions'''
+        self.tracer.count('itemsScored', int(np.count_nonzero(~np.isnan(predictions))))
+        self._filterScores(predictions, support, *filters)
+        with self.tracer.stage('slopeOne.sort'):
+            return self._topRecommendations(predictions, None, tieOrder, names)
 
-    def slopeOneRecommenderTable(self, userRatings):
+    def _slopeOneTieOrder(self, userItems, places):
+        '''Order of Slope One predictions with equal values. An item comes
+        after the first rated item it was rated together with, in the order
+        of the user's ratings (places), the order the dictionary based version
+        found the items in. Only the items that can reach the top n are
+        looked up, see TopN.topN.'''
+        minimum = max(self.min_overlap, 1)
+        def firstRated(itemIDs):
+            frequencies = self.slopeOne.frequencies[np.ix_(userItems, itemIDs)]
+            return np.min(np.where(frequencies >= minimum, places[:, None], len(places)),
+                          axis=0, initial=len(places))
+        return firstRated
+
+    def slopeOneRecommenderTable(self, userRatings, profile=False):
         '''Creates a table of recommendations based on weighted slope one 
         for readability'''
-        titles = []
-        ratings = []
+        if profile:
+            return profiled(self.slopeOneRecommenderTable, userRatings)
         aList = self.weightedSlopeOne(userRatings)
-        for recommend in aList:
-            titles.append(recommend[0])
-            ratings.append(recommend[1])
-        dataTable = pd.DataFrame({'Title':titles, 'Rating': ratings})
-        dataTable = dataTable.reindex(columns = ['Title', 'Rating'])
-        return dataTable.set_index('Title')
+        with self.tracer.stage('table'):
+            return recommendationTable(aList)
         
     def cosineSimilarity(self, itemI, itemJ):
         '''Computes the cosine similarity of two items.
         itemI is an item in user ratings
-        itemJ is an item in user ratings'''
-        sumNumer = 0
-        sumDenomRi = 0
-        sumDenomRj = 0
-        
-        for (user, ratings) in self.data.items():
-            if itemI in ratings and itemJ in ratings:
-                if not (isnan(ratings[itemI]) or isnan(ratings[itemJ])):
-                    userAverage = self.usersRatingAverages[user]
-                    sumNumer += float((ratings[itemI] - userAverage) * (ratings[itemJ] - userAverage))
-                    sumDenomRi += (ratings[itemI] - userAverage)**2
-                    sumDenomRj += (ratings[itemJ] - userAverage)**2
+        itemJ is an item in user ratings
+        With computeSupport a pair rated together by fewer than min_overlap
+        users is 0 and the similarity is shrunk by its support.'''
+        itemIDI = self.data.itemIndex[itemI]
+        itemIDJ = self.data.itemIndex[itemJ]
+        support = None
+        if self.itemSupport is not None:
+            support = self.itemSupport.count(itemIDI, itemIDJ)
+            if support < self.min_overlap:
+                return 0.0
+        usersI, ratingsI = self.data.itemColumn(itemIDI)
+        usersJ, ratingsJ = self.data.itemColumn(itemIDJ)
+        users, i, j = np.intersect1d(usersI, usersJ, assume_unique=True,
+                                     return_indices=True)
+        userAverage = self.usersRatingAverages[users]
+        centeredI = ratingsI[i] - userAverage
+        centeredJ = ratingsJ[j] - userAverage
+        sumNumer = float(np.dot(centeredI, centeredJ))
+        sumDenomRi = float(np.dot(centeredI, centeredI))
+        sumDenomRj = float(np.dot(centeredJ, centeredJ))
         
         denom = sqrt(sumDenomRi) * sqrt(sumDenomRj)
                                    
         if denom == 0.0:
             return 0.0
+        elif support is not None:
+            return float(shrinkScores(sumNumer / denom, support, self.shrinkage))
         else:
             return sumNumer / (sqrt(sumDenomRi) * sqrt(sumDenomRj))
     
-    def computeSimilarityMatrix(self):
+    def computeSimilarityMatrix(self, neighbors_per_item=None, min_support=None,
+                                similarityDtype='float64', max_memory=None, online=False,
+                                recomputeEvery=None, shrinkage=None):
         '''Populates a similarity matrix using cosine similarity based on the user data passed
-        to the Recommender class.'''
-        for ratings in self.data.values():
-            for (itemI, ratingI) in ratings.items():
-                self.simMatrix.setdefault(itemI, {})
-                for(itemJ, ratingJ) in ratings.items():
-                    if itemI != itemJ and not (isnan(ratingI) or isnan(ratingJ)):
-                        self.simMatrix.setdefault(itemJ, {})
-                        self.simMatrix[itemJ].setdefault(itemI, 0.0)
-                        self.simMatrix[itemI].setdefault(itemJ, 0.0)
-                        if self.simMatrix[itemJ][itemI] == 0.0:
-                            self.simMatrix[itemI][itemJ] = self.cosineSimilarity(itemI, itemJ)
-                        else:
-                            self.simMatrix[itemI][itemJ] = self.simMatrix[itemJ][itemI]     
-        #if item != item2 and not isnan(rating) and not isnan(rating2)
+        to the Recommender class. self.simMatrix is an ItemNeighbors model that keeps
+        a list of the most similar items for every item.
+        param neighbors_per_item is the model size, the number of neighbors kept
+        per item. None keeps every item that was rated together with it.
+        param min_support is the fewest users that must have rated a pair of
+        items for the pair to be kept, self.min_overlap when None, see
+        computeSupport.
+        param similarityDtype is the storage dtype of the similarities.
+        param max_memory is a budget in bytes for the model, when given the
+        dtype and the number of neighbors kept are picked to fit, lowering
+        the precision before pruning, see ItemNeighbors.storageFor.
+        param online keeps the sums behind every similarity in self.cosineSums,
+        see ItemSimilarity.CosineAccumulators, so add_rating, update_rating,
+        remove_rating and apply_updates keep the model up to date without a
+        rebuild. They take 24 bytes per item pair on top of max_memory and the
+        similarities are rounded to 12 decimals so rounding residue does not
+        reorder tied neighbors.
+        param recomputeEvery rebuilds the averages, the sums and the model
+        from the data after that many online updates, see recomputeSimilarity.
+        param shrinkage scales a similarity backed by n users by
+        n / (n + shrinkage) before the neighbors are picked, self.shrinkage
+        when None, see computeSupport.
+        computeAverages is called first if the averages are missing.'''
+        if min_support is None:
+            min_support = self.min_overlap
+        if shrinkage is None:
+            shrinkage = self.shrinkage
+        if max_memory is not None:
+            similarityDtype, neighbors_per_item = ItemNeighbors.storageFor(
+                self.data.numItems, max_memory, neighbors_per_item)
+        if self.usersRatingAverages is None:
+            self.computeAverages()
+        self._similarityOptions = (neighbors_per_item, min_support, similarityDtype, shrinkage)
+        self.recomputeEvery = recomputeEvery
+        self._updatesSinceRecompute = 0
+        self._staleItems = set()
+        with self.tracer.stage('train.similarity'):
+            if online:
+                self.cosineSums = CosineAccumulators.fromRatings(self.data,
+                                                                 self.usersRatingAverages)
+                self.simMatrix = ItemNeighbors.fromBlocks(self.data.numItems,
+                                                          self.cosineSums.blocks(),
+                                                          neighbors_per_item, min_support,
+                                                          similarityDtype, shrinkage)
+            else:
+                self.cosineSums = None
+                self.simMatrix = ItemNeighbors.fromRatings(self.data, self.usersRatingAverages,
+                                                           neighbors_per_item, min_support,
+                                                           similarityDtype=similarityDtype,
+                                                           shrinkage=shrinkage)
+
+    @property
+    def simMatrix(self):
+        '''The ItemNeighbors model of computeSimilarityMatrix. After online
+        updates the rows of the items whose sums changed are pruned again on
+        the first read, so a burst of updates costs one rebuild of those rows.
+        The rebuild holds a lock, a concurrent read waits for it instead of
+        getting the stale rows.'''
+        if self._staleItems:
+            with self._staleLock:
+                if self._staleItems:
+                    items = np.array(sorted(self._staleItems), dtype=np.int64)
+                    (neighbors_per_item, min_support, similarityDtype,
+                     shrinkage) = self._similarityOptions
+                    similarities, support = self.cosineSums.rows(items)
+                    self._simMatrix = self._simMatrix.replaceRows(
+                        items, similarities, support, neighbors_per_item, min_support,
+                        self.data.numItems, shrinkage)
+                    self._staleItems = set()
+        return self._simMatrix
+
+    @simMatrix.setter
+    def simMatrix(self, simMatrix):
+        self._simMatrix = simMatrix
+
+    def recomputeSimilarity(self):
+        '''Rebuilds the user averages, the online sums and the similarity
+        model from the data with the options of the last computeSimilarityMatrix
+        call. Online updates are exact up to rounding: every update adds and
+        takes out floating point terms, so the sums drift from a rebuild by a
+        few units in the last place per update. After 3000 updates on the
+        bundled MovieLens data similarities and predictions were within 1e-12
+        of a rebuild. Call this, or pass recomputeEvery, to reset the drift.'''
+        (neighbors_per_item, min_support, similarityDtype, shrinkage) = self._similarityOptions
+        self.computeAverages()
+        self.computeSimilarityMatrix(neighbors_per_item, min_support, similarityDtype,
+                                     online=True, recomputeEvery=self.recomputeEvery,
+                                     shrinkage=shrinkage)
     
-    def cosineSimPredict(self, userRatings):
+    def cosineSimPredict(self, userRatings, profile=False, exclude=None, min_support=None,
+                         min_rating=None, ratingScale=None):
         '''Predicts items a user may like based on a cosine similarity matrix
-        user is the name of the user that we wish to predict recommendations for. '''
-        minR = 1
-        maxR = 5
-        self.normalizeRuN(userRatings, minR, maxR)
-        recommendations = {}
-        denom = {}
-        
-        for(userItem, rating) in userRatings.items():
-            if not isnan(rating):
-                for(diffItem, diffRating) in self.simMatrix.items():
-                    if (diffItem not in userRatings or isnan(userRatings[diffItem])) and userItem in self.simMatrix[diffItem]:
-                        recommendations.setdefault(diffItem, 0.0)
-                        denom.setdefault(diffItem, 0.0)
-                        recommendations[diffItem] += self.simMatrix[diffItem][userItem] * rating
-                        denom[diffItem] += abs(self.simMatrix[diffItem][userItem])
-                        
-        recommendations = [(self.convertProductID2name(key),
-                           round(self.deNormSingle(value/denom[key], minR, maxR), 2)) for (key, value) in recommendations.items()]
-                            
-        recommendations.sort(key = lambda artistTuple: artistTuple[1],
-                             reverse = True)        
-        self.deNormalizeRuN(userRatings, minR, maxR)
-        return recommendations[:self.n]
+        user is the name of the user that we wish to predict recommendations for.
+        userRatings is not changed, the ratings are copied into an array once
+        and normalized there, so concurrent calls can share a dictionary and a
+        Recommender.
+        param ratingScale is the (lowest, highest) rating, self.ratingScale
+        when None
+        With profile the result is (recommendations, breakdown) and the filters
+        work as in recommend, the support of an item is the number of its
+        neighbors that were rated.'''
+        if profile:
+            return profiled(self.cosineSimPredict, userRatings, exclude=exclude,
+                            min_support=min_support, min_rating=min_rating,
+                            ratingScale=ratingScale)
+        (minR, maxR) = ratingScale or self.ratingScale
+        with self.tracer.stage('cosine.normalize'):
+            userItems, ratings, places = self.data.sparseFromDict(userRatings, True)
+            normalizeRatings(ratings, minR, maxR)
+        with self.tracer.stage('cosine.score'):
+            predictions, support = self.simMatrix.predict(userItems, ratings, support=True)
+        return self._cosineRecommendations(predictions, support, minR, maxR,
+                                           (exclude, min_support, min_rating), True,
+                                           self._cosineTieOrder(userItems, places))
+
+    def cosineSimPredictBatch(self, userRatingsList, exclude=None, min_support=None,
+                              min_rating=None, ratingScale=None, names=True):
+        '''cosineSimPredict for many users at once. userRatingsList is a list
+        of {'ItemKey': rating} dictionaries or a (users, items) array of
+        ratings by item id that is NaN where there is no rating. Returns one
+        list of recommendations per user, or one (item ids, scores) pair per
+        user without names.'''
+        (minR, maxR) = ratingScale or self.ratingScale
+        with self.tracer.stage('cosine.normalize'):
+            queries = self.queryRows(userRatingsList, True)
+            for (userItems, ratings, places) in queries:
+                normalizeRatings(ratings, minR, maxR)
+        with self.tracer.stage('cosine.score'):
+            predictions, support = self.simMatrix.predictBatch(
+                [(userItems, ratings) for (userItems, ratings, places) in queries],
+                support=True)
+        filters = (exclude, min_support, min_rating)
+        return [self._cosineRecommendations(row, rowSupport, minR, maxR, filters, names,
+                                            self._cosineTieOrder(userItems, places))
+                for (row, rowSupport, (userItems, ratings, places))
+                in zip(predictions, support, queries)]
+
+    def queryRows(self, userRatingsList, positions=False):
+        '''Converts the ratings of many users, a list of {'ItemKey': rating}
+        dictionaries or (item ids, ratings) pairs, or a (users, items) array
+        with NaN for missing ratings, to a list of new (item ids, ratings)
+        arrays. With positions every row also has the place of each rating
+        in the input, see RatingMatrix.sparseFromDict.'''
+        rows = []
+        if isinstance(userRatingsList, np.ndarray):
+            for row in userRatingsList:
+                userItems = np.flatnonzero(~np.isnan(row))
+                rows.append((userItems, row[userItems].astype(np.float64)))
+        else:
+            for userRatings in userRatingsList:
+                if isinstance(userRatings, dict):
+                    rows.append(self.data.sparseFromDict(userRatings, positions))
+                    continue
+                (userItems, ratings) = userRatings
+                rows.append((np.asarray(userItems), np.array(ratings, dtype=np.float64)))
+        if positions:
+            rows = [row if len(row) == 3 else row + (np.arange(len(row[0])),) for row in rows]
+        return rows
+
+    def _cosineRecommendations(self, predictions, support, minR, maxR, filters, names=True,
+                               tieOrder=None):
+        '''The n best items of a row of normalized cosine predictions'''
+        #Items whose similarities are all 0 have no prediction.
+        self.tracer.count('itemsScored', int(np.count_nonzero(~np.isnan(predictions))))
+        denormalizeRatings(predictions, minR, maxR)
+        self._filterScores(predictions, support, *filters)
+        with self.tracer.stage('cosine.sort'):
+            return self._topRecommendations(predictions, 2, tieOrder, names)
+
+    def _cosineTieOrder(self, userItems, places):
+        '''Order of cosine predictions with equal values, the place of the
+        first rated item an item was rated together with, see
+        _slopeOneTieOrder. The pairs are read from the ratings, the
+        similarity model drops pairs with a similarity of 0. Items with the
+        same place follow the order the dictionary based similarity matrix
+        was filled in: the items of the first user and the items before them
+        come first.'''
+        placeOf = np.full(self.data.numItems, len(places))
+        placeOf[userItems] = places
+        def firstRated(itemIDs):
+            keys = []
+            for itemID in itemIDs.tolist():
+                users = self.data.itemColumn(itemID)[0]
+                together = self.data.indices[postingRanges(self.data.indptr, users)[0]]
+                keys.append(placeOf[together].min(initial=len(places)))
+            firstItems = self.data.userRow(0)[0] if self.data.numUsers else itemIDs[:0]
+            late = ~np.isin(itemIDs, firstItems)
+            if len(firstItems):
+                late &= itemIDs > firstItems[0]
+            return 2 * np.array(keys, dtype=np.int64) + late
+        return firstRated
 
                             
-    def cosineSimTable(self, userRatings):
+    def cosineSimTable(self, userRatings, profile=False):
         '''Creates a table of recommendations based on cosine similarity prediciton'''
-        titles = []
-        ratings = []
+        if profile:
+            return profiled(self.cosineSimTable, userRatings)
         aList = self.cosineSimPredict(userRatings)
-        for recommend in aList:
-            titles.append(recommend[0])
-            ratings.append(recommend[1])
-        dataTable = pd.DataFrame({'Title':titles, 'Rating': ratings})
-        dataTable = dataTable.reindex(columns = ['Title', 'Rating'])
-        return dataTable.set_index('Title')
+        with self.tracer.stage('table'):
+            return recommendationTable(aList)
         
     def normalizeRuN(self, nRatings, minR, maxR):
         '''Normalize R_u,N for use with prediction function.
@@ -338,8 +832,379 @@ class Recommender:
         rating = 0.5 * ((rating + 1) * (maxR - minR)) + minR
         return rating
         
+    def add_rating(self, user, item, rating):
+        '''Adds a new rating of item by user. New users and items are added to
+        the data. If computeDeviations has been called the slope one model is
+        updated in place for only the items the user has rated.
+        Raises ValueError before anything changes when a trained model is
+        read only, see checkWritable.'''
+        self.checkWritable()
+        userID = self.data.internUser(user)
+        itemID = self.data.internItem(item)
+        if self.data.getRating(userID, itemID) is not None:
+            raise ValueError(str(user) + ' has already rated ' + str(item))
+        self._applyRatings([userID], [itemID], [float(rating)])
+
+    def update_rating(self, user, item, rating):
+        '''Changes the rating user gave item, see add_rating. Raises KeyError
+        before anything changes when user has not rated item.'''
+        self.checkWritable()
+        userID, itemID = self._ratedPair(user, item)
+        self._applyRatings([userID], [itemID], [float(rating)])
+
+    def remove_rating(self, user, item):
+        '''Removes the rating user gave item, see update_rating'''
+        self.checkWritable()
+        userID, itemID = self._ratedPair(user, item)
+        self._applyRatings([userID], [itemID], [np.nan])
+
+    def apply_updates(self, batch):
+        '''Applies a stream of rating events without retraining.
+        batch is an iterable of (user, item, rating) tuples. A rating of None or
+        NaN removes the rating if there is one, any other rating is added or
+        replaces the current one. The batch is applied at once: only the last
+        event of every (user, item) pair takes effect, the pairs are merged
+        into the data in one pass and every model is brought up to date once
+        per changed user, see _applyRatings. Returns the number of events
+        applied, a removal of a rating that is not there does not count.'''
+        self.checkWritable()
+        events = list(batch)
+        if not events:
+            return 0
+        userIDs = self.data.internUsers([user for (user, item, rating) in events])
+        itemIDs = self.data.internItems([item for (user, item, rating) in events])
+        ratings = np.array([np.nan if isMissing(rating) else float(rating)
+                            for (user, item, rating) in events])
+        return self._applyRatings(userIDs, itemIDs, ratings)
+
+    def checkWritable(self):
+        '''Raises ValueError when a trained model cannot follow a rating
+        change. The Slope One model of computeDeviations(path=...) or of a
+        model loaded with mmap=True is a read only memory map, changing a
+        rating would leave it out of step with the data, so the rating
+        methods call this before they change anything.'''
+        if self.slopeOne is not None and not (self.slopeOne.deviationSums.flags.writeable
+                                              and self.slopeOne.frequencies.flags.writeable):
+            raise ValueError('The Slope One model is read only, call computeDeviations() '
+                             'without a path or load the model with mmap=False to change '
+                             'ratings')
+
+    def _ratedPair(self, user, item):
+        '''(user id, item id) of a rating that must exist, KeyError otherwise'''
+        userID = self.data.userIndex[user]
+        itemID = self.data.itemIndex[item]
+        if self.data.getRating(userID, itemID) is None:
+            raise KeyError(str(user) + ' has not rated ' + str(item))
+        return userID, itemID
+
+    def _applyRatings(self, userIDs, itemIDs, ratings):
+        '''Applies rating events given by id in order, a NaN rating removes.
+        The events are sorted by (user, item) and collapsed to the last one
+        of every pair, the pairs whose rating changes are written into the
+        data at once, see RatingMatrix.applyChanges, and handed to
+        _ratingsChanged. A single event only touches the rows of its user
+        and item. Returns the number of events that find something to
+        change when applied one after the other.'''
+        userIDs = np.asarray(userIDs, dtype=np.int64)
+        itemIDs = np.asarray(itemIDs, dtype=np.int64)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        order = np.argsort(userIDs * self.data.numItems + itemIDs, kind='stable')
+        (userIDs, itemIDs, ratings) = (userIDs[order], itemIDs[order], ratings[order])
+        samePair = (userIDs[1:] == userIDs[:-1]) & (itemIDs[1:] == itemIDs[:-1])
+        first = np.concatenate([[True], ~samePair])
+        last = np.concatenate([~samePair, [True]])
+        stored = self.data.getRatings(userIDs, itemIDs)
+        #The rating a pair holds when each event arrives.
+        before = np.where(first, stored, np.roll(ratings, 1))
+        applied = int(np.count_nonzero(~(np.isnan(ratings) & np.isnan(before))))
+        unchanged = (ratings == stored) | (np.isnan(ratings) & np.isnan(stored))
+        changed = last & ~unchanged
+        (userIDs, itemIDs, ratings, stored) = (userIDs[changed], itemIDs[changed],
+                                               ratings[changed], stored[changed])
+        if len(userIDs) == 0:
+            return applied
+        #Rows that keep their length are written in place, see RatingMatrix.spliceRow.
+        oldRows = {userID: tuple(array.copy() for array in self.data.userRow(userID))
+                   for userID in np.unique(userIDs).tolist()}
+        self.data.applyChanges(userIDs, itemIDs, ratings)
+        self._ratingsChanged(userIDs, itemIDs, stored, ratings, oldRows)
+        return applied
+
+    def _ratingsChanged(self, userIDs, itemIDs, previous, ratings, oldRows):
+        '''Brings the trained models up to date after the ratings of the
+        (user id, item id) pairs, sorted by user, changed from previous to
+        ratings, NaN for no rating. oldRows are the (item ids, ratings) of
+        every changed user before the change. The averages, the online sums,
+        the index and the support counts are updated once per changed user
+        (and item), Slope One once per changed rating.'''
+        users, starts = np.unique(userIDs, return_index=True)
+        stops = np.append(starts[1:], len(userIDs))
+        if self.usersRatingAverages is not None:
+            previousAverages = self._updateAverages(users)
+        if self.cosineSums is not None:
+            self.cosineSums.grow(self.data.numItems)
+        for (position, userID) in enumerate(users.tolist()):
+            self.invalidateUser(self.data.users[userID])
+            if self.annIndex is not None:
+                self.annIndex.update(userID)
+            oldItems, oldRatings = oldRows[userID]
+            if self.cosineSums is not None:
+                self._updateCosineSums(userID, oldItems, oldRatings, previousAverages[position])
+            if self.slopeOne is not None:
+                changes = slice(starts[position], stops[position])
+                self._updateSlopeOne(oldItems, oldRatings, itemIDs[changes],
+                                     previous[changes], ratings[changes])
+        if self.userSupport is not None:
+            #A changed rating leaves the counts as they are.
+            counted = np.isnan(previous) | np.isnan(ratings)
+            colptr, colUsers, colRatings = self.data.csc
+            for userID in np.unique(userIDs[counted]).tolist():
+                self.userSupport.refresh(userID, self.data.indptr, self.data.indices, colptr,
+                                         colUsers, self.data.numUsers)
+            for itemID in np.unique(itemIDs[counted]).tolist():
+                self.itemSupport.refresh(itemID, colptr, colUsers, self.data.indptr,
+                                         self.data.indices, self.data.numItems)
+        if self.cosineSums is not None:
+            self._updatesSinceRecompute += len(userIDs)
+            if (self.recomputeEvery is not None
+                    and self._updatesSinceRecompute >= self.recomputeEvery):
+                self.recomputeSimilarity()
+
+    def _updateAverages(self, userIDs):
+        '''Sets the averages of users from their ratings after they changed.
+        Returns the previous averages.'''
+        averages = self.usersRatingAverages
+        if len(averages) < self.data.numUsers or not averages.flags.writeable:
+            averages = np.concatenate([averages,
+                                       np.zeros(self.data.numUsers - len(averages))])
+            self.usersRatingAverages = averages
+        previousAverages = averages[userIDs]
+        for userID in userIDs.tolist():
+            items, ratings = self.data.userRow(userID)
+            averages[userID] = ratings.mean() if len(ratings) else 0.0
+        return previousAverages
+
+    def _updateCosineSums(self, userID, oldItems, oldRatings, previousAverage):
+        '''Takes the terms of a user out of the online sums with the row and
+        average before the change and puts them back with the new ones. Only
+        the pairs of the items the user rated change, their rows are marked
+        for simMatrix to prune again.'''
+        items, ratings = self.data.userRow(userID)
+        self.cosineSums.removeUser(oldItems, oldRatings, previousAverage)
+        self.cosineSums.addUser(items, ratings, self.usersRatingAverages[userID])
+        with self._staleLock:
+            self._staleItems.update(oldItems.tolist())
+            self._staleItems.update(items.tolist())
+
+    def _updateSlopeOne(self, items, values, changedItems, previous, ratings):
+        '''Replays the rating changes of one user on the Slope One model in
+        order, starting from the user's (items, values) before them'''
+        for (item, before, after) in zip(changedItems.tolist(), previous.tolist(),
+                                         ratings.tolist()):
+            others = items != item
+            if np.isnan(before):
+                self.slopeOne.addRating(items[others], values[others], item, after)
+                items = np.append(items, item)
+                values = np.append(values, after)
+            elif np.isnan(after):
+                self.slopeOne.removeRating(items[others], values[others], item, before)
+                items = items[others]
+                values = values[others]
+            else:
+                self.slopeOne.updateRating(items[others], item, before, after)
+                values = np.where(others, values, after)
+
+    def recommend_all(self, users=None, method='knn', workers=None, output=None,
+                      chunksize=64):
+        '''Recommends items for many users using a pool of worker processes.
+        param users is the list of users, None means every user in the data
+        param method is 'knn' (recommend), 'slopeone' (weightedSlopeOne) or
+        'cosine' (cosineSimPredict), the matching model must already be computed
+        param workers is the number of processes, None uses every cpu
+        param output is an optional csv path. Without it an iterator of
+        (user, recommendations) is returned in the order of users, with it the
+        rows are written as they arrive and the number of users is returned.
+        The trained model is placed in shared memory once and every worker reads
+        it from there, see Parallel.recommendAll.'''
+        from Parallel import recommendAll, writeRecommendations
+        if users is None:
+            users = list(self.data.users)
+        results = recommendAll(self, users, method, workers, chunksize)
+        if output is None:
+            return results
+        return writeRecommendations(results, output)
+
+    def recommendUser(self, user, method='knn'):
+        '''Recommendations for one user by name with the given method, see
+        recommend_all'''
+        if method == 'knn':
+            return self.recommend(user)
+        elif method == 'slopeone':
+            return self.weightedSlopeOne(self.data[user])
+        elif method == 'cosine':
+            return self.cosineSimPredict(self.data[user])
+        raise ValueError('Unknown method ' + str(method))
+
+    def recommendRecords(self, users=None, method='knn', batchSize=64):
+        '''Generator of the recommendations of many users as structured
+        arrays of Results.RECORD_DTYPE, (user id, rank, item id, score), one
+        array per batchSize users in the order of users. Every batch is scored
+        at once by id, see recommendBatch, weightedSlopeOneBatch and
+        cosineSimPredictBatch, and no names are looked up.
+        param users and method are as in recommend_all, the cache is not used'''
+        if users is None:
+            users = list(self.data.users)
+        for start in range(0, len(users), batchSize):
+            batch = users[start:start + batchSize]
+            userIDs = np.array([self.data.userIndex[user] for user in batch], dtype=np.int64)
+            with self.tracer.stage('records'):
+                records = resultRecords(userIDs, self._recommendIDs(batch, userIDs, method))
+            yield records
+
+    def _recommendIDs(self, users, userIDs, method):
+        '''(item ids, scores) of the recommendations of a batch of users'''
+        if method == 'knn':
+            nearest = self.computeNearestNeighbors(users, self.k)
+            return [self._knnRecommend(user, neighbors, names=False)
+                    for (user, neighbors) in zip(users, nearest)]
+        rows = [self.data.userRow(userID) for userID in userIDs]
+        if method == 'slopeone':
+            return self.weightedSlopeOneBatch(rows, names=False)
+        elif method == 'cosine':
+            return self.cosineSimPredictBatch(rows, names=False)
+        raise ValueError('Unknown method ' + str(method))
+
+    def recommendFrame(self, users=None, method='knn', batchSize=64):
+        '''The recommendations of many users as one long DataFrame with the
+        columns User, Rank, Title and Rating, see recommendRecords and
+        Results.recordsFrame'''
+        records = concatRecords(self.recommendRecords(users, method, batchSize))
+        return recordsFrame(records, self.data.users, self.itemNames())
+
+    def writeRecords(self, filename, users=None, method='knn', batchSize=64, format=None):
+        '''Streams the recommendations of many users to a csv or parquet file
+        one batch at a time, see recommendRecords and Results.writeRecords.
+        Returns the number of rows written.'''
+        return writeRecords(self.recommendRecords(users, method, batchSize), filename,
+                            self.data.users, self.itemNames(), format)
+
+    def itemNames(self):
+        '''Name of every item by item id, see convertProductID2name'''
+        return [self.convertProductID2name(item) for item in self.data.items]
+
+    def modelState(self):
+        '''Returns the state of the recommender as a (meta, arrays) pair. meta
+        holds the plain python values and arrays the NumPy arrays of the data
+        and of every model that has been computed. fromModelState rebuilds the
+        recommender from the pair without copying the arrays.'''
+        meta = {'users': self.data.users, 'items': self.data.items, 'k': self.k,
+                'n': self.n, 'metric': self.metric, 'ratingScale': list(self.ratingScale),
+                'missing': self.missing,
+                'annIndex': (dict(self._annOptions, probes=self.annIndex.probes)
+                             if self.annIndex is not None else None),
+                'support': ({'min_overlap': self.min_overlap, 'shrinkage': self.shrinkage}
+                            if self.userSupport is not None else None),
+                'productid2name': self.productid2name}
+        arrays = {'data.indptr': self.data.indptr, 'data.indices': self.data.indices,
+                  'data.values': self.data.values}
+        if self.usersRatingAverages is not None:
+            arrays['usersRatingAverages'] = self.usersRatingAverages
+        if self.slopeOne is not None:
+            arrays['slopeOne.deviationSums'] = self.slopeOne.deviationSums
+            arrays['slopeOne.frequencies'] = self.slopeOne.frequencies
+        if self.annIndex is not None:
+            for (name, array) in self.annIndex.state().items():
+                arrays['annIndex.' + name] = array
+        if self.simMatrix is not None:
+            arrays['simMatrix.indptr'] = self.simMatrix.indptr
+            arrays['simMatrix.neighbors'] = self.simMatrix.neighbors
+            arrays['simMatrix.similarities'] = self.simMatrix.similarities
+        if self.userSupport is not None:
+            for (name, support) in (('userSupport', self.userSupport),
+                                    ('itemSupport', self.itemSupport)):
+                for (key, array) in support.state().items():
+                    arrays[name + '.' + key] = array
+        return meta, arrays
+
+    def modelFootprint(self):
+        '''Returns the memory the recommender actually takes as
+        {'arrays': {name: {'dtype', 'shape', 'bytes'}}, 'models': bytes,
+        'total': bytes}. The arrays are the ones of modelState, models counts
+        every array but the rating data, plus the online sums of
+        computeSimilarityMatrix which are not saved.'''
+        meta, arrays = self.modelState()
+        if self.cosineSums is not None:
+            arrays['cosineSums.numerator'] = self.cosineSums.numerator
+            arrays['cosineSums.squares'] = self.cosineSums.squares
+            arrays['cosineSums.support'] = self.cosineSums.support
+        report = {}
+        for (name, array) in arrays.items():
+            report[name] = {'dtype': array.dtype.name, 'shape': list(array.shape),
+                            'bytes': int(array.nbytes)}
+        total = sum(entry['bytes'] for entry in report.values())
+        models = sum(entry['bytes'] for (name, entry) in report.items()
+                     if not name.startswith('data.'))
+        return {'arrays': report, 'models': models, 'total': total}
+
+    @classmethod
+    def fromModelState(cls, meta, arrays):
+        '''Rebuilds a recommender from the (meta, arrays) pair of modelState'''
+        data = RatingMatrix(meta['users'], meta['items'], arrays['data.indptr'],
+                            arrays['data.indices'], arrays['data.values'])
+        recommender = cls(data, meta['k'], meta['metric'], meta['n'],
+                          ratingScale=meta.get('ratingScale', (1, 5)),
+                          missing=meta.get('missing', 'absent'))
+        if meta.get('annIndex') is not None and 'annIndex.centroids' in arrays:
+            recommender.annIndex = AnnIndex.fromState(
+                data, {'centroids': arrays['annIndex.centroids'],
+                       'assignments': arrays['annIndex.assignments']},
+                meta['annIndex']['probes'], recommender.missing)
+            recommender._annOptions = meta['annIndex']
+        elif meta.get('annIndex') is not None:
+            recommender.enableApproximateNeighbors(**meta['annIndex'])
+        if meta.get('support') is not None:
+            recommender.min_overlap = meta['support']['min_overlap']
+            recommender.shrinkage = meta['support']['shrinkage']
+            for name in ('userSupport', 'itemSupport'):
+                state = {key[len(name) + 1:]: array for (key, array) in arrays.items()
+                         if key.startswith(name + '.')}
+                setattr(recommender, name,
+                        SupportCounts.fromState(state, recommender.min_overlap))
+        recommender.productid2name = meta['productid2name']
+        if 'usersRatingAverages' in arrays:
+            recommender.usersRatingAverages = arrays['usersRatingAverages']
+        if 'slopeOne.frequencies' in arrays:
+            recommender.slopeOne = SlopeOneModel(arrays['slopeOne.deviationSums'],
+                                                 arrays['slopeOne.frequencies'])
+        if 'simMatrix.indptr' in arrays:
+            recommender.simMatrix = ItemNeighbors(arrays['simMatrix.indptr'],
+                                                  arrays['simMatrix.neighbors'],
+                                                  arrays['simMatrix.similarities'])
+        return recommender
+
+    def save(self, path):
+        '''Saves the data and every computed model (averages, deviations,
+        frequencies and similarity matrix) to the directory path, see
+        ModelStore.saveModel'''
+        from ModelStore import saveModel
+        saveModel(self, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''Loads a recommender written by save. With mmap the arrays are memory
+        mapped read only so start up does not read the models and processes
+        loading the same path share the pages. The files are never written:
+        changing a rating of a memory mapped recommender copies the rating
+        arrays it changes into memory first.'''
+        from ModelStore import loadModelState
+        meta, arrays = loadModelState(path, mmap)
+        return cls.fromModelState(meta, arrays)
+
     def changeMetric(self, metric):
-        '''Changes the metric and updates self.fn'''
+        '''Changes the metric and updates self.fn. Cached lists of the previous
+        metric are dropped.'''
+        if self.cache is not None:
+            self.cache.invalidate(('metric', self.metric))
         self.metric = metric
         if self.metric == 'pearson' :
             self.fn = self.pearson
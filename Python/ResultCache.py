@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import threading
+import time
+from collections import OrderedDict
+
+#------------------------------------------------------------------------------
+#Start of ResultCache class
+class ResultCache:
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        '''Least recently used cache with an optional time to live.
+        param maxsize is the most entries kept, the least recently used entry
+        is dropped when a new one does not fit
+        param ttl is the number of seconds an entry stays valid, None keeps
+        entries until they are dropped or invalidated
+        Every entry can carry tags, invalidate(tag) drops all entries with
+        that tag.'''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''Returns the value stored for key or default on a miss'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= self.clock():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, tags=()):
+        '''Stores value for key, tagged with every tag in tags'''
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            expires = None if self.ttl is None else self.clock() + self.ttl
+            tags = frozenset(tags)
+            self._entries[key] = (value, expires, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        '''Drops every entry tagged with tag and returns how many were dropped'''
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        '''Returns the hit and miss counters and the current size'''
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        (value, expires, tags) = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+#End of ResultCache class
+#------------------------------------------------------------------------------
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Recommendations of many users as NumPy structured arrays. A batch of users
+becomes one array of (user, rank, item, score) records by id, names are
+only looked up when a table or a file is made from the records. pandas and
+pyarrow are imported when a table or a parquet file is asked for, so the
+scoring paths do not need either.
+"""
+import csv
+import numpy as np
+
+#One record per recommendation, user and item are ids of the RatingMatrix
+#and rank starts at 1 for the best item of a user.
+RECORD_DTYPE = np.dtype([('user', np.int32), ('rank', np.int32), ('item', np.int32),
+                         ('score', np.float64)])
+
+#Columns of tables and files, the same as Parallel.writeRecommendations.
+COLUMNS = ['User', 'Rank', 'Title', 'Rating']
+
+RECORD_FORMATS = ('csv', 'parquet')
+
+def resultRecords(userIDs, rows):
+    '''Packs one (item ids, scores) row per user id, best first, into a
+    structured array of RECORD_DTYPE'''
+    counts = np.array([len(items) for (items, scores) in rows], dtype=np.int64)
+    records = np.empty(int(counts.sum()), dtype=RECORD_DTYPE)
+    if len(records) == 0:
+        return records
+    records['user'] = np.repeat(userIDs, counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    records['rank'] = np.arange(len(records)) - starts + 1
+    records['item'] = np.concatenate([items for (items, scores) in rows])
+    records['score'] = np.concatenate([np.asarray(scores, dtype=np.float64)
+                                       for (items, scores) in rows])
+    return records
+
+def concatRecords(blocks):
+    '''Joins an iterable of record arrays into one'''
+    blocks = list(blocks)
+    if not blocks:
+        return np.empty(0, dtype=RECORD_DTYPE)
+    return np.concatenate(blocks)
+
+def nameArray(names):
+    '''An object array of names that can be indexed by an array of ids'''
+    array = np.empty(len(names), dtype=object)
+    array[:] = list(names)
+    return array
+
+def recordsFrame(records, users, items):
+    '''One long DataFrame of records with the columns User, Rank, Title and
+    Rating. users and items are the names by id. User is a categorical over
+    users so the names are not copied per row.'''
+    import pandas as pd
+    items = nameArray(items)
+    return pd.DataFrame({'User': pd.Categorical.from_codes(records['user'], list(users)),
+                         'Rank': records['rank'],
+                         'Title': items[records['item']],
+                         'Rating': records['score']}, columns=COLUMNS)
+
+def recommendationTable(recommendations):
+    '''DataFrame of a list of (title, rating) pairs indexed by Title'''
+    import pandas as pd
+    titles = [title for (title, rating) in recommendations]
+    ratings = [rating for (title, rating) in recommendations]
+    return pd.DataFrame({'Title': titles, 'Rating': ratings}).set_index('Title')
+
+def writeRecords(blocks, filename, users, items, format=None):
+    '''Writes an iterable of record arrays to a file block by block, so only
+    one block is held at a time. users and items are the names by id.
+    param format is 'csv' or 'parquet', None picks it from the extension of
+    filename. Parquet files need pyarrow. Returns the number of records.'''
+    if format is None:
+        format = 'parquet' if str(filename).endswith('.parquet') else 'csv'
+    if format not in RECORD_FORMATS:
+        raise ValueError('Unknown format ' + str(format))
+    users = nameArray(users)
+    items = nameArray(items)
+    if format == 'parquet':
+        return _writeParquet(blocks, filename, users, items)
+    written = 0
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for records in blocks:
+            writer.writerows(zip(users[records['user']], records['rank'].tolist(),
+                                 items[records['item']], records['score'].tolist()))
+            written += len(records)
+    return written
+
+def _writeParquet(blocks, filename, users, items):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Writing parquet files needs pyarrow') from None
+    written = 0
+    writer = None
+    try:
+        for records in blocks:
+            if len(records) == 0:
+                continue
+            table = pa.table({'User': users[records['user']].tolist(),
+                              'Rank': records['rank'],
+                              'Title': items[records['item']].tolist(),
+                              'Rating': records['score']})
+            if writer is None:
+                writer = pq.ParquetWriter(filename, table.schema)
+            writer.write_table(table)
+            written += len(records)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({column: [] for column in COLUMNS}), filename)
+    return written
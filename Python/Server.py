@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Serves a Recommender over HTTP with asyncio. Requests that arrive close
+together are collected into a micro-batch and scored with one call to the
+batch methods of Recommender in an executor, so the event loop keeps
+accepting connections while a batch is scored. Run from the Python folder:
+
+    python Server.py ../Data/L_MovieData.csv --encoding latin-1 --port 8080
+    python Server.py --model movielens_model --port 8080
+
+Endpoints
+    GET  /knn?user=NAME
+    POST /slopeone   {"ratings": {"ItemKey": rating, ...}}
+    POST /cosine     {"ratings": {"ItemKey": rating, ...}}
+    GET  /stats
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, urlsplit
+import numpy as np
+from RatingsLoader import readWideCsv
+from Recommender import Recommender
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+#Largest request body accepted, in bytes
+MAX_BODY = 1 << 20
+
+#------------------------------------------------------------------------------
+#Start of LatencyStats class
+class LatencyStats:
+    def __init__(self, window=10000):
+        '''Request latencies and batch sizes of one endpoint. Percentiles are
+        taken over the last window requests.'''
+        self.latencies = deque(maxlen=window)
+        self.batchSizes = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def addRequest(self, seconds, failed=False):
+        self.latencies.append(seconds)
+        self.requests += 1
+        if failed:
+            self.errors += 1
+
+    def addBatch(self, size):
+        self.batchSizes.append(size)
+
+    def summary(self):
+        '''Returns the counters, the mean batch size and the p50 and p99
+        latencies in milliseconds'''
+        summary = {'requests': self.requests, 'errors': self.errors,
+                   'batches': len(self.batchSizes), 'meanBatchSize': None,
+                   'p50': None, 'p99': None}
+        if self.batchSizes:
+            summary['meanBatchSize'] = float(np.mean(self.batchSizes))
+        if self.latencies:
+            (p50, p99) = np.percentile(np.array(self.latencies) * 1000.0, [50, 99])
+            summary['p50'] = float(p50)
+            summary['p99'] = float(p99)
+        return summary
+#End of LatencyStats class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of MicroBatcher class
+class MicroBatcher:
+    def __init__(self, score, maxBatchSize=32, maxLatency=0.005, executor=None,
+                 stats=None):
+        '''Collects the requests given to submit into batches.
+        param score is called as score(list of requests) in executor and
+        returns one result per request
+        param maxBatchSize is the most requests scored together
+        param maxLatency is the most seconds the first request of a batch
+        waits for others to join it
+        A batch is scored when it is full or when the first request has
+        waited maxLatency seconds. If scoring a batch raises, its requests
+        are scored one by one so a bad request only fails itself.'''
+        self.score = score
+        self.maxBatchSize = maxBatchSize
+        self.maxLatency = maxLatency
+        self.executor = executor
+        self.stats = stats
+        self._pending = []
+        self._arrived = None
+        self._full = None
+        self._task = None
+
+    async def submit(self, request):
+        '''Queues request and returns its result once its batch is scored'''
+        loop = asyncio.get_running_loop()
+        if self._task is None:
+            self.start()
+        future = loop.create_future()
+        self._pending.append((request, future, loop.time()))
+        self._arrived.set()
+        if len(self._pending) >= self.maxBatchSize:
+            self._full.set()
+        return await future
+
+    def start(self):
+        '''Starts collecting batches on the running event loop'''
+        self._arrived = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._arrived.wait()
+            deadline = self._pending[0][2] + self.maxLatency
+            while len(self._pending) < self.maxBatchSize:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            batch = self._pending[:self.maxBatchSize]
+            del self._pending[:self.maxBatchSize]
+            if not self._pending:
+                self._arrived.clear()
+            await self._scoreBatch(batch)
+
+    async def _scoreBatch(self, batch):
+        loop = asyncio.get_running_loop()
+        if self.stats is not None:
+            self.stats.addBatch(len(batch))
+        requests = [request for (request, future, arrived) in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.score, requests)
+        except Exception as error:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(error)
+                return
+            for entry in batch:
+                await self._scoreBatch([entry])
+            return
+        for ((request, future, arrived), result) in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+#End of MicroBatcher class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of RecommendationServer class
+class RecommendationServer:
+    def __init__(self, recommender, maxBatchSize=32, maxLatency=0.005, executor=None):
+        '''HTTP front end of a Recommender with kNN, Slope One and cosine
+        endpoints, see the module docstring.
+        param maxBatchSize and maxLatency configure the micro-batches of every
+        endpoint, see MicroBatcher
+        param executor runs the scoring, by default a single thread so the
+        recommender is never used by two batches at once'''
+        self.recommender = recommender
+        self.executor = executor
+        if executor is None:
+            self.executor = ThreadPoolExecutor(1)
+        self.stats = {'knn': LatencyStats(), 'slopeone': LatencyStats(),
+                      'cosine': LatencyStats()}
+        self.batchers = {
+            'knn': MicroBatcher(recommender.recommendBatch, maxBatchSize, maxLatency,
+                                self.executor, self.stats['knn']),
+            'slopeone': MicroBatcher(recommender.weightedSlopeOneBatch, maxBatchSize,
+                                     maxLatency, self.executor, self.stats['slopeone']),
+            'cosine': MicroBatcher(recommender.cosineSimPredictBatch, maxBatchSize,
+                                   maxLatency, self.executor, self.stats['cosine'])}
+        self._server = None
+
+    async def handle(self, method, target, body=b''):
+        '''Answers one request and returns (status, payload dictionary).
+        Used for every HTTP request and by InProcessClient.'''
+        parts = urlsplit(target)
+        endpoint = parts.path.strip('/')
+        if endpoint == 'stats':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.statsSummary()
+        if endpoint not in self.batchers:
+            return 404, {'error': 'unknown endpoint ' + parts.path}
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        status, payload = await self._recommend(endpoint, method, parts.query, body)
+        self.stats[endpoint].addRequest(loop.time() - start, status != 200)
+        return status, payload
+
+    async def _recommend(self, endpoint, method, query, body):
+        if endpoint == 'knn':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            users = parse_qs(query).get('user')
+            if not users:
+                return 400, {'error': 'missing user parameter'}
+            if users[0] not in self.recommender.data.userIndex:
+                return 404, {'error': 'unknown user ' + users[0]}
+            request = users[0]
+        else:
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            if endpoint == 'slopeone' and self.recommender.slopeOne is None:
+                return 503, {'error': 'computeDeviations has not been run'}
+            if endpoint == 'cosine' and self.recommender.simMatrix is None:
+                return 503, {'error': 'computeSimilarityMatrix has not been run'}
+            try:
+                request = json.loads(body.decode('utf-8'))['ratings']
+                if not isinstance(request, dict):
+                    raise TypeError
+                for rating in request.values():
+                    if rating is not None and not isinstance(rating, (int, float)):
+                        raise TypeError
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'body must be {"ratings": {"ItemKey": rating}}'}
+        try:
+            recommendations = await self.batchers[endpoint].submit(request)
+        except Exception as error:
+            return 500, {'error': '%s: %s' % (type(error).__name__, error)}
+        return 200, {'recommendations': [[title, rating] for (title, rating) in recommendations]}
+
+    def statsSummary(self):
+        '''Latency percentiles and batch sizes of every endpoint'''
+        return {endpoint: stats.summary() for (endpoint, stats) in self.stats.items()}
+
+    async def _connection(self, reader, writer):
+        '''Serves the HTTP/1.1 requests of one connection'''
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine.strip():
+                    break
+                try:
+                    (method, target, version) = requestLine.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'bad request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    (name, _, value) = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keepAlive = (headers.get('connection', '').lower() != 'close'
+                             and version != 'HTTP/1.0')
+                length = int(headers.get('content-length', 0) or 0)
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {'error': 'body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.handle(method, target, body)
+                await self._respond(writer, status, payload, keepAlive)
+                if not keepAlive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, writer, status, payload, keepAlive):
+        body = json.dumps(payload).encode('utf-8')
+        head = ('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                'Content-Length: %d\r\nConnection: %s\r\n\r\n'
+                % (status, REASONS[status], len(body), 'keep-alive' if keepAlive else 'close'))
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=8080):
+        '''Starts listening, port 0 picks a free port. Returns the asyncio server.'''
+        self._server = await asyncio.start_server(self._connection, host, port)
+        return self._server
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for batcher in self.batchers.values():
+            await batcher.stop()
+#End of RecommendationServer class
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+#Start of InProcessClient class
+class InProcessClient:
+    def __init__(self, server):
+        '''Calls a RecommendationServer without sockets. Requests go through
+        the same routing, validation, batching and statistics as HTTP
+        requests, which makes it handy for tests and for embedding.'''
+        self.server = server
+
+    async def request(self, method, target, payload=None):
+        '''Returns (status, payload dictionary)'''
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        return await self.server.handle(method, target, body)
+
+    async def knn(self, user):
+        return await self.request('GET', '/knn?user=' + quote(str(user), safe=''))
+
+    async def slopeOne(self, ratings):
+        return await self.request('POST', '/slopeone', {'ratings': ratings})
+
+    async def cosine(self, ratings):
+        return await self.request('POST', '/cosine', {'ratings': ratings})
+
+    async def stats(self):
+        return await self.request('GET', '/stats')
+#End of InProcessClient class
+#------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve recommendations over HTTP')
+    parser.add_argument('data', nargs='?', help='wide csv file of ratings')
+    parser.add_argument('--encoding', default='utf-8')
+    parser.add_argument('--model', help='directory written by Recommender.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--metric', default='pearson')
+    parser.add_argument('--n', type=int, default=5)
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if args.model:
+        recommender = Recommender.load(args.model)
+    elif args.data:
+        recommender = Recommender(readWideCsv(args.data, encoding=args.encoding),
+                                  args.k, args.metric, args.n)
+        recommender.computeDeviations()
+        recommender.computeSimilarityMatrix()
+    else:
+        parser.error('give a data file or --model')
+    server = RecommendationServer(recommender, args.max_batch_size,
+                                  args.max_latency_ms / 1000.0)
+
+    async def serve():
+        listening = await server.start(args.host, args.port)
+        print('Serving on %s:%d' % listening.sockets[0].getsockname()[:2])
+        try:
+            await listening.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import os
+import multiprocessing
+import shutil
+import tempfile
+import numpy as np
+from Parallel import attachArrays, releaseArrays, shareArrays
+
+#(deviation sums, frequencies) storage dtypes from the most to the least
+#precise, see SlopeOneModel.storageFor.
+STORAGE_LEVELS = [('float64', 'int64'), ('float64', 'uint32'), ('float32', 'uint32'),
+                  ('float32', 'uint16'), ('float16', 'uint16')]
+
+#Dtypes a model widens its arrays to, narrowest first, when a rating change
+#needs more than the storage dtype holds, see SlopeOneModel.addRating.
+WIDER_FREQUENCIES = ['uint16', 'uint32', 'int64']
+WIDER_DEVIATIONS = ['float32', 'float64']
+
+def exactLimit(dtype):
+    '''Largest whole number up to which dtype holds every whole number'''
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        return int(np.iinfo(dtype).max)
+    return 2 ** (np.finfo(dtype).nmant + 1)
+
+def castStorage(array, dtype, name):
+    '''Returns array as dtype, raises ValueError when a value does not fit.
+    A float dtype must hold whole numbers up to the largest |value| exactly,
+    float16 for instance only up to 2048, so sums of whole number ratings
+    are never rounded.'''
+    dtype = np.dtype(dtype)
+    if array.dtype == dtype:
+        return array
+    if array.size:
+        if np.issubdtype(dtype, np.integer):
+            fits = array.min() >= np.iinfo(dtype).min and array.max() <= exactLimit(dtype)
+        else:
+            fits = np.abs(array).max() <= exactLimit(dtype)
+        if not fits:
+            raise ValueError(name + ' do not fit in ' + dtype.name)
+    return array.astype(dtype)
+
+#------------------------------------------------------------------------------
+#Start of SlopeOneModel class
+class SlopeOneModel:
+    def __init__(self, deviationSums, frequencies):
+        '''Weighted Slope One model over item ids.
+        deviationSums[i, j] is the sum of (rating of i - rating of j) over every
+        user that rated both items and frequencies[i, j] is the number of those
+        users. The diagonal of both is 0.'''
+        self.deviationSums = deviationSums
+        self.frequencies = frequencies
+        self._deviationBuffer = deviationSums
+        self._frequencyBuffer = frequencies
+
+    @classmethod
+    def fromRatings(cls, ratings, blockSize=512, deviationDtype='float64',
+                    frequencyDtype='int64', itemBlockSize=None):
+        '''Builds the model from a RatingMatrix.
+        With B the 0/1 rated mask and R the ratings of a block of users and
+        B_b, R_b their columns of a block of item rows, those rows of the
+        frequencies are the sum of B_b^T B and the rows of the deviation sums
+        the sum of R_b^T B - B_b^T R. Users are processed blockSize at a time
+        so only one dense block of users is held at once.
+        deviationDtype and frequencyDtype are the storage dtypes of the two
+        arrays, e.g. float32 and uint16 take 6 instead of 16 bytes per pair.
+        The arrays are allocated in those dtypes and filled itemBlockSize rows
+        at a time, the sums of a row block are added up in float64 and cast
+        once it is complete. itemBlockSize of None keeps that float64 row
+        block near 64 MB, so training takes about that much memory on top of
+        the model and the user block whatever the storage dtypes.'''
+        numItems = ratings.numItems
+        if itemBlockSize is None:
+            itemBlockSize = max(1, (1 << 22) // max(numItems, 1))
+        deviationSums = np.zeros((numItems, numItems), dtype=deviationDtype)
+        frequencies = np.zeros((numItems, numItems), dtype=frequencyDtype)
+        userBlocks = [(start, min(start + blockSize, ratings.numUsers))
+                      for start in range(0, ratings.numUsers, blockSize)]
+        for rowStart in range(0, numItems, itemBlockSize):
+            rowStop = min(rowStart + itemBlockSize, numItems)
+            deviationRows = np.zeros((rowStop - rowStart, numItems))
+            frequencyRows = np.zeros((rowStop - rowStart, numItems))
+            for (start, stop) in userBlocks:
+                block, mask = ratings.denseBlock(start, stop)
+                mask = mask.astype(np.float64)
+                frequencyRows += mask[:, rowStart:rowStop].T @ mask
+                deviationRows += block[:, rowStart:rowStop].T @ mask
+                deviationRows -= mask[:, rowStart:rowStop].T @ block
+            diagonal = np.arange(rowStop - rowStart)
+            deviationRows[diagonal, diagonal + rowStart] = 0.0
+            frequencyRows[diagonal, diagonal + rowStart] = 0
+            deviationSums[rowStart:rowStop] = castStorage(deviationRows, deviationDtype,
+                                                          'deviation sums')
+            frequencies[rowStart:rowStop] = castStorage(frequencyRows, frequencyDtype,
+                                                        'frequencies')
+        return cls(deviationSums, frequencies)
+
+    @classmethod
+    def storageFor(cls, numItems, numUsers, max_memory, largestSum=None):
+        '''Returns the most precise (deviation dtype, frequency dtype) of
+        STORAGE_LEVELS whose arrays for numItems items take at most max_memory
+        bytes. Frequencies are at most numUsers so a count dtype is only used
+        when it can hold that. largestSum bounds |deviation sum|, e.g. the
+        ratings of the most rated item times the rating span, a deviation
+        dtype is only used when it holds sums that large exactly, see
+        castStorage, so float16 is left out above 2048. None assumes
+        numUsers times a span of 4. Raises ValueError when nothing fits.
+        The check holds for the ratings the model is trained on, a model
+        whose counts or sums later grow past its dtypes through addRating
+        widens them.'''
+        if largestSum is None:
+            largestSum = numUsers * 4
+        for (deviationDtype, frequencyDtype) in STORAGE_LEVELS:
+            if numUsers > np.iinfo(frequencyDtype).max:
+                continue
+            if largestSum > exactLimit(deviationDtype):
+                continue
+            pairBytes = np.dtype(deviationDtype).itemsize + np.dtype(frequencyDtype).itemsize
+            if numItems * numItems * pairBytes <= max_memory:
+                return deviationDtype, frequencyDtype
+        raise ValueError('A Slope One model of %d items does not fit in %d bytes, '
+                         'train it on disk instead' % (numItems, max_memory))
+
+    @classmethod
+    def fromRatingsOnDisk(cls, ratings, path, userBlockSize=4096, itemBlockSize=None,
+                          workers=None, deviationDtype='float64', frequencyDtype='int64'):
+        '''Builds the model from a RatingMatrix without holding it in memory
+        and returns it memory mapped read only from path.
+        The item rows are split into blocks of itemBlockSize rows and the users
+        into chunks of userBlockSize. Every (user chunk, row block) pair is a
+        task that computes the partial sums of those users for those rows, see
+        slopeOneShard, and spills them to a file. Tasks run in workers
+        processes that share the ratings. The spills of a row block are added
+        up and written to slopeOne.deviationSums.npy and
+        slopeOne.frequencies.npy in path, the files Recommender.save writes,
+        so only one row block of the model is in memory at a time.
+        itemBlockSize of None keeps a row block of both arrays near 256 MB.
+        deviationDtype and frequencyDtype are the storage dtypes of the files.'''
+        numItems = ratings.numItems
+        if itemBlockSize is None:
+            itemBlockSize = max(1, (1 << 24) // max(numItems, 1))
+        if workers is None:
+            workers = os.cpu_count() or 1
+        os.makedirs(path, exist_ok=True)
+        deviationFile = os.path.join(path, 'slopeOne.deviationSums.npy')
+        frequencyFile = os.path.join(path, 'slopeOne.frequencies.npy')
+        deviationSums = np.lib.format.open_memmap(deviationFile, mode='w+', dtype=deviationDtype,
+                                                  shape=(numItems, numItems))
+        frequencies = np.lib.format.open_memmap(frequencyFile, mode='w+', dtype=frequencyDtype,
+                                                shape=(numItems, numItems))
+        spillFolder = tempfile.mkdtemp(prefix='slopeone-', dir=path)
+        rowBlocks = [(start, min(start + itemBlockSize, numItems))
+                     for start in range(0, numItems, itemBlockSize)]
+        userChunks = [(start, min(start + userBlockSize, ratings.numUsers))
+                      for start in range(0, ratings.numUsers, userBlockSize)]
+        tasks = [(userStart, userStop, rowStart, rowStop,
+                  os.path.join(spillFolder, '%d_%d.npz' % (rowStart, userStart)))
+                 for (rowStart, rowStop) in rowBlocks for (userStart, userStop) in userChunks]
+        arrays = {'indptr': ratings.indptr, 'indices': ratings.indices,
+                  'values': ratings.values}
+        spills = {}
+        blocks = []
+        try:
+            if workers <= 1 or len(tasks) <= 1:
+                _shardWorker['ratings'] = arrays
+                results = map(slopeOneShardTask, tasks)
+                pool = None
+            else:
+                blocks, specs = shareArrays(arrays)
+                pool = multiprocessing.Pool(workers, initShardWorker, (specs,))
+                results = pool.imap_unordered(slopeOneShardTask, tasks)
+            for (rowStart, spillFile) in results:
+                spills.setdefault(rowStart, []).append(spillFile)
+                if len(spills[rowStart]) == len(userChunks):
+                    rowStop = min(rowStart + itemBlockSize, numItems)
+                    mergeShards(spills.pop(rowStart), rowStart, rowStop,
+                                deviationSums, frequencies)
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            _shardWorker.clear()
+            releaseArrays(blocks)
+            shutil.rmtree(spillFolder, ignore_errors=True)
+        deviationSums.flush()
+        frequencies.flush()
+        del deviationSums, frequencies
+        return cls(np.load(deviationFile, mmap_mode='r'), np.load(frequencyFile, mmap_mode='r'))
+
+    @property
+    def numItems(self):
+        return self.frequencies.shape[0]
+
+    @property
+    def deviations(self):
+        '''The average deviation of every item pair, 0 where there is no pair'''
+        deviations = np.zeros(self.deviationSums.shape)
+        np.divide(self.deviationSums, self.frequencies, out=deviations,
+                  where=self.frequencies > 0)
+        return deviations
+
+    def predict(self, items, ratings, support=False, min_overlap=1):
+        '''Predicts the rating of every item for a user that rated items with
+        ratings (item ids and ratings arrays).
+        For item j the prediction is
+        sum_i (deviationSums[j, i] + rating_i * frequencies[j, i]) / sum_i frequencies[j, i]
+        over the rated items i. Returns an array of length numItems that is NaN
+        for the rated items and for items that share no users with them.
+        With support the sums of frequencies, the number of ratings behind
+        every prediction, are returned too.
+        Pairs rated together by fewer than min_overlap users are left out of
+        the sums, a frequency is the co-rating count of its pair.
+        Both arrays are symmetric up to sign so the rows of the rated items
+        are read instead of their columns, a memory mapped model only loads
+        those rows from disk.'''
+        frequencies = self.frequencies[items]
+        deviationSums = self.deviationSums[items]
+        if min_overlap > 1:
+            weak = frequencies < min_overlap
+            frequencies = np.where(weak, 0, frequencies)
+            deviationSums = np.where(weak, 0, deviationSums)
+        deviationSums = deviationSums.sum(axis=0, dtype=np.float64)
+        numerator = ratings @ frequencies - deviationSums
+        denominator = frequencies.sum(axis=0)
+        predictions = np.full(self.numItems, np.nan)
+        np.divide(numerator, denominator, out=predictions, where=denominator > 0)
+        predictions[items] = np.nan
+        if support:
+            return predictions, denominator
+        return predictions
+
+    def predictBatch(self, queries, support=False, min_overlap=1):
+        '''predict for a batch of users given as a list of (item ids, ratings)
+        rows. Only the columns rated by someone in the batch are read and the
+        sums over them are two matrix products. Returns a
+        (len(queries), numItems) array of predictions, min_overlap is as in
+        predict.'''
+        items = np.unique(np.concatenate([np.asarray(row[0], dtype=np.int64)
+                                          for row in queries] + [np.zeros(0, dtype=np.int64)]))
+        mask = np.zeros((len(queries), len(items)))
+        ratings = np.zeros((len(queries), len(items)))
+        for (q, (rowItems, rowRatings)) in enumerate(queries):
+            columns = np.searchsorted(items, rowItems)
+            mask[q, columns] = 1.0
+            ratings[q, columns] = rowRatings
+        frequencies = self.frequencies[items].astype(np.float64)
+        deviationSums = self.deviationSums[items]
+        if min_overlap > 1:
+            weak = frequencies < min_overlap
+            frequencies[weak] = 0.0
+            deviationSums = np.where(weak, 0, deviationSums)
+        numerator = ratings @ frequencies - mask @ deviationSums
+        denominator = mask @ frequencies
+        predictions = np.full((len(queries), self.numItems), np.nan)
+        np.divide(numerator, denominator, out=predictions, where=denominator > 0)
+        for (q, (rowItems, rowRatings)) in enumerate(queries):
+            predictions[q, rowItems] = np.nan
+        if support:
+            return predictions, denominator
+        return predictions
+
+    def grow(self, numItems):
+        '''Makes room for item ids up to numItems - 1, new items have no pairs.
+        The arrays are views into buffers that double in size when full so
+        adding items one at a time does not copy the model every time.'''
+        if numItems <= self.numItems:
+            return
+        capacity = self._frequencyBuffer.shape[0]
+        if numItems > capacity:
+            capacity = max(numItems, 2 * capacity)
+            deviationBuffer = np.zeros((capacity, capacity), dtype=self.deviationSums.dtype)
+            frequencyBuffer = np.zeros((capacity, capacity), dtype=self.frequencies.dtype)
+            deviationBuffer[:self.numItems, :self.numItems] = self.deviationSums
+            frequencyBuffer[:self.numItems, :self.numItems] = self.frequencies
+            self._deviationBuffer = deviationBuffer
+            self._frequencyBuffer = frequencyBuffer
+        self.deviationSums = self._deviationBuffer[:numItems, :numItems]
+        self.frequencies = self._frequencyBuffer[:numItems, :numItems]
+
+    def addRating(self, items, ratings, item, rating):
+        '''Adds a new rating of item to the model. items and ratings are the
+        other ratings of the same user, only their rows and columns change.
+        A frequency or a deviation sum that would pass what its dtype holds
+        exactly widens the array first, see widen, so an update never wraps
+        around or rounds.'''
+        self.grow(item + 1)
+        self._change(items, item, 1, rating - ratings)
+
+    def updateRating(self, items, item, previous, rating):
+        '''Changes the rating of item from previous to rating. items are the
+        other items rated by the same user.'''
+        self._change(items, item, 0, np.full(len(items), rating - previous))
+
+    def removeRating(self, items, ratings, item, rating):
+        '''Removes a rating of item from the model. items and ratings are the
+        other ratings of the same user.'''
+        self._change(items, item, -1, ratings - rating)
+
+    def _change(self, items, item, count, deviations):
+        '''Adds count to the frequencies of (item, items) and deviations to
+        their deviation sums, and the same to (items, item) with the sign of
+        the deviations flipped'''
+        frequencies = (self.frequencies[item, items].astype(np.int64) + count,
+                       self.frequencies[items, item].astype(np.int64) + count)
+        deviationSums = (self.deviationSums[item, items].astype(np.float64) + deviations,
+                         self.deviationSums[items, item].astype(np.float64) - deviations)
+        if len(items):
+            self.widen(max(int(frequencies[0].max()), int(frequencies[1].max())),
+                       max(float(np.abs(deviationSums[0]).max()),
+                           float(np.abs(deviationSums[1]).max())))
+        self.frequencies[item, items] = frequencies[0]
+        self.frequencies[items, item] = frequencies[1]
+        self.deviationSums[item, items] = deviationSums[0]
+        self.deviationSums[items, item] = deviationSums[1]
+
+    def widen(self, largestFrequency, largestSum):
+        '''Changes the storage dtypes to the narrowest of WIDER_FREQUENCIES
+        and WIDER_DEVIATIONS that hold largestFrequency and largestSum
+        exactly, when the current ones do not, see exactLimit. The buffers
+        are copied so the model takes more memory from then on.'''
+        numItems = self.numItems
+        if largestFrequency > exactLimit(self.frequencies.dtype):
+            dtype = next((dtype for dtype in WIDER_FREQUENCIES
+                          if largestFrequency <= exactLimit(dtype)), 'int64')
+            self._frequencyBuffer = self._frequencyBuffer.astype(dtype)
+            self.frequencies = self._frequencyBuffer[:numItems, :numItems]
+        if (np.issubdtype(self.deviationSums.dtype, np.floating)
+                and largestSum > exactLimit(self.deviationSums.dtype)):
+            dtype = next((dtype for dtype in WIDER_DEVIATIONS
+                          if largestSum <= exactLimit(dtype)), 'float64')
+            self._deviationBuffer = self._deviationBuffer.astype(dtype)
+            self.deviationSums = self._deviationBuffer[:numItems, :numItems]
+#End of SlopeOneModel class
+#------------------------------------------------------------------------------
+
+def slopeOneShard(indptr, indices, values, userStart, userStop, rowStart, rowStop):
+    '''Partial Slope One sums of the users userStart..userStop-1 for the item
+    rows rowStart..rowStop-1, given the CSR arrays of the ratings.
+    Only the items the chunk rated are kept: with R the ratings and B the
+    0/1 mask of the chunk over those columns and R_b, B_b their columns that
+    fall in the row block, the frequencies are B_b^T B and the deviation
+    sums R_b^T B - B_b^T R. Returns (rows, columns, deviationSums,
+    frequencies) where rows and columns are item ids.'''
+    start = indptr[userStart]
+    stop = indptr[userStop]
+    columns, positions = np.unique(indices[start:stop], return_inverse=True)
+    userIDs = np.repeat(np.arange(userStop - userStart),
+                        np.diff(indptr[userStart:userStop + 1]))
+    block = np.zeros((userStop - userStart, len(columns)))
+    mask = np.zeros((userStop - userStart, len(columns)))
+    block[userIDs, positions] = values[start:stop]
+    mask[userIDs, positions] = 1.0
+    inRows = (columns >= rowStart) & (columns < rowStop)
+    frequencies = mask[:, inRows].T @ mask
+    deviationSums = block[:, inRows].T @ mask - mask[:, inRows].T @ block
+    return columns[inRows], columns, deviationSums, frequencies
+
+def mergeShards(spillFiles, rowStart, rowStop, deviationSums, frequencies):
+    '''Adds up the spilled partial sums of one row block and writes the
+    rows rowStart..rowStop-1 of the model'''
+    numItems = frequencies.shape[1]
+    deviationRows = np.zeros((rowStop - rowStart, numItems))
+    frequencyRows = np.zeros((rowStop - rowStart, numItems))
+    for spillFile in spillFiles:
+        with np.load(spillFile) as shard:
+            cells = np.ix_(shard['rows'] - rowStart, shard['columns'])
+            deviationRows[cells] += shard['deviationSums']
+            frequencyRows[cells] += shard['frequencies']
+        os.remove(spillFile)
+    diagonal = np.arange(rowStop - rowStart)
+    deviationRows[diagonal, diagonal + rowStart] = 0.0
+    frequencyRows[diagonal, diagonal + rowStart] = 0
+    deviationSums[rowStart:rowStop] = castStorage(deviationRows, deviationSums.dtype,
+                                                  'deviation sums')
+    frequencies[rowStart:rowStop] = castStorage(frequencyRows, frequencies.dtype, 'frequencies')
+
+#State of a shard worker process, set once by initShardWorker.
+_shardWorker = {}
+
+def initShardWorker(specs):
+    '''Pool initializer, maps the shared CSR arrays of the ratings'''
+    blocks, arrays = attachArrays(specs)
+    _shardWorker['blocks'] = blocks
+    _shardWorker['ratings'] = arrays
+
+def slopeOneShardTask(task):
+    '''Computes one (user chunk, row block) task and spills it to a file'''
+    (userStart, userStop, rowStart, rowStop, spillFile) = task
+    arrays = _shardWorker['ratings']
+    rows, columns, deviationSums, frequencies = slopeOneShard(
+        arrays['indptr'], arrays['indices'], arrays['values'],
+        userStart, userStop, rowStart, rowStop)
+    np.savez(spillFile, rows=rows, columns=columns, deviationSums=deviationSums,
+             frequencies=frequencies)
+    return rowStart, spillFile
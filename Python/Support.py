@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Co-occurrence counts of the rating data: the number of items every pair of
+users rated in common and the number of users that rated every pair of
+items. The counts are stored as compact rows so the neighbor search
+and the predictors can drop the pairs with too little support before any
+arithmetic is spent on them, and shrink the scores of the pairs they keep.
+"""
+import numpy as np
+from Neighbors import postingRanges
+
+#Largest dense block of (rows x rows) cells counted at once.
+BLOCK_CELLS = 1 << 21
+#Largest number of (row, row) pairs expanded from the postings at once.
+BLOCK_PAIRS = 1 << 21
+
+def countDtype(largest):
+    '''Smallest unsigned dtype that holds counts up to largest'''
+    for dtype in (np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+def shrinkScores(scores, counts, shrinkage, largerIsCloser=True):
+    '''Significance weighting of scores that are backed by counts ratings.
+    A similarity is scaled by counts / (counts + shrinkage) so pairs with
+    little support are pulled toward 0, a distance, where smaller is closer,
+    is divided by it so it grows. shrinkage of 0 returns scores unchanged.'''
+    if not shrinkage:
+        return scores
+    weight = np.asarray(counts, dtype=np.float64)
+    weight = weight / (weight + shrinkage)
+    if largerIsCloser:
+        return scores * weight
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(weight > 0, scores / weight, np.inf)
+
+#------------------------------------------------------------------------------
+#Start of SupportCounts class
+class SupportCounts:
+    def __init__(self, indptr=None, indices=None, counts=None, matrix=None, minCount=1):
+        '''Symmetric count matrix of how many keys every pair of rows shares,
+        a row does not count itself. Only the pairs sharing at least minCount
+        keys are kept, the counts of the others read as 0.
+        The counts are stored either as sparse rows, row i lists the rows it
+        shares minCount keys with in id order, indices[indptr[i]:indptr[i+1]],
+        and their counts, or as a dense (rows x rows) matrix, whichever
+        fromPostings found smaller. Sparse rows cost 4 bytes plus the count
+        dtype per kept pair, the matrix the count dtype per cell, so the
+        storage never exceeds rows * rows * 2 bytes with uint16 counts.
+        Sparse rows changed by refresh are kept per row and merged in on
+        read until compact folds them into the arrays, the matrix is
+        changed in place.'''
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.matrix = matrix
+        self.minCount = max(int(minCount), 1)
+        self._changes = {}
+        self._pending = 0
+
+    @classmethod
+    def users(cls, ratings, minCount=1):
+        '''Number of items every pair of users of a RatingMatrix rated in common'''
+        colptr, colUsers, colRatings = ratings.csc
+        return cls.fromPostings(ratings.indptr, ratings.indices, colptr, colUsers,
+                                ratings.numUsers, minCount)
+
+    @classmethod
+    def items(cls, ratings, minCount=1):
+        '''Number of users that rated every pair of items of a RatingMatrix'''
+        colptr, colUsers, colRatings = ratings.csc
+        return cls.fromPostings(colptr, colUsers, ratings.indptr, ratings.indices,
+                                ratings.numItems, minCount)
+
+    @classmethod
+    def fromPostings(cls, rowptr, rowKeys, keyptr, keyRows, numRows, minCount=1):
+        '''Counts the keys every pair of rows shares. rowptr and rowKeys list
+        the keys of every row, keyptr and keyRows the rows of every key. Rows
+        are counted a block at a time: the rows sharing each key of the block
+        are looked up in the postings and counted with bincount, blocks are
+        sized so at most BLOCK_CELLS cells and BLOCK_PAIRS pairs are held.
+        Each block is cast to the count dtype, which fits the longest row,
+        as soon as it is counted and only its pairs sharing minCount keys
+        are kept. Once the kept pairs take more memory than a dense matrix
+        the counts move into one, so the peak is at most about twice the
+        dense matrix plus one block, some 50 MB.'''
+        minCount = max(int(minCount), 1)
+        rowLengths = np.diff(rowptr)[:numRows]
+        dtype = countDtype(int(rowLengths.max()) if numRows else 0)
+        denseBytes = numRows * numRows * dtype.itemsize
+        pairBytes = np.dtype(np.int32).itemsize + dtype.itemsize
+        keyLengths = np.diff(keyptr)
+        rowPairs = np.zeros(numRows, dtype=np.int64)
+        if numRows:
+            owners = np.repeat(np.arange(numRows), rowLengths)
+            rowPairs = np.bincount(owners, keyLengths[rowKeys[:len(owners)]],
+                                   minlength=numRows).astype(np.int64)
+        cumulative = np.cumsum(rowPairs)
+        blockRows = max(BLOCK_CELLS // max(numRows, 1), 1)
+        lengths = np.zeros(numRows, dtype=np.int64)
+        blocks = []
+        indices = [np.zeros(0, dtype=np.int32)]
+        counts = [np.zeros(0, dtype=dtype)]
+        kept = 0
+        matrix = None
+        start = 0
+        while start < numRows:
+            done = cumulative[start - 1] if start else 0
+            stop = int(np.searchsorted(cumulative, done + BLOCK_PAIRS, side='right'))
+            stop = min(max(stop, start + 1), start + blockRows, numRows)
+            rows = np.arange(start, stop)
+            positions, keyCounts = postingRanges(rowptr, rows)
+            others, otherCounts = postingRanges(keyptr, rowKeys[positions])
+            owners = np.repeat(np.repeat(rows - start, keyCounts), otherCounts)
+            cells = owners * numRows + keyRows[others]
+            del positions, others, owners
+            block = np.bincount(cells, minlength=len(rows) * numRows).astype(dtype)
+            del cells
+            block = block.reshape(len(rows), numRows)
+            block[np.arange(len(rows)), rows] = 0
+            if matrix is not None:
+                matrix[start:stop] = block
+                start = stop
+                continue
+            (found, columns) = np.nonzero(block >= minCount)
+            lengths[start:stop] = np.bincount(found, minlength=len(rows))
+            blocks.append((start, stop))
+            indices.append(columns.astype(np.int32))
+            counts.append(block[found, columns])
+            kept += len(columns)
+            del block, found, columns
+            if kept * pairBytes > denseBytes:
+                #The pairs kept so far already outgrow the dense matrix, they
+                #are moved into it a block at a time.
+                matrix = np.zeros((numRows, numRows), dtype=dtype)
+                del indices[0], counts[0]
+                for (blockStart, blockStop) in blocks:
+                    owners = np.repeat(np.arange(blockStart, blockStop),
+                                       lengths[blockStart:blockStop])
+                    matrix[owners, indices.pop(0)] = counts.pop(0)
+                    del owners
+            start = stop
+        if matrix is not None:
+            return cls(matrix=matrix, minCount=minCount)
+        indptr = np.zeros(numRows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return cls(indptr, np.concatenate(indices), np.concatenate(counts), minCount=minCount)
+
+    @classmethod
+    def fromState(cls, arrays, minCount=1):
+        '''Rebuilds the counts from the arrays of state'''
+        if 'matrix' in arrays:
+            return cls(matrix=arrays['matrix'], minCount=minCount)
+        return cls(arrays['indptr'], arrays['indices'], arrays['counts'], minCount=minCount)
+
+    def state(self):
+        '''The arrays of the counts by name, compacted first'''
+        if self.matrix is not None:
+            return {'matrix': self.matrix}
+        self.compact()
+        return {'indptr': self.indptr, 'indices': self.indices, 'counts': self.counts}
+
+    @property
+    def numRows(self):
+        '''Number of rows, rows added by refresh are included'''
+        if self.matrix is not None:
+            return len(self.matrix)
+        return max(len(self.indptr) - 1, max(self._changes, default=-1) + 1)
+
+    @property
+    def dtype(self):
+        return (self.matrix if self.matrix is not None else self.counts).dtype
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.state().values())
+
+    def row(self, i):
+        '''(ids, counts) of the rows that share at least minCount keys with
+        row i, in id order'''
+        if self.matrix is not None:
+            if i >= len(self.matrix):
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            ids = np.flatnonzero(self.matrix[i] >= self.minCount)
+            return ids, self.matrix[i, ids].astype(np.int64)
+        if i < len(self.indptr) - 1:
+            start, stop = self.indptr[i], self.indptr[i + 1]
+            ids = self.indices[start:stop].astype(np.int64)
+            counts = self.counts[start:stop].astype(np.int64)
+        else:
+            ids = np.zeros(0, dtype=np.int64)
+            counts = np.zeros(0, dtype=np.int64)
+        changes = self._changes.get(i)
+        if changes:
+            changedIDs = np.fromiter(changes.keys(), dtype=np.int64, count=len(changes))
+            changedCounts = np.fromiter(changes.values(), dtype=np.int64, count=len(changes))
+            unchanged = ~np.isin(ids, changedIDs)
+            ids = np.concatenate([ids[unchanged], changedIDs])
+            counts = np.concatenate([counts[unchanged], changedCounts])
+            order = np.argsort(ids)
+            kept = counts[order] >= self.minCount
+            ids = ids[order][kept]
+            counts = counts[order][kept]
+        return ids, counts
+
+    def candidates(self, i, min_overlap=1):
+        '''(ids, counts) of the rows that share at least min_overlap keys
+        with row i, in id order'''
+        ids, counts = self.row(i)
+        kept = counts >= min_overlap
+        return ids[kept], counts[kept]
+
+    def lookup(self, i, ids):
+        '''Counts of row i against the rows ids, 0 for rows it shares fewer
+        than minCount keys with'''
+        rowIDs, rowCounts = self.row(i)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(rowIDs) == 0:
+            return np.zeros(len(ids), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(rowIDs, ids), len(rowIDs) - 1)
+        return np.where(rowIDs[positions] == ids, rowCounts[positions], 0)
+
+    def count(self, i, j):
+        '''Number of keys rows i and j share'''
+        return int(self.lookup(i, [j])[0])
+
+    def refresh(self, i, rowptr, rowKeys, keyptr, keyRows, numRows):
+        '''Counts row i again from the postings, laid out as for fromPostings,
+        after keys were added to or removed from it, and sets its count in
+        every row it shares keys with or used to. Counts are recomputed rather
+        than adjusted so the pairs below minCount, which are not stored, come
+        out right. Sparse changes are folded into the arrays by compact once
+        they hold a quarter as many entries.'''
+        positions = np.arange(rowptr[i], rowptr[i + 1])
+        others, otherCounts = postingRanges(keyptr, rowKeys[positions])
+        counts = np.bincount(keyRows[others], minlength=numRows).astype(np.int64)
+        counts[i] = 0
+        if len(counts) and counts.max() > np.iinfo(self.dtype).max:
+            self._widen(countDtype(int(counts.max())))
+        if self.matrix is not None:
+            self._grow(numRows)
+            if not self.matrix.flags.writeable:
+                #A memory mapped matrix is copied, the file is never written.
+                self.matrix = self.matrix.copy()
+            self.matrix[i, :numRows] = counts
+            self.matrix[:numRows, i] = counts
+            return
+        oldIDs, oldCounts = self.row(i)
+        changed = np.union1d(oldIDs, np.flatnonzero(counts >= self.minCount))
+        changes = self._changes.setdefault(i, {})
+        for (other, count) in zip(changed.tolist(), counts[changed].tolist()):
+            changes[other] = count
+            self._changes.setdefault(other, {})[i] = count
+        self._pending += 2 * len(changed)
+        if self._pending > max(len(self.indices) // 4, 1 << 16):
+            self.compact()
+
+    def _widen(self, dtype):
+        if self.matrix is not None:
+            self.matrix = self.matrix.astype(dtype)
+        else:
+            self.counts = self.counts.astype(dtype)
+
+    def _grow(self, numRows):
+        if numRows <= len(self.matrix):
+            return
+        matrix = np.zeros((numRows, numRows), dtype=self.matrix.dtype)
+        matrix[:len(self.matrix), :len(self.matrix)] = self.matrix
+        self.matrix = matrix
+
+    def compact(self):
+        '''Folds the changes of refresh into the sparse arrays. Only the
+        changed rows are merged, the others are copied over as they are.'''
+        if self.matrix is not None or not self._changes:
+            return
+        numRows = self.numRows
+        stored = len(self.indptr) - 1
+        lengths = np.zeros(numRows, dtype=np.int64)
+        lengths[:stored] = np.diff(self.indptr)
+        indices = []
+        counts = []
+        previous = 0
+        for i in sorted(self._changes):
+            if i > previous and previous < stored:
+                start, stop = self.indptr[previous], self.indptr[min(i, stored)]
+                indices.append(self.indices[start:stop])
+                counts.append(self.counts[start:stop])
+            ids, rowCounts = self.row(i)
+            lengths[i] = len(ids)
+            indices.append(ids.astype(np.int32))
+            counts.append(rowCounts.astype(self.counts.dtype))
+            previous = i + 1
+        if previous < stored:
+            indices.append(self.indices[self.indptr[previous]:])
+            counts.append(self.counts[self.indptr[previous]:])
+        self.indptr = np.zeros(numRows + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.indptr[1:])
+        self.indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32)
+        self.counts = (np.concatenate(counts) if counts
+                       else np.zeros(0, dtype=self.counts.dtype))
+        self._changes = {}
+        self._pending = 0
+#End of SupportCounts class
+#------------------------------------------------------------------------------
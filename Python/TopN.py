@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Top n selection shared by the neighbor search and every prediction path.
+Scores are kept in arrays indexed by id, items that are filtered out or
+have no prediction are NaN, and only the ids that can reach the top n are
+sorted, rounded and handed back for name lookups.
+"""
+import numpy as np
+
+def selectTop(scores, k, largest=True):
+    '''Returns the indices of the k best scores, best first. Ties keep index
+    order so the result is the first k of a stable sort, but only the
+    candidates that can be in the top k are sorted. k of None sorts all.'''
+    key = -scores if largest else scores
+    if k is None or k >= len(key):
+        return np.argsort(key, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kth = np.partition(key, k - 1)[k - 1]
+    candidates = np.flatnonzero(key <= kth)
+    order = np.argsort(key[candidates], kind='stable')
+    return candidates[order[:k]]
+
+def topN(scores, n, decimals=None, tieOrder=None):
+    '''Returns (ids, values) of the n largest scores that are not NaN, best
+    first. With decimals the values are round(score, decimals) and the
+    order is that of the rounded values, ties in id order, exactly like
+    rounding every score and stable sorting the whole list. Only the scores
+    within one rounding step of the n-th best are rounded and sorted.
+    param tieOrder is an optional array by id, ties are then ordered by it
+    and by id after that. It can also be a function that returns the keys
+    of an array of ids, it is then only called for the ids that can reach
+    the top n.'''
+    ids = np.flatnonzero(~np.isnan(scores))
+    values = scores[ids]
+    if n is not None and n < len(ids):
+        if n <= 0:
+            return ids[:0], []
+        nth = -np.partition(-values, n - 1)[n - 1]
+        #Rounding moves a score by at most half a step so a score more than
+        #a step below the n-th best cannot reach the top n.
+        margin = 0.0 if decimals is None else 10.0 ** -decimals
+        keep = values >= nth - margin
+        ids = ids[keep]
+        values = values[keep]
+    if tieOrder is not None:
+        keys = tieOrder(ids) if callable(tieOrder) else tieOrder[ids]
+        first = np.argsort(keys, kind='stable')
+        ids = ids[first]
+        values = values[first]
+    if decimals is None:
+        values = [float(value) for value in values]
+    else:
+        values = [round(float(value), decimals) for value in values]
+    order = np.argsort(-np.array(values), kind='stable')[:n]
+    return ids[order], [values[i] for i in order]
+
+def filterScores(scores, exclude=None, support=None, min_support=None, min_rating=None):
+    '''Drops scores in place by setting them to NaN.
+    param exclude is a sequence of ids that must not be recommended
+    param support is the number of ratings behind every score, scores with
+    less than min_support are dropped
+    param min_rating drops scores below it'''
+    if exclude is not None and len(exclude):
+        scores[np.asarray(exclude, dtype=np.int64)] = np.nan
+    if min_support is not None and support is not None:
+        scores[support < min_support] = np.nan
+    if min_rating is not None:
+        with np.errstate(invalid='ignore'):
+            scores[scores < min_rating] = np.nan
+    return scores
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+Shared fixtures of the tests. The modules live flat in Python/ and import
+each other by name, so that directory is put on the path.
+"""
+import os
+import sys
+import pytest
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(PYTHON_DIR), 'Data')
+sys.path.insert(0, PYTHON_DIR)
+
+@pytest.fixture
+def dataPath():
+    '''Returns the path of a file in the Data folder'''
+    return lambda name: os.path.join(DATA_DIR, name)
+
+@pytest.fixture
+def bandRatings(dataPath):
+    '''Band_Ratings.csv as {'User' : {'Band': rating}}'''
+    import pandas as pd
+    return pd.read_csv(dataPath('Band_Ratings.csv'), index_col='Band').to_dict()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+from AnnIndex import AnnIndex
+from Benchmark import benchmarkAnn, syntheticRatings
+
+def test_query_falls_back_only_when_asked():
+    ratings = syntheticRatings(200, 60, 0.15)
+    index = AnnIndex(ratings, clusters=40, probes=1, missing='zero')
+    rows = [ratings.userRow(userID) for userID in range(ratings.numUsers)]
+    userIDs = np.arange(ratings.numUsers)
+    k = 10
+    found = index.query(rows, k, 'pearson', exclude=userIDs, fallback=False)
+    short = sum(len(ids) < k for (ids, distances) in found)
+    assert short > 0
+    assert index.stats()['fallbacks'] == 0
+    for ((ids, distances), userID) in zip(found, userIDs):
+        assert userID not in ids
+    found = index.query(rows, k, 'pearson', exclude=userIDs)
+    assert all(len(ids) == k for (ids, distances) in found)
+    assert index.stats()['fallbacks'] == short
+
+def test_benchmark_leaves_the_query_user_out():
+    ratings = syntheticRatings(100, 40, 0.2)
+    results = benchmarkAnn('synthetic', ratings, queries=20, k=5, missing='zero',
+                           probes=(1, 1000))
+    exact, few, every = results
+    assert exact['candidates'] == ratings.numUsers - 1
+    #Probing every cluster scores every other user and finds the exact neighbors.
+    assert every['candidates'] == ratings.numUsers - 1
+    assert every['fallbacks'] == 0.0
+    assert every['recall'] == 1.0
+    assert few['candidates'] < every['candidates']
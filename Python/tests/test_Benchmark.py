@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+import pytest
+from Benchmark import SIZES, sampleItems, syntheticRatings
+
+@pytest.mark.parametrize('size', sorted(SIZES))
+def test_synthetic_density_is_the_one_asked_for(size):
+    (numUsers, numItems, density) = SIZES[size]
+    ratings = syntheticRatings(numUsers, numItems, density)
+    #Poisson counts around density * numItems, none of them lost to duplicates.
+    assert ratings.nnz / (numUsers * numItems) == pytest.approx(density, rel=0.05)
+
+def test_items_are_drawn_without_replacement_by_popularity():
+    rng = np.random.default_rng(1)
+    popularity = np.array([0.5, 0.3, 0.15, 0.05])
+    counts = rng.integers(1, 5, 20000)
+    itemIDs = sampleItems(rng, counts, popularity, blockEntries=1000)
+    starts = np.cumsum(counts) - counts
+    assert len(itemIDs) == counts.sum()
+    for (start, count) in zip(starts[:500], counts[:500]):
+        row = itemIDs[start:start + count]
+        assert np.all(np.diff(row) > 0)
+    #Two draws from four items take item 0 first with probability 0.5 and
+    #second with probability sum(p[b] * 0.5 / (1 - p[b])) over the others.
+    pairs = itemIDs[np.repeat(counts == 2, counts)]
+    expected = 0.5 + sum(p * 0.5 / (1 - p) for p in popularity[1:])
+    assert np.mean(pairs == 0) * 2 == pytest.approx(expected, abs=0.02)
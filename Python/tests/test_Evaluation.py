@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+from Benchmark import syntheticRatings
+from Evaluation import evaluate, scoreMethod, trainMethod
+from TopN import topN
+
+def test_knn_scores_are_the_ones_recommend_ranks(capsys):
+    train = syntheticRatings(200, 60, 0.15)
+    userIDs = np.arange(0, 200, 7)
+    for metric in ('pearson', 'manhattan', 'euclidean'):
+        options = {'metric': metric, 'k': 3}
+        model = trainMethod(train, 'knn', options)
+        #The metric is set without the message of the metric setter.
+        assert capsys.readouterr().out == ''
+        assert model.metric == metric
+        scores = scoreMethod(train, 'knn', options, model, userIDs, (1, 5))
+        for (row, userID) in zip(scores, userIDs):
+            if np.isnan(row).all():
+                #recommend divides by a total distance of 0 for these.
+                continue
+            itemIDs, values = topN(row, model.n, 2)
+            recommendations = model.recommend(train.users[userID])
+            #recommend lists equal scores in the order the neighbors rated them.
+            assert [value for (item, value) in recommendations] == values
+            for (item, value) in recommendations:
+                assert round(row[train.itemIndex[item]], 2) == value
+
+def test_evaluate_reports_every_method():
+    results = evaluate(syntheticRatings(150, 50, 0.2), ['knn:pearson:3', 'slopeone',
+                                                        'cosine:10'], folds=3, workers=1)
+    assert [result['method'] for result in results] == ['knn:pearson:3', 'slopeone',
+                                                        'cosine:10']
+    for result in results:
+        assert result['folds'] == 3
+        assert 0 < result['coverage'] <= 1
+        assert result['mae'] is not None and result['mae'] >= 0
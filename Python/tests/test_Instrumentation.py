@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import pytest
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+
+@pytest.fixture(scope='module')
+def recommender():
+    r = Recommender(syntheticRatings(40, 20, 0.5), 3, 'pearson', 5)
+    r.computeDeviations()
+    r.computeAverages()
+    r.computeSimilarityMatrix()
+    return r
+
+def test_profile_breakdown_names_every_stage(recommender):
+    user = recommender.data.users[0]
+    query = recommender.data[user]
+    calls = [(lambda: recommender.recommend(user, profile=True),
+              ['neighbors.distances', 'neighbors.select', 'knn.score', 'knn.sort'],
+              ['pairsCompared', 'itemsScored']),
+             (lambda: recommender.recommenderTable(user, profile=True),
+              ['neighbors.distances', 'neighbors.select', 'knn.score', 'knn.sort', 'table'],
+              ['pairsCompared', 'itemsScored']),
+             (lambda: recommender.weightedSlopeOne(query, profile=True),
+              ['slopeOne.input', 'slopeOne.score', 'slopeOne.sort'], ['itemsScored']),
+             (lambda: recommender.cosineSimPredict(query, profile=True),
+              ['cosine.normalize', 'cosine.score', 'cosine.sort'], ['itemsScored'])]
+    for (call, stages, counters) in calls:
+        (result, breakdown) = call()
+        assert sorted(breakdown['stages']) == sorted(stages)
+        assert sorted(breakdown['calls']) == sorted(stages)
+        assert sorted(breakdown['counters']) == sorted(counters)
+        assert breakdown['total'] >= sum(breakdown['stages'].values())
+    assert recommender.recommend(user, profile=True)[0] == recommender.recommend(user)
+    assert recommender.tracer.breakdown() == {'stages': {}, 'calls': {}, 'counters': {}}
+
+def test_tracer_sums_stages_and_forwards_events(recommender):
+    events = []
+    tracer = recommender.enableTracing(events.append)
+    try:
+        users = recommender.data.users[:3]
+        for user in users:
+            recommender.recommend(user)
+        breakdown = tracer.breakdown()
+        assert breakdown['calls'] == {'neighbors.distances': 3, 'neighbors.select': 3,
+                                      'knn.score': 3, 'knn.sort': 3}
+        assert breakdown['counters']['pairsCompared'] == 3 * (recommender.data.numUsers - 1)
+        assert len(events) == 12 + 6
+        assert sum(event['seconds'] for event in events if 'stage' in event) == \
+            pytest.approx(sum(breakdown['stages'].values()))
+        #A profiled call is counted by the tracer as well.
+        (result, profile) = recommender.recommend(users[0], profile=True)
+        assert tracer.calls['knn.score'] == 4
+        assert profile['calls']['knn.score'] == 1
+        tracer.reset()
+        assert tracer.breakdown() == {'stages': {}, 'calls': {}, 'counters': {}}
+    finally:
+        recommender.disableTracing()
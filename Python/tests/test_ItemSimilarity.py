@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+from concurrent.futures import ThreadPoolExecutor
+from math import isnan, sqrt
+import threading
+import numpy as np
+import pytest
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+
+def dictCosineSimilarity(data, averages, itemI, itemJ):
+    '''Adjusted cosine of two items over {'User' : {'Item': rating}}, one
+    user at a time like the original dictionary implementation'''
+    sumNumer = 0.0
+    sumDenomRi = 0.0
+    sumDenomRj = 0.0
+    for (user, ratings) in data.items():
+        if itemI in ratings and itemJ in ratings:
+            if not (isnan(ratings[itemI]) or isnan(ratings[itemJ])):
+                userAverage = averages[user]
+                sumNumer += (ratings[itemI] - userAverage) * (ratings[itemJ] - userAverage)
+                sumDenomRi += (ratings[itemI] - userAverage)**2
+                sumDenomRj += (ratings[itemJ] - userAverage)**2
+    denom = sqrt(sumDenomRi) * sqrt(sumDenomRj)
+    if denom == 0.0:
+        return 0.0
+    return sumNumer / denom
+
+def dictAverages(data):
+    averages = {}
+    for (user, ratings) in data.items():
+        rated = [rating for rating in ratings.values() if not isnan(rating)]
+        averages[user] = sum(rated) / len(rated)
+    return averages
+
+@pytest.fixture(params=['band', 'synthetic'])
+def ratings(request, bandRatings):
+    if request.param == 'band':
+        return bandRatings
+    return syntheticRatings(60, 25, 0.3).toDict()
+
+@pytest.mark.parametrize('online', [False, True])
+def test_vectorized_cosine_matches_dict_cosine(ratings, online):
+    averages = dictAverages(ratings)
+    r = Recommender(ratings)
+    r.computeAverages()
+    r.computeSimilarityMatrix(online=online)
+    items = r.data.items
+    for (i, itemI) in enumerate(items):
+        for (j, itemJ) in enumerate(items):
+            if i == j:
+                continue
+            expected = dictCosineSimilarity(ratings, averages, itemI, itemJ)
+            assert r.cosineSimilarity(itemI, itemJ) == pytest.approx(expected, abs=1e-12)
+            assert r.simMatrix.similarity(i, j) == pytest.approx(expected, abs=1e-12)
+    np.testing.assert_allclose(r.usersRatingAverages,
+                               [averages[user] for user in r.data.users])
+
+def test_cosine_leaves_the_ratings_alone_and_batches_match_single_calls(ratings):
+    r = Recommender(ratings)
+    r.computeAverages()
+    r.computeSimilarityMatrix()
+    queries = [ratings[user] for user in r.data.users]
+    copies = [dict(query) for query in queries]
+    single = [r.cosineSimPredict(query) for query in queries]
+    assert [list(query.items()) for query in queries] == [list(copy.items()) for copy in copies]
+    assert r.cosineSimPredictBatch(queries) == single
+    assert [list(query.items()) for query in queries] == [list(copy.items()) for copy in copies]
+
+def test_concurrent_reads_rebuild_stale_rows_once():
+    ratings = syntheticRatings(80, 30, 0.3)
+    events = [('u1', 'i3', 5.0), ('u2', 'i7', None), ('u9', 'i0', 2.0), ('u40', 'i12', 4.0)]
+    expected = Recommender(ratings.toDict())
+    expected.computeAverages()
+    expected.computeSimilarityMatrix(online=True)
+    expected.apply_updates(events)
+    queries = [expected.data[user] for user in expected.data.users]
+    expected = [expected.cosineSimPredict(query) for query in queries]
+    r = Recommender(ratings.toDict())
+    r.computeAverages()
+    r.computeSimilarityMatrix(online=True)
+    r.apply_updates(events)
+    rows = r.cosineSums.rows
+    calls = []
+    def countedRows(items):
+        calls.append(len(items))
+        return rows(items)
+    r.cosineSums.rows = countedRows
+    barrier = threading.Barrier(8)
+    def predict(query):
+        barrier.wait()
+        return r.cosineSimPredict(query)
+    with ThreadPoolExecutor(8) as pool:
+        got = list(pool.map(predict, queries[:8]))
+    assert got == expected[:8]
+    assert len(calls) == 1
+    assert [r.cosineSimPredict(query) for query in queries] == expected
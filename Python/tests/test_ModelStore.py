@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+from Recommender import Recommender
+
+def test_rating_changes_on_memory_mapped_model(tmp_path, bandRatings):
+    r = Recommender(bandRatings, 2, 'pearson', 5)
+    r.computeAverages()
+    r.save(str(tmp_path))
+    loaded = Recommender.load(str(tmp_path), mmap=True)
+    assert not loaded.data.indptr.flags.writeable
+    for recommender in (r, loaded):
+        recommender.add_rating('Angelica', 'Deadmau5', 2.0)
+        recommender.add_rating('Newcomer', 'Phoenix', 4.0)
+        recommender.update_rating('Hailey', 'Broken Bells', 1.0)
+        recommender.remove_rating('Bill', 'Deadmau5')
+    assert loaded.data.nnz == loaded.data.indptr[-1] == r.data.nnz
+    assert loaded.data.toDict() == r.data.toDict()
+    np.testing.assert_allclose(loaded.usersRatingAverages, r.usersRatingAverages)
+    for user in ('Angelica', 'Hailey', 'Bill'):
+        assert loaded.recommend(user) == r.recommend(user)
+    #The saved files are untouched.
+    again = Recommender.load(str(tmp_path), mmap=True)
+    assert again.data.toDict() == Recommender(bandRatings).data.toDict()
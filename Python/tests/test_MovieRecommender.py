@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+
+The recommendations for Movie_Ratings.csv are pinned to the ones of the
+original dictionary based MovieRecommender and Recommender, kept in
+data/movie_ratings_baseline.json, item order of equal scores included.
+"""
+import json
+import os
+import pytest
+from MovieRecommender import MovieRecommender
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                        'movie_ratings_baseline.json')
+
+@pytest.fixture(scope='module')
+def baseline():
+    with open(BASELINE, encoding='utf-8') as f:
+        return json.load(f)
+
+def assertRecommendations(got, expected):
+    assert [title for (title, rating) in got] == [title for (title, rating) in expected]
+    assert [rating for (title, rating) in got] == pytest.approx(
+        [rating for (title, rating) in expected], abs=1e-9)
+
+@pytest.mark.parametrize('metric', ['pearson', 'manhattan', 'euclidean'])
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_knn_matches_baseline(dataPath, baseline, metric, k):
+    m = MovieRecommender(dataPath('Movie_Ratings.csv'), k, metric, 5)
+    m.cleanData()
+    expected = baseline['knn']['%s:%d' % (metric, k)]
+    assert sorted(expected) == sorted(m.data.keys())
+    for (user, recommendations) in expected.items():
+        assertRecommendations(m.recommend(user), recommendations)
+
+def test_slope_one_matches_baseline(dataPath, baseline):
+    m = MovieRecommender(dataPath('Movie_Ratings.csv'))
+    m.cleanData()
+    m.computeDeviations()
+    for (user, recommendations) in baseline['slopeone'].items():
+        assertRecommendations(m.weightedSlopeOne(m.data[user]), recommendations)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+from Benchmark import syntheticRatings
+from Parallel import recommendAll
+from Recommender import Recommender
+
+def test_workers_match_one_process():
+    r = Recommender(syntheticRatings(300, 100, 0.1), 5, 'pearson', 10)
+    users = r.data.users[:100]
+    serial = list(recommendAll(r, users, workers=1))
+    assert list(recommendAll(r, users, workers=2, chunksize=8)) == serial
+
+def test_chunks_in_flight_are_bounded():
+    r = Recommender(syntheticRatings(300, 100, 0.1), 5, 'pearson', 10)
+    read = []
+    def users():
+        for user in r.data.users:
+            read.append(user)
+            yield user
+    results = recommendAll(r, users(), workers=2, chunksize=4)
+    next(results)
+    #Two chunks per worker are sent before the first one is waited on.
+    assert len(read) <= 4 * 4 + 4
+    results.close()
+
+def test_model_state_keeps_the_trained_index():
+    r = Recommender(syntheticRatings(300, 100, 0.1), 5, 'pearson', 10)
+    index = r.enableApproximateNeighbors(clusters=8, probes=2)
+    index.probes = 3
+    rebuilt = Recommender.fromModelState(*r.modelState())
+    assert rebuilt.annIndex.centroids is index.centroids
+    np.testing.assert_array_equal(rebuilt.annIndex.assignments, index.assignments)
+    assert rebuilt.annIndex.lists == index.lists
+    assert rebuilt.annIndex.probes == 3
+    for user in r.data.users[:20]:
+        assert rebuilt.recommend(user) == r.recommend(user)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+import pytest
+import RatingMatrix as ratingMatrixModule
+from Benchmark import syntheticRatings
+from RatingMatrix import RatingMatrix
+
+def copyMatrix(ratings, writeable=True):
+    arrays = [array.copy() for array in (ratings.indptr, ratings.indices, ratings.values)]
+    for array in arrays:
+        array.flags.writeable = writeable
+    matrix = RatingMatrix(ratings.users, ratings.items, *arrays)
+    matrix.csc
+    return matrix
+
+def randomChanges(ratings, count, seed):
+    rng = np.random.default_rng(seed)
+    keys = rng.choice(ratings.numUsers * ratings.numItems, count, replace=False)
+    values = rng.integers(1, 6, count).astype(np.float64)
+    values[rng.integers(3, size=count) == 0] = np.nan
+    #Half of the changes hit stored ratings, updates and removals.
+    stored = ratings.rowUserIDs().astype(np.int64) * ratings.numItems + ratings.indices
+    keys[::2] = rng.choice(stored, len(keys[::2]), replace=False)
+    keys = np.unique(keys)
+    return keys // ratings.numItems, keys % ratings.numItems, values[:len(keys)]
+
+@pytest.mark.parametrize('count', [1, 5, 16])
+@pytest.mark.parametrize('writeable', [True, False])
+def test_row_changes_match_the_merge(monkeypatch, count, writeable):
+    ratings = syntheticRatings(80, 30, 0.2)
+    for seed in range(10):
+        userIDs, itemIDs, values = randomChanges(ratings, count, seed)
+        spliced = copyMatrix(ratings, writeable)
+        originals = (spliced.indptr, spliced.indices, spliced.values)
+        before = [array.copy() for array in originals]
+        previous = spliced.getRatings(userIDs, itemIDs)
+        spliced.applyChanges(userIDs, itemIDs, values)
+        monkeypatch.setattr(ratingMatrixModule, 'ROW_CHANGES_LIMIT', 0)
+        merged = copyMatrix(ratings)
+        merged.applyChanges(userIDs, itemIDs, values)
+        monkeypatch.undo()
+        for (got, expected) in zip((spliced.indptr, spliced.indices, spliced.values) + spliced.csc,
+                                   (merged.indptr, merged.indices, merged.values) + merged.csc):
+            np.testing.assert_array_equal(got, expected)
+        np.testing.assert_array_equal(spliced.getRatings(userIDs, itemIDs), values)
+        np.testing.assert_array_equal(previous, ratings.getRatings(userIDs, itemIDs))
+        if not writeable:
+            #Read only arrays were copied, not written.
+            for (array, copy) in zip(originals, before):
+                np.testing.assert_array_equal(array, copy)
+
+def test_get_ratings_finds_every_pair():
+    ratings = syntheticRatings(50, 40, 0.3)
+    userIDs, itemIDs = np.divmod(np.arange(ratings.numUsers * ratings.numItems),
+                                 ratings.numItems)
+    expected = [np.nan if ratings.getRating(userID, itemID) is None
+                else ratings.getRating(userID, itemID)
+                for (userID, itemID) in zip(userIDs.tolist(), itemIDs.tolist())]
+    np.testing.assert_array_equal(ratings.getRatings(userIDs, itemIDs), expected)
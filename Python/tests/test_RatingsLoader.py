@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import tracemalloc
+import numpy as np
+from RatingsLoader import readTripletCsv, readWideCsv
+
+def test_wide_csv_matches_pandas(dataPath, bandRatings):
+    ratings = readWideCsv(dataPath('Band_Ratings.csv'))
+    expected = {user: {band: rating for (band, rating) in bands.items() if rating == rating}
+                for (user, bands) in bandRatings.items()}
+    assert ratings.toDict() == expected
+
+def test_triplet_csv_of_millions_of_rows_streams(tmp_path):
+    rows = 2000000
+    rng = np.random.default_rng(0)
+    users = rng.integers(0, 20000, rows)
+    items = rng.integers(0, 3000, rows)
+    ratings = rng.integers(1, 6, rows)
+    path = str(tmp_path / 'ratings.csv')
+    with open(path, 'w') as f:
+        f.write('user,item,rating\n')
+        for start in range(0, rows, 100000):
+            stop = start + 100000
+            f.write(''.join('u%d,i%d,%d\n' % row for row in zip(users[start:stop].tolist(),
+                                                                items[start:stop].tolist(),
+                                                                ratings[start:stop].tolist())))
+    tracemalloc.start()
+    try:
+        loaded = readTripletCsv(path)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    #Typed arrays while parsing and the CSR arrays, not python objects per row.
+    assert peak < 64 * rows
+    keys = users * 3000 + items
+    assert loaded.nnz == len(np.unique(keys))
+    #A repeated (user, item) pair keeps the last rating.
+    last = len(keys) - 1 - np.unique(keys[::-1], return_index=True)[1]
+    for position in last[:1000:97].tolist():
+        userID = loaded.userIndex['u%d' % users[position]]
+        itemID = loaded.itemIndex['i%d' % items[position]]
+        assert loaded.getRating(userID, itemID) == ratings[position]
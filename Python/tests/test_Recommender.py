@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import json
+import os
+import numpy as np
+import pytest
+from Benchmark import syntheticRatings
+from RatingMatrix import RatingMatrix
+from Recommender import Recommender
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data',
+                        'band_ratings_baseline.json')
+
+def test_read_only_slope_one_rejects_rating_changes(tmp_path, bandRatings):
+    r = Recommender(bandRatings)
+    r.computeDeviations(path=str(tmp_path))
+    before = r.data.toDict()
+    users = list(r.data.users)
+    with pytest.raises(ValueError):
+        r.add_rating('Newcomer', 'Phoenix', 4.0)
+    with pytest.raises(ValueError):
+        r.update_rating('Hailey', 'Broken Bells', 1.0)
+    with pytest.raises(ValueError):
+        r.remove_rating('Bill', 'Deadmau5')
+    with pytest.raises(ValueError):
+        r.apply_updates([('Angelica', 'Deadmau5', 2.0)])
+    assert r.data.toDict() == before
+    assert r.data.users == users
+
+def test_loaded_slope_one_follows_rating_changes(tmp_path, bandRatings):
+    r = Recommender(bandRatings)
+    r.computeDeviations()
+    r.save(str(tmp_path))
+    loaded = Recommender.load(str(tmp_path), mmap=False)
+    for recommender in (r, loaded):
+        recommender.add_rating('Angelica', 'Deadmau5', 2.0)
+    assert loaded.weightedSlopeOne(loaded.data['Hailey']) == r.weightedSlopeOne(r.data['Hailey'])
+    mapped = Recommender.load(str(tmp_path), mmap=True)
+    with pytest.raises(ValueError):
+        mapped.add_rating('Angelica', 'Deadmau5', 2.0)
+    assert 'Deadmau5' not in mapped.data['Angelica']
+
+def trainedRecommender(ratings):
+    r = Recommender(RatingMatrix(ratings.users, ratings.items, ratings.indptr.copy(),
+                                 ratings.indices.copy(), ratings.values.copy()),
+                    5, 'pearson', 10)
+    r.computeDeviations()
+    r.computeAverages()
+    r.computeSimilarityMatrix(online=True)
+    r.computeSupport(2)
+    return r
+
+def ratingEvents(ratings, count, seed):
+    rng = np.random.default_rng(seed)
+    events = []
+    for event in range(count):
+        user = int(rng.integers(ratings.numUsers + 3))
+        item = int(rng.integers(ratings.numItems + 2))
+        rating = None if rng.integers(3) == 0 else float(rng.integers(1, 6))
+        events.append(('u' + str(user), 'i' + str(item), rating))
+    #Repeated pairs, the last event of a pair wins.
+    return events + events[:count // 4]
+
+def test_apply_updates_matches_one_event_at_a_time_and_a_rebuild():
+    ratings = syntheticRatings(120, 80, 0.1)
+    events = ratingEvents(ratings, 400, 2)
+    batched = trainedRecommender(ratings)
+    single = trainedRecommender(ratings)
+    applied = batched.apply_updates(events)
+    assert applied == sum(single.apply_updates([event]) for event in events)
+    assert batched.data.toDict() == single.data.toDict()
+    rebuilt = trainedRecommender(batched.data)
+    #The CSC arrays were patched, not rebuilt.
+    for (patched, built) in zip(batched.data.csc, RatingMatrix(
+            batched.data.users, batched.data.items, batched.data.indptr,
+            batched.data.indices, batched.data.values).csc):
+        np.testing.assert_array_equal(patched, built)
+    for r in (batched, single):
+        np.testing.assert_allclose(r.usersRatingAverages, rebuilt.usersRatingAverages)
+        np.testing.assert_array_equal(r.slopeOne.frequencies, rebuilt.slopeOne.frequencies)
+        np.testing.assert_allclose(r.slopeOne.deviationSums, rebuilt.slopeOne.deviationSums,
+                                   atol=1e-9)
+        np.testing.assert_allclose(r.cosineSums.numerator, rebuilt.cosineSums.numerator,
+                                   atol=1e-9)
+        for userID in range(r.data.numUsers):
+            for (updated, built) in zip(r.userSupport.row(userID),
+                                        rebuilt.userSupport.row(userID)):
+                np.testing.assert_array_equal(updated, built)
+        for user in ('u0', 'u5', 'u121'):
+            assert r.weightedSlopeOne(r.data[user]) == rebuilt.weightedSlopeOne(r.data[user])
+
+def test_missing_rating_changes_nothing(bandRatings):
+    r = Recommender(bandRatings)
+    r.computeDeviations()
+    frequencies = r.slopeOne.frequencies.copy()
+    before = r.data.toDict()
+    with pytest.raises(KeyError):
+        r.update_rating('Hailey', 'Phoenix', 4.0)
+    with pytest.raises(KeyError):
+        r.remove_rating('Hailey', 'Phoenix')
+    assert r.apply_updates([('Hailey', 'Phoenix', None)]) == 0
+    assert r.data.toDict() == before
+    np.testing.assert_array_equal(r.slopeOne.frequencies, frequencies)
+
+def test_equal_scores_keep_the_order_the_neighbors_rated_them_in():
+    nan = float('nan')
+    data = {'u': {'w': 1.0, 'v': 1.0, 'x': nan, 'y': nan},
+            'far': {'w': 1.0, 'v': 2.0, 'x': 2.0, 'y': nan},
+            'near': {'w': 1.5, 'v': 1.0, 'x': nan, 'y': 4.0}}
+    #x has the smaller item id but the nearest neighbor rated y.
+    assert Recommender(data, 2, 'manhattan').recommend('u') == [('y', 1.33), ('x', 1.33)]
+
+@pytest.fixture(scope='module')
+def bandBaseline():
+    '''Recommendations of the original dictionary based Recommender for
+    Band_Ratings.csv, item order of equal scores included'''
+    with open(BASELINE, encoding='utf-8') as f:
+        return json.load(f)
+
+def assertRecommendations(got, expected):
+    assert [title for (title, rating) in got] == [title for (title, rating) in expected]
+    assert [rating for (title, rating) in got] == pytest.approx(
+        [rating for (title, rating) in expected], abs=1e-9)
+
+@pytest.mark.parametrize('metric', ['pearson', 'manhattan', 'euclidean'])
+@pytest.mark.parametrize('k', [1, 2, 3])
+def test_knn_matches_baseline(bandRatings, bandBaseline, metric, k):
+    r = Recommender(bandRatings, k, metric, 5)
+    for (user, recommendations) in bandBaseline['knn']['%s:%d' % (metric, k)].items():
+        assertRecommendations(r.recommend(user), recommendations)
+
+def test_slope_one_and_cosine_match_baseline(bandRatings, bandBaseline):
+    r = Recommender(bandRatings)
+    r.computeDeviations()
+    r.computeAverages()
+    r.computeSimilarityMatrix()
+    for (user, recommendations) in bandBaseline['slopeone'].items():
+        assertRecommendations(r.weightedSlopeOne(bandRatings[user]), recommendations)
+    for (user, recommendations) in bandBaseline['cosine'].items():
+        assertRecommendations(r.cosineSimPredict(bandRatings[user]), recommendations)
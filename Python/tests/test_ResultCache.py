@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+from ResultCache import ResultCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_rating_change_drops_stale_lists():
+    r = Recommender(syntheticRatings(60, 30, 0.5), 3, 'pearson', 5)
+    users = r.data.users
+    neighbors = {name: [other for (other, distance) in nearest] for (name, nearest)
+                 in zip(users, r.computeNearestNeighbors(users, 3))}
+    #user is a neighbor of withUser and not of withoutUser.
+    withUser = users[0]
+    user = neighbors[withUser][0]
+    withoutUser = next(name for name in users
+                       if name != user and user not in neighbors[name])
+    cache = r.enableCache()
+    first = r.recommend(user)
+    #A miss for the recommendations and one for the neighbors.
+    assert cache.stats() == {'hits': 0, 'misses': 2, 'size': 2, 'maxsize': 1024}
+    assert r.recommend(user) == first
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+    for name in (withUser, withoutUser):
+        r.recommend(name)
+    assert len(cache) == 6
+    item = r.data.items[int(r.data.userRow(r.data.userIndex[user])[0][0])]
+    r.update_rating(user, item, 1 if r.data[user][item] != 1 else 5)
+    #The lists of user and of withUser are gone, withoutUser is kept.
+    assert len(cache) == 2
+    hits = cache.hits
+    r.recommend(withoutUser)
+    assert cache.hits == hits + 1
+    fresh = Recommender(r.data, 3, 'pearson', 5)
+    for name in (user, withUser):
+        misses = cache.misses
+        assert r.recommend(name) == fresh.recommend(name)
+        assert cache.misses == misses + 2
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResultCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+    clock.now = 9.5
+    assert cache.get('a') == 1
+    cache.put('b', 2)
+    clock.now = 10.0
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    clock.now = 19.5
+    assert cache.get('b', 'gone') == 'gone'
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(maxsize=2)
+    cache.put('a', 1, tags=['x'])
+    cache.put('b', 2, tags=['x'])
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    #b was used least recently.
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    cache.put('d', 4)
+    assert cache.get('a') is None
+    assert cache.invalidate('x') == 0
+    assert cache.stats() == {'hits': 3, 'misses': 2, 'size': 2, 'maxsize': 2}
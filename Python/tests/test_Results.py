@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import csv
+import pytest
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+from Results import COLUMNS, RECORD_DTYPE
+
+METHODS = ['knn', 'slopeone', 'cosine']
+
+@pytest.fixture(scope='module')
+def recommender():
+    r = Recommender(syntheticRatings(50, 30, 0.5), 3, 'pearson', 5)
+    r.computeDeviations()
+    r.computeAverages()
+    r.computeSimilarityMatrix()
+    r.productid2name = {item: 'Title ' + item for item in r.data.items[::2]}
+    return r
+
+def expectedRows(recommender, users, method):
+    '''(User, Rank, Title, Rating) rows of recommendUser for every user'''
+    return [(user, rank, title, rating) for user in users
+            for (rank, (title, rating))
+            in enumerate(recommender.recommendUser(user, method), 1)]
+
+@pytest.mark.parametrize('method', METHODS)
+def test_records_and_frame_match_single_users(recommender, method):
+    users = recommender.data.users[::-3]
+    blocks = list(recommender.recommendRecords(users, method, batchSize=4))
+    assert len(blocks) == 5
+    assert all(block.dtype == RECORD_DTYPE for block in blocks)
+    expected = expectedRows(recommender, users, method)
+    names = recommender.itemNames()
+    records = [(recommender.data.users[user], rank, names[item], score)
+               for block in blocks for (user, rank, item, score) in block.tolist()]
+    assert [row[:3] for row in records] == [row[:3] for row in expected]
+    assert [row[3] for row in records] == pytest.approx([row[3] for row in expected])
+    frame = recommender.recommendFrame(users, method, batchSize=4)
+    assert list(frame.columns) == COLUMNS
+    rows = list(zip(frame['User'].astype(str), frame['Rank'].tolist(),
+                    frame['Title'], frame['Rating'].tolist()))
+    assert rows == records
+
+def test_knn_records_match_recommend(recommender):
+    users = list(recommender.data.users)
+    frame = recommender.recommendFrame(users)
+    for user in users:
+        rows = frame[frame['User'] == user]
+        assert list(zip(rows['Title'], rows['Rating'])) == recommender.recommend(user)
+
+@pytest.mark.parametrize('method', METHODS)
+def test_csv_file_round_trips(tmp_path, recommender, method):
+    filename = tmp_path / 'recommendations.csv'
+    users = recommender.data.users[:12]
+    written = recommender.writeRecords(filename, users, method, batchSize=5)
+    frame = recommender.recommendFrame(users, method)
+    assert written == len(frame)
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        assert next(reader) == COLUMNS
+        rows = [(user, int(rank), title, float(rating))
+                for (user, rank, title, rating) in reader]
+    assert rows == list(zip(frame['User'].astype(str), frame['Rank'].tolist(),
+                            frame['Title'], frame['Rating'].tolist()))
+
+def test_parquet_file_round_trips(tmp_path, recommender):
+    pq = pytest.importorskip('pyarrow.parquet')
+    filename = tmp_path / 'recommendations.parquet'
+    written = recommender.writeRecords(filename, batchSize=7)
+    frame = recommender.recommendFrame()
+    assert written == len(frame)
+    table = pq.read_table(filename).to_pydict()
+    assert list(table) == COLUMNS
+    assert table['User'] == frame['User'].astype(str).tolist()
+    assert table['Rank'] == frame['Rank'].tolist()
+    assert table['Title'] == frame['Title'].tolist()
+    assert table['Rating'] == frame['Rating'].tolist()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import asyncio
+import json
+import pytest
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+from Server import InProcessClient, RecommendationServer
+
+@pytest.fixture(scope='module')
+def recommender():
+    r = Recommender(syntheticRatings(120, 40, 0.2), 3, 'pearson', 5)
+    r.computeDeviations()
+    return r
+
+def serve(recommender, requests, **options):
+    '''Runs requests(client) on a fresh server and returns its result'''
+    async def run():
+        server = RecommendationServer(recommender, **options)
+        try:
+            return await requests(InProcessClient(server))
+        finally:
+            await server.close()
+            server.executor.shutdown()
+    return asyncio.run(run())
+
+def test_concurrent_requests_are_batched(recommender):
+    users = recommender.data.users[:20]
+    async def requests(client):
+        responses = await asyncio.gather(*[client.knn(user) for user in users])
+        return responses, await client.stats()
+    responses, (status, stats) = serve(recommender, requests, maxBatchSize=8,
+                                       maxLatency=0.5)
+    for (user, (status, payload)) in zip(users, responses):
+        assert status == 200
+        assert payload['recommendations'] == [[title, rating] for (title, rating)
+                                              in recommender.recommend(user)]
+    assert status == 200
+    assert stats['knn']['requests'] == 20
+    assert stats['knn']['errors'] == 0
+    #Twenty requests at once fill two batches of eight and leave four.
+    assert stats['knn']['batches'] == 3
+    assert stats['knn']['meanBatchSize'] == pytest.approx(20 / 3)
+    assert stats['knn']['p50'] is not None and stats['knn']['p99'] >= stats['knn']['p50']
+
+def test_slope_one_requests_match_single_calls(recommender):
+    users = recommender.data.users[:10]
+    async def requests(client):
+        return await asyncio.gather(*[client.slopeOne(recommender.data[user])
+                                      for user in users])
+    responses = serve(recommender, requests, maxLatency=0.5)
+    for (user, (status, payload)) in zip(users, responses):
+        assert status == 200
+        expected = recommender.weightedSlopeOne(recommender.data[user])
+        assert [title for (title, rating) in payload['recommendations']] == \
+            [title for (title, rating) in expected]
+        assert [rating for (title, rating) in payload['recommendations']] == \
+            pytest.approx([rating for (title, rating) in expected])
+
+def test_unknown_user_is_not_found(recommender):
+    async def requests(client):
+        responses = await asyncio.gather(client.knn('nobody'),
+                                         client.knn(recommender.data.users[0]),
+                                         client.request('GET', '/knn'),
+                                         client.request('GET', '/nothing'))
+        return responses, await client.stats()
+    ((unknown, known, missing, endpoint), (status, stats)) = serve(recommender, requests)
+    assert unknown[0] == 404 and 'nobody' in unknown[1]['error']
+    assert known[0] == 200
+    assert missing[0] == 400
+    assert endpoint[0] == 404
+    assert stats['knn']['requests'] == 3
+    assert stats['knn']['errors'] == 2
+
+def test_http_connection_is_closed_after_the_last_response(recommender):
+    user = recommender.data.users[0]
+    async def run():
+        server = RecommendationServer(recommender)
+        listening = await server.start(port=0)
+        port = listening.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /knn?user=' + user.encode() + b' HTTP/1.1\r\n\r\n'
+                         b'GET /stats HTTP/1.1\r\nConnection: close\r\n\r\n')
+            await writer.drain()
+            #The server closes its end once the second response is sent.
+            received = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            await writer.wait_closed()
+            return received
+        finally:
+            await server.close()
+            server.executor.shutdown()
+    received = asyncio.run(run())
+    (first, second) = received.split(b'HTTP/1.1 ')[1:]
+    assert first.startswith(b'200 ') and b'Connection: keep-alive' in first
+    assert json.loads(first.split(b'\r\n\r\n', 1)[1])['recommendations'] == \
+        [[title, rating] for (title, rating) in recommender.recommend(user)]
+    assert second.startswith(b'200 ') and b'Connection: close' in second
+    assert json.loads(second.split(b'\r\n\r\n', 1)[1])['knn']['requests'] == 1
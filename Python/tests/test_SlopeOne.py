@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import tracemalloc
+import numpy as np
+import pytest
+from Benchmark import syntheticRatings
+from RatingMatrix import RatingMatrix
+from Recommender import Recommender
+from SlopeOne import SlopeOneModel
+
+def polarRatings(numUsers):
+    '''Every user rates item a 5 and item b 1, the sums are 4 * numUsers'''
+    userIDs = np.repeat(np.arange(numUsers), 2)
+    itemIDs = np.tile([0, 1], numUsers)
+    ratings = np.tile([5.0, 1.0], numUsers)
+    return RatingMatrix.fromTriplets(['u' + str(user) for user in range(numUsers)],
+                                     ['a', 'b'], userIDs, itemIDs, ratings)
+
+def test_float16_only_for_sums_it_holds_exactly():
+    budget = 100 * 100 * 4
+    assert SlopeOneModel.storageFor(100, 500, budget, 2048) == ('float16', 'uint16')
+    with pytest.raises(ValueError):
+        SlopeOneModel.storageFor(100, 500, budget, 2049)
+    assert SlopeOneModel.storageFor(100, 500, 100 * 100 * 6, 2049) == ('float32', 'uint16')
+
+def test_float16_deviation_sums_are_checked():
+    small = syntheticRatings(100, 30, 0.3)
+    exact = SlopeOneModel.fromRatings(small)
+    model = SlopeOneModel.fromRatings(small, deviationDtype='float16', frequencyDtype='uint16')
+    np.testing.assert_array_equal(model.deviationSums, exact.deviationSums)
+    #Sums past 2048 would be rounded in float16.
+    assert SlopeOneModel.fromRatings(polarRatings(512), deviationDtype='float16') is not None
+    with pytest.raises(ValueError):
+        SlopeOneModel.fromRatings(polarRatings(513), deviationDtype='float16')
+
+def test_max_memory_skips_float16_for_large_sums():
+    r = Recommender(polarRatings(513))
+    r.computeDeviations(max_memory=2 * 2 * 6)
+    assert r.slopeOne.deviationSums.dtype == np.float32
+    small = Recommender(syntheticRatings(100, 30, 0.3))
+    small.computeDeviations(max_memory=30 * 30 * 4)
+    assert small.slopeOne.deviationSums.dtype == np.float16
+
+def test_row_blocks_match_one_block_and_bound_the_peak():
+    ratings = syntheticRatings(300, 1500, 0.02)
+    whole = SlopeOneModel.fromRatings(ratings, itemBlockSize=1500)
+    tracemalloc.start()
+    try:
+        model = SlopeOneModel.fromRatings(ratings, deviationDtype='float16',
+                                          frequencyDtype='uint16', itemBlockSize=100)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    np.testing.assert_array_equal(model.deviationSums, whole.deviationSums)
+    np.testing.assert_array_equal(model.frequencies, whole.frequencies)
+    #Less than the float64 arrays the narrow model used to be cast from.
+    assert peak < 1500 * 1500 * 16
+
+def test_rating_changes_widen_counts_and_sums_past_their_dtype():
+    r = Recommender(polarRatings(255))
+    r.computeDeviations(deviationDtype='float16', frequencyDtype='uint8')
+    r.add_rating('u255', 'a', 5.0)
+    r.add_rating('u255', 'b', 1.0)
+    #255 + 1 does not fit in uint8.
+    assert r.slopeOne.frequencies.dtype == np.uint16
+    assert r.slopeOne.frequencies[0, 1] == 256
+    model = SlopeOneModel(np.array([[0.0, 2048.0], [-2048.0, 0.0]], dtype=np.float16),
+                          np.array([[0, 512], [512, 0]], dtype=np.uint16))
+    model.addRating(np.array([1]), np.array([1.0]), 0, 5.0)
+    #2052 is not a float16.
+    assert model.deviationSums.dtype == np.float32
+    assert model.deviationSums[0, 1] == 2052.0 and model.deviationSums[1, 0] == -2052.0
+    assert model.frequencies[0, 1] == 513
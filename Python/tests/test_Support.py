@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import tracemalloc
+import numpy as np
+import pytest
+import Support
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+from Support import SupportCounts
+
+def bruteCounts(ratings):
+    '''(users x users, items x items) counts from a dense 0/1 matrix'''
+    rated = np.zeros((ratings.numUsers, ratings.numItems), dtype=np.int64)
+    for user in range(ratings.numUsers):
+        rated[user, ratings.userRow(user)[0]] = 1
+    users = rated @ rated.T
+    items = rated.T @ rated
+    np.fill_diagonal(users, 0)
+    np.fill_diagonal(items, 0)
+    return users, items
+
+def assertCounts(support, expected, minCount):
+    for i in range(len(expected)):
+        ids, counts = support.row(i)
+        wanted = np.flatnonzero(expected[i] >= minCount)
+        np.testing.assert_array_equal(ids, wanted)
+        np.testing.assert_array_equal(counts, expected[i, wanted])
+
+@pytest.mark.parametrize('density', [0.01, 0.2])
+@pytest.mark.parametrize('minCount', [1, 3])
+def test_counts_match_brute_force(monkeypatch, density, minCount):
+    #Small blocks so the counts are built over many of them.
+    monkeypatch.setattr(Support, 'BLOCK_CELLS', 5000)
+    monkeypatch.setattr(Support, 'BLOCK_PAIRS', 5000)
+    ratings = syntheticRatings(200, 300, density)
+    users, items = bruteCounts(ratings)
+    userSupport = SupportCounts.users(ratings, minCount)
+    itemSupport = SupportCounts.items(ratings, minCount)
+    assertCounts(userSupport, users, minCount)
+    assertCounts(itemSupport, items, minCount)
+    assert userSupport.dtype == np.uint16
+    #Sparse data keeps sparse rows, dense data a matrix.
+    assert (userSupport.matrix is None) == (density < 0.1)
+
+@pytest.mark.parametrize('density', [0.01, 0.2])
+def test_counts_follow_rating_changes(density):
+    r = Recommender(syntheticRatings(150, 200, density), 5, 'pearson', 10)
+    r.computeSupport(2)
+    rng = np.random.default_rng(1)
+    events = []
+    for event in range(300):
+        user = int(rng.integers(r.data.numUsers + 3))
+        item = int(rng.integers(r.data.numItems))
+        rating = None if rng.integers(3) == 0 else float(rng.integers(1, 6))
+        events.append(('u' + str(user), 'i' + str(item), rating))
+    r.apply_updates(events)
+    users, items = bruteCounts(r.data)
+    assertCounts(r.userSupport, users, 2)
+    assertCounts(r.itemSupport, items, 2)
+    r.userSupport.compact()
+    assertCounts(r.userSupport, users, 2)
+
+def test_peak_memory_is_bounded():
+    ratings = syntheticRatings(4000, 2000, 0.02)
+    ratings.csc
+    tracemalloc.start()
+    try:
+        support = SupportCounts.users(ratings)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    denseBytes = ratings.numUsers**2 * 2
+    assert support.nbytes <= denseBytes
+    assert peak < 2 * denseBytes + (64 << 20)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+@author: johnjoegarza
+"""
+import numpy as np
+import pytest
+from Benchmark import syntheticRatings
+from Recommender import Recommender
+from TopN import selectTop, topN
+
+def sortedTop(scores, n, decimals, tieOrder):
+    '''topN the slow way: round every score and sort the whole list'''
+    ids = [i for i in range(len(scores)) if not np.isnan(scores[i])]
+    values = {i: float(scores[i]) if decimals is None else round(float(scores[i]), decimals)
+              for i in ids}
+    keys = {i: 0 if tieOrder is None else tieOrder[i] for i in ids}
+    ids.sort(key=lambda i: (-values[i], keys[i], i))
+    ids = ids[:n]
+    return ids, [values[i] for i in ids]
+
+@pytest.mark.parametrize('decimals', [None, 0, 1, 2])
+@pytest.mark.parametrize('n', [0, 1, 5, 40, None])
+def test_top_n_matches_a_full_sort(decimals, n):
+    rng = np.random.default_rng(7)
+    for trial in range(20):
+        #Few distinct values and small noise give ties before and after rounding.
+        scores = rng.integers(0, 12, 60) / 4.0 + rng.choice([0.0, 0.004, -0.004, 0.05], 60)
+        scores[rng.random(60) < 0.2] = np.nan
+        tieOrder = rng.integers(0, 5, 60)
+        for order in (None, tieOrder, lambda ids: tieOrder[ids]):
+            ids, values = topN(scores, n, decimals, order)
+            expected = sortedTop(scores, n, decimals, None if order is None else tieOrder)
+            assert (ids.tolist(), values) == expected
+
+def test_select_top_matches_a_stable_sort():
+    rng = np.random.default_rng(3)
+    scores = rng.integers(0, 6, 50).astype(np.float64)
+    for largest in (True, False):
+        order = np.argsort(-scores if largest else scores, kind='stable')
+        for k in (None, 0, 1, 7, 50, 80):
+            expected = order if k is None else order[:k]
+            np.testing.assert_array_equal(selectTop(scores, k, largest), expected)
+
+def test_recommend_filters_equal_filtering_afterwards():
+    r = Recommender(syntheticRatings(60, 40, 0.3), 3, 'pearson', None)
+    limited = Recommender(r.data, 3, 'pearson', 5)
+    checked = 0
+    for user in r.data.users:
+        nearest = r.computeNearestNeighbors([user], r.k)[0]
+        if sum(distance for (name, distance) in nearest[:r.k]) == 0:
+            continue
+        scores, support = r._knnScores(user, nearest)[:2]
+        score = dict(zip(r.data.items, scores))
+        count = dict(zip(r.data.items, support))
+        everything = r.recommend(user)
+        exclude = [name for (name, value) in everything[::3]]
+        filters = [({'exclude': exclude}, lambda name: name not in exclude),
+                   ({'min_support': 2}, lambda name: count[name] >= 2),
+                   ({'min_rating': 3.2}, lambda name: score[name] >= 3.2),
+                   ({'exclude': exclude, 'min_support': 2, 'min_rating': 3.2},
+                    lambda name: name not in exclude and count[name] >= 2
+                    and score[name] >= 3.2)]
+        for (options, keep) in filters:
+            expected = [(name, value) for (name, value) in everything if keep(name)]
+            assert r.recommend(user, **options) == expected
+            assert limited.recommend(user, **options) == expected[:5]
+        checked += 1
+    assert checked > 40